@@ -0,0 +1,107 @@
+import time
+import asyncio
+from concurrent.futures import Future
+from collections import Counter
+from contextlib import asynccontextmanager
+from fastapi import HTTPException
+
+
+class Slot:
+    """
+    Inference slot granted by 'AdmissionController.admit'. Work submitted to a thread pool keeps running when
+    the request is cancelled or times out : the slot is then only released when the held future completes.
+    """
+
+    def __init__(self):
+        self.future = None
+
+    def hold(self, future: Future):
+        """Keep the slot until 'future' (pool work running for the request) completes"""
+        self.future = future
+
+
+class AdmissionController:
+    """
+    Bound the number of predictions running at the same time and fail fast instead of queuing without limit :
+        - at most 'max_in_flight' predictions run concurrently
+        - at most 'max_queue' requests wait for a slot, the next ones are rejected (429)
+        - a request waiting past its deadline, or whose deadline is already expired when it gets a slot,
+          is rejected (503) without running the inference
+        - a slot is released when the inference held by the request completes, not when the request gives up
+    """
+
+    def __init__(self, max_in_flight: int = 4, max_queue: int = 32, retry_after_s: int = 1):
+        self.max_in_flight  = max_in_flight
+        self.max_queue      = max_queue
+        self.retry_after_s  = retry_after_s
+        self.in_flight      = 0
+        self.waiting        = 0
+        self.stats          = Counter()
+        self._slots         = asyncio.Semaphore(max_in_flight)
+
+    def is_saturated(self) -> bool:
+        """True if a new request would have to wait for a slot"""
+        return self.in_flight + self.waiting >= self.max_in_flight
+
+    def reject(self, status_code: int, reason: str):
+        self.stats[f"shed_{reason}"] += 1
+        raise HTTPException(status_code=status_code, detail=f"Request rejected : {reason.replace('_', ' ')}",
+                            headers={"Retry-After": str(self.retry_after_s)})
+
+    @asynccontextmanager
+    async def admit(self, deadline: float):
+        """
+        Wait for an inference slot until the deadline (time.monotonic() based).
+
+        Args:
+            deadline (float) : time after which the result is no longer useful to the client
+
+        Yields:
+            Slot : slot of the request (see 'Slot.hold')
+        """
+        if time.monotonic() >= deadline:
+            self.reject(503, "deadline_expired")
+        if self.is_saturated() and self.waiting >= self.max_queue:
+            self.reject(429, "queue_full")
+
+        if self.is_saturated():
+            self.stats["queued"] += 1
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=deadline - time.monotonic())
+        except asyncio.TimeoutError:
+            self.reject(503, "deadline_expired")
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+        slot = Slot()
+        try:
+            # deadline may have passed while waiting for the slot : skip the inference
+            if time.monotonic() >= deadline:
+                self.reject(503, "deadline_expired")
+            self.stats["admitted"] += 1
+            yield slot
+        finally:
+            if slot.future is not None and not slot.future.done():
+                # request cancelled / timed out while its inference is still running in the pool
+                self.stats["released_late"] += 1
+                loop = asyncio.get_running_loop()
+                slot.future.add_done_callback(lambda _: loop.call_soon_threadsafe(self.release))
+            else:
+                self.release()
+
+    def release(self):
+        """Give back a slot (event loop thread only)"""
+        self.in_flight -= 1
+        self._slots.release()
+
+    def report(self) -> dict:
+        """Current state and counters of the admission control"""
+        return {
+            "in_flight":        self.in_flight,
+            "waiting":          self.waiting,
+            "max_in_flight":    self.max_in_flight,
+            "max_queue":        self.max_queue,
+            **self.stats,
+        }
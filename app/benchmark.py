@@ -0,0 +1,115 @@
+import json
+import time
+import argparse
+import threading
+import urllib.request
+import urllib.error
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# -- internal
+from src.utils.FileManager import FileManager
+
+DEGRADED_HEADER = "X-Degraded"      # answered by the baseline fallback (see 'api.degraded_mode')
+
+REVIEW = ("I went in with low expectations but the acting was superb, the pacing was tight and the ending "
+          "genuinely surprised me. One of the best films I have seen this year, I will watch it again. ") * 8
+
+
+def timed_request(url: str, payload: dict = None, timeout: float = 30.0):
+    """
+    Send a request (POST if a payload is provided, GET otherwise) and measure its latency.
+
+    Returns:
+        float   : latency in ms
+        int     : HTTP status code
+        bool    : answered by the degraded (baseline) path
+    """
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            resp.read()
+            status = resp.status
+            degraded = resp.headers.get(DEGRADED_HEADER) is not None
+    except urllib.error.HTTPError as e:
+        status, degraded = e.code, False
+    return (time.perf_counter() - start) * 1e3, status, degraded
+
+
+def probe_latencies(url: str, duration_s: float, interval_s: float = 0.02):
+    """Call a (trivial) endpoint in a loop for 'duration_s' seconds and return its latencies in ms"""
+    latencies = []
+    end = time.perf_counter() + duration_s
+    while time.perf_counter() < end:
+        latencies.append(timed_request(url)[0])
+        time.sleep(interval_s)
+    return np.array(latencies)
+
+
+def percentiles(latencies: np.ndarray) -> dict:
+    if len(latencies) == 0:
+        return {}
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {"n": int(len(latencies)), "p50_ms": round(float(p50), 2), "p95_ms": round(float(p95), 2),
+            "p99_ms": round(float(p99), 2), "max_ms": round(float(latencies.max()), 2)}
+
+
+def benchmark(host: str, concurrency: int, duration_s: float):
+    """
+    Measure the latency of 'GET /health' alone, then while 'concurrency' clients send '/predict' requests in a loop.
+    With the forward passes running off the event loop, the health check tail latency must stay flat.
+    The '/predict' latencies of the LoRA path, of the degraded (baseline) answers and of the rejected requests
+    (429 / 503) are reported separately.
+    """
+    health_url, predict_url = f"{host}/health", f"{host}/predict"
+
+    # warm up (model loading) so it is not accounted in the measures
+    timed_request(predict_url, {"text": REVIEW}, timeout=300)
+
+    idle = probe_latencies(health_url, duration_s)
+
+    # run predictions in the background while probing the health endpoint
+    stop = threading.Event()
+    predict_results = []
+    def predict_loop():
+        while not stop.is_set():
+            predict_results.append(timed_request(predict_url, {"text": REVIEW}))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(predict_loop)
+        loaded = probe_latencies(health_url, duration_s)
+        stop.set()
+
+    statuses = {}
+    for _, status, _ in predict_results:
+        statuses[status] = statuses.get(status, 0) + 1
+    lora = np.array([lat for lat, status, degraded in predict_results if status == 200 and not degraded])
+    degraded = np.array([lat for lat, status, degraded in predict_results if status == 200 and degraded])
+    rejected = np.array([lat for lat, status, _ in predict_results if status in (429, 503)])
+
+    return {
+        "concurrency":          concurrency,
+        "health_idle":          percentiles(idle),
+        "health_under_load":    percentiles(loaded),
+        "predict":              {**percentiles(lora), "statuses": statuses},
+        "predict_degraded":     percentiles(degraded),
+        "predict_rejected":     percentiles(rejected),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser("Concurrency benchmark of the API : latency of a trivial endpoint (/health) while predictions run. The API must be running (start_api).")
+    ap.add_argument("--host",           type=str,   default="http://127.0.0.1:8000",    help="Base url of the running API")
+    ap.add_argument("--concurrency",    type=int,   default=None,                       help="Number of clients sending predictions in parallel (default: configs 'api.max_in_flight', so that the LoRA path is measured, not the degraded one)")
+    ap.add_argument("--duration",       type=float, default=10.0,                       help="Duration (s) of each measure")
+    args = ap.parse_args()
+
+    concurrency = args.concurrency or FileManager.load_config().get("api", {}).get("max_in_flight", 4)
+    print(json.dumps(benchmark(args.host, concurrency, args.duration), indent=2))
+
+
+if __name__ == "__main__":
+    main()
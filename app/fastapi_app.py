@@ -1,33 +1,330 @@
-from fastapi import FastAPI
-from pydantic import BaseModel, Field, validator
+import os
+import time
+import uuid
+import asyncio
+import contextvars
+import base64
+import binascii
+import threading
+import warnings
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Literal, Optional
+from fastapi import FastAPI, HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field, root_validator, validator
+import numpy as np
 import torch
 import uvicorn
+from transformers import AutoConfig
 
 # -- internal
-from src.utils.utils import LABELS, LABEL_NEGATIVE, LABEL_POSITIVE
+from src.utils.utils import LABELS, LABEL_NEGATIVE, LABEL_POSITIVE, init_logging
 from src.utils.FileManager import FileManager
+from src.utils.ErrorHandler import ErrorHandler
 from src.utils.enums import EModelType
+from src.data.feedback import FeedbackLog
+from src.prediction.similarity import IVFIndex
+from src.utils.prediction_methods import embed_lora, explain_lora_occlusion, compile_lora, delegate_predict_fn, predict_proba_baseline, predict_proba_lora_ids, truncate_input_ids
+from app.responses import build_predictions_response
+from app.admission import AdmissionController, Slot
+
+REQUEST_ID_HEADER = "X-Request-ID"
+TIMEOUT_HEADER    = "X-Request-Timeout-Ms"      # per-request time budget (overrides configs 'api.timeout_ms')
+DEGRADED_HEADER   = "X-Degraded"
+# dtypes accepted for base64 encoded token ids (little-endian buffers)
+IDS_DTYPES = {"int32": np.dtype("<i4"), "uint16": np.dtype("<u2")}
+
+# decoded base64 buffers are read-only 'bytes' shared with torch without a copy (the model never writes in its
+# inputs) : the warning is only muted for the calls of this module, registered once (no thread-unsafe catch_warnings)
+warnings.filterwarnings("ignore", message="The given NumPy array is not writable", category=UserWarning, module=__name__)
 
 app = FastAPI(title="IMDB Sentiment API")
 
+cfg_api = FileManager.load_config().get("api", {})
+cfg_similarity = FileManager.load_config().get("similarity", {"index": "imdb", "nprobe": 8})
+cfg_explain = FileManager.load_config().get("explain", {"max_variants": 32, "max_chars": 5000})
+feedback_log = FeedbackLog(FileManager.get_feedback_file(), fsync=cfg_api.get("feedback_fsync", False))
+admission = AdmissionController(max_in_flight=cfg_api.get("max_in_flight", 4), max_queue=cfg_api.get("max_queue", 32), 
+                                retry_after_s=cfg_api.get("retry_after_s", 1))
+
+# dedicated pool running the model forward passes off the event loop. Each worker uses 'torch_threads' intra-op
+# threads : workers x torch_threads is kept <= number of cores to avoid oversubscription
+inference_workers = cfg_api.get("inference_workers") or admission.max_in_flight
+torch_threads = cfg_api.get("torch_threads") or max(1, (os.cpu_count() or 1) // inference_workers)
+torch.set_num_threads(torch_threads)
+inference_executor = ThreadPoolExecutor(max_workers=inference_workers, thread_name_prefix="inference")
+
+
+async def run_inference(fn, *args, slot: Slot = None):
+    """
+    Run a blocking (model loading / forward pass) method in the inference pool and wait for its result. The
+    method runs in a copy of the caller's context, so that its logs keep the request id. The admission 'slot'
+    of the request is held until the method completes, even if the request is cancelled meanwhile.
+    """
+    ctx = contextvars.copy_context()
+    future = inference_executor.submit(ctx.run, guard_exit, fn, *args)
+    if slot is not None:
+        slot.hold(future)
+    return await asyncio.wrap_future(future)
+
+
+def guard_exit(fn, *args):
+    """
+    Run a method of the inference pool, turning the SystemExit of 'ErrorHandler.fatal' (missing model or file,
+    already logged) into a failure of the request : it must not stop the server.
+    """
+    try:
+        return fn(*args)
+    except SystemExit:
+        raise HTTPException(status_code=500, detail="Model or resource unavailable (see logs)")
+
+
+@app.on_event("startup")
+def init_api_logging():
+    init_logging()
+    ErrorHandler.init("api")
+    ErrorHandler.log(f"Inference pool : {inference_workers} workers x {torch_threads} torch threads")
+    # compiled inference : buckets of the latest model are compiled and warmed before the first request
+    if cfg_api.get("compiled", False):
+        model_id = FileManager.get_last_model_id(EModelType.LORA)
+        if model_id:
+            get_compiled(model_id)
+
+
+@app.on_event("shutdown")
+def stop_inference_executor():
+    inference_executor.shutdown(wait=False, cancel_futures=True)
+
+
+@app.middleware("http")
+async def correlation_id(request: Request, call_next):
+    """Attach a correlation id (provided by the client or generated) to every log emitted while handling the request"""
+    request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+    token = ErrorHandler.set_request_id(request_id)
+    request.state.arrival = time.monotonic()
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        ErrorHandler.reset_request_id(token)
+    response.headers[REQUEST_ID_HEADER] = request_id
+    ErrorHandler.sample("request", request_id=request_id, path=request.url.path, 
+                        status=response.status_code, latency_ms=round((time.perf_counter() - start) * 1e3, 3))
+    return response
+
+
+def get_deadline(request: Request) -> float:
+    """Time (time.monotonic() based) after which the response is no longer useful to the client"""
+    timeout_ms = request.headers.get(TIMEOUT_HEADER)
+    try:
+        timeout_ms = float(timeout_ms) if timeout_ms else cfg_api.get("timeout_ms", 2000)
+    except ValueError:
+        raise HTTPException(status_code=422, detail=f"Invalid '{TIMEOUT_HEADER}' header : {timeout_ms}")
+    return getattr(request.state, "arrival", time.monotonic()) + timeout_ms / 1e3
+
+
+@lru_cache(maxsize=8)
+def get_vocab_size(model_id: str) -> int:
+    """Vocabulary size of a LoRA model, read from its config (no weights loaded) to validate token ids"""
+    return AutoConfig.from_pretrained(FileManager.get_model_path(EModelType.LORA, model_id=model_id)).vocab_size
+
+
+def validate_token_ids(sequences: list, model_id: str):
+    """Make sure that JSON token ids are in the vocabulary of the model (out of range ids are a 422, not a 500)"""
+    vocab_size = get_vocab_size(model_id)
+    for ids in sequences:
+        if ids and (min(ids) < 0 or max(ids) >= vocab_size):
+            raise ValueError(f"Token ids must be in [0, {vocab_size})")
+
+
+@lru_cache(maxsize=2)
+def get_lora(model_id: str):
+    """Load (once) a LoRA model and its tokenizer"""
+    return FileManager.load_lora(model_id=model_id, allow_gpu=False, mmap_weights=cfg_api.get("mmap_weights", False))
+
+
+@lru_cache(maxsize=2)
+def load_compiled(model_id: str):
+    """Compile (once) a LoRA model for static-shape inference, every bucket warmed up (configs 'api.compiled')"""
+    model, tokenizer = get_lora(model_id)
+    return compile_lora(model, tokenizer, batch_size=max(FileManager.load_config()["compiled"]["batch_buckets"]))
+
+
+compile_locks = {}
+
+def get_compiled(model_id: str):
+    """Compiled model of a LoRA : concurrent first calls wait for a single compilation (lru_cache does not lock)"""
+    with compile_locks.setdefault(model_id, threading.Lock()):
+        return load_compiled(model_id)
+
+
+@lru_cache(maxsize=2)
+def get_similarity_index(model_id: str, name: str):
+    """Open (once) a similarity index : its embeddings are memory-mapped, not loaded"""
+    # resolved by hand : the FileManager getter creates the directory or exits when it is missing
+    path = os.path.join(FileManager.get_model_path(EModelType.LORA, model_id=model_id), FileManager.EMBEDDINGS_DIR, name)
+    if not os.path.isdir(path):
+        raise HTTPException(status_code=404, detail=f"No similarity index '{name}' for model id {model_id}")
+    return IVFIndex(path)
+
+
+@lru_cache(maxsize=2)
+def load_baseline(model_id: str):
+    """Load (once) a baseline model"""
+    return FileManager.load_model(EModelType.BASELINE, model_id=model_id)
+
+
+def get_baseline():
+    """
+    Most recent baseline model, used as fallback when the LoRA path is saturated. Newly published baselines
+    (see 'update_baseline') are picked up without restarting the API
+    """
+    model_id = FileManager.get_last_model_id(EModelType.BASELINE)
+    if not model_id:
+        return None
+    return load_baseline(model_id)
+
+
+@lru_cache(maxsize=4)
+def get_predict_fn(model_type: EModelType, model_id: str):
+    """Load (once) the prediction method of any other type of model (student, ...)"""
+    return delegate_predict_fn(model_type=model_type, model_id=model_id)
+
+
+def validate_model_id(v, model_type: EModelType = EModelType.LORA):
+    """Make sure that the 'model_id' parameter is valid"""
+    # default value - take latest model existing
+    if not v or v == "latest":
+        v = FileManager.get_last_model_id(model_type)
+    
+    # check if model exists
+    if not FileManager.check_model_exists(model_type=model_type, model_id=v):
+        raise ValueError(f"Model id '{v}' does not exist")
+    
+    return v
+
+
 class Inp(BaseModel):
-    text:       str
-    model_id:   str = Field(default="latest", description="Model identifier (or 'latest' for most recent model)")
+    text:           Optional[str]       = Field(default=None, description="Raw text of the review")
+    input_ids:      Optional[List[int]] = Field(default=None, description="Token ids of the review (already tokenized with the model's vocabulary)")
+    input_ids_b64:  Optional[str]       = Field(default=None, description="Token ids as a base64 encoded little-endian buffer (see 'ids_dtype')")
+    ids_dtype:      Literal["int32", "uint16"] = Field(default="int32", description="Dtype of the 'input_ids_b64' buffer")
+    model_type:     EModelType          = Field(default=EModelType.LORA, description="Type of model used for the prediction (lora, student, ...)")
+    model_id:       str                 = Field(default="latest", description="Model identifier (or 'latest' for most recent model)")
     
+    @validator("model_id", pre=True, always=True)
+    def validate_model_id(cls, v, values):
+        return validate_model_id(v, values.get("model_type", EModelType.LORA))
+
+    @root_validator(skip_on_failure=True)
+    def validate_input(cls, values):
+        """Make sure that exactly one kind of input is provided"""
+        n_inputs = sum(values.get(k) is not None for k in ("text", "input_ids", "input_ids_b64"))
+        if n_inputs != 1:
+            raise ValueError("Exactly one of 'text', 'input_ids' or 'input_ids_b64' must be provided")
+        if values.get("text") is None and values.get("model_type") != EModelType.LORA:
+            raise ValueError("Token ids inputs are only supported by 'lora' models")
+        if values.get("input_ids") is not None:
+            validate_token_ids([values["input_ids"]], values["model_id"])
+        return values
+
+
+class BatchInp(BaseModel):
+    input_ids:      Optional[List[List[int]]]   = Field(default=None, min_items=1, max_items=cfg_api.get("max_batch_size", 256), description="Token ids of each review")
+    input_ids_b64:  Optional[List[str]]         = Field(default=None, min_items=1, max_items=cfg_api.get("max_batch_size", 256), description="Token ids of each review as base64 encoded little-endian buffers")
+    ids_dtype:      Literal["int32", "uint16"]  = Field(default="int32", description="Dtype of the 'input_ids_b64' buffers")
+    model_id:       str                         = Field(default="latest", description="Model identifier (or 'latest' for most recent model)")
+
     @validator("model_id", pre=True, always=True)
     def validate_model_id(cls, v):
-        """Make sure that the 'model_id' parameter is valid"""
-        # default value - take latest model existing
-        if not v or v == "latest":
-            v = FileManager.get_last_model_id(EModelType.LORA)
-        
-        # check if model exists
-        if not FileManager.check_model_exists(model_type=EModelType.LORA, model_id=v):
-            raise ValueError(f"Model id '{v}' does not exist")
-        
+        return validate_model_id(v)
+
+    @root_validator(skip_on_failure=True)
+    def validate_input(cls, values):
+        """Make sure that exactly one kind of input is provided"""
+        if (values.get("input_ids") is None) == (values.get("input_ids_b64") is None):
+            raise ValueError("Exactly one of 'input_ids' or 'input_ids_b64' must be provided")
+        if values.get("input_ids") is not None:
+            validate_token_ids(values["input_ids"], values["model_id"])
+        return values
+    
+
+class SimilarInp(BaseModel):
+    text:           str                 = Field(..., min_length=1, description="Raw text of the review")
+    k:              int                 = Field(default=10, ge=1, le=1000, description="Number of similar reviews")
+    nprobe:         Optional[int]       = Field(default=None, ge=1, description="Clusters scanned (default: configs 'similarity.nprobe')")
+    index:          Optional[str]       = Field(default=None, description="Name of the index (default: configs 'similarity.index')")
+    return_text:    bool                = Field(default=True, description="Return the text of the similar reviews")
+    model_id:       str                 = Field(default="latest", description="Model identifier (or 'latest' for most recent model)")
+
+    @validator("model_id", pre=True, always=True)
+    def validate_model_id(cls, v):
+        return validate_model_id(v)
+
+    @validator("index")
+    def validate_index(cls, v):
+        """The index name is a directory name : no path separator, no parent directory"""
+        if v is not None and (not v or "/" in v or "\\" in v or ".." in v):
+            raise ValueError(f"Invalid index name '{v}'")
         return v
+
+
+class ExplainInp(BaseModel):
+    text:           str                 = Field(..., min_length=1, max_length=cfg_explain["max_chars"], description="Raw text of the review")
+    top_k:          Optional[int]       = Field(default=10, ge=1, description="Number of words returned (all words if null)")
+    model_id:       str                 = Field(default="latest", description="Model identifier (or 'latest' for most recent model)")
+
+    @validator("model_id", pre=True, always=True)
+    def validate_model_id(cls, v):
+        return validate_model_id(v)
+
+
+class FeedbackInp(BaseModel):
+    text:       str                 = Field(..., min_length=1, description="Raw text of the review")
+    label:      Literal["neg", "pos"] = Field(..., description="Label given by the moderator")
+    model_id:   Optional[str]       = Field(default=None, description="Model whose prediction is corrected (informative)")
     
 
+def decode_input_ids(input_ids: list = None, input_ids_b64: str = None, ids_dtype: str = "int32"):
+    """
+    Convert token ids received by the API into a 1D tensor. Base64 int32 buffers are shared with the 
+    tensor without any copy (uint16 buffers are widened to int32, torch has no uint16 indexing).
+    
+    Args:
+        input_ids (list[int])   : token ids as a JSON list
+        input_ids_b64 (str)     : token ids as a base64 encoded little-endian buffer
+        ids_dtype (str)         : dtype of the buffer ("int32" or "uint16")
+        
+    Returns:
+        torch.Tensor : 1D int32 tensor of token ids
+    """
+    if input_ids is not None:
+        return torch.tensor(input_ids, dtype=torch.int32)
+    
+    try:
+        buffer = base64.b64decode(input_ids_b64, validate=True)
+    except binascii.Error as e:
+        raise HTTPException(status_code=422, detail=f"Invalid base64 token ids : {e}")
+    
+    dtype = IDS_DTYPES[ids_dtype]
+    if len(buffer) % dtype.itemsize != 0:
+        raise HTTPException(status_code=422, detail=f"Token ids buffer size is not a multiple of {dtype.itemsize} bytes ({ids_dtype})")
+    
+    ids = np.frombuffer(buffer, dtype=dtype)
+    if ids.dtype != np.int32:
+        ids = ids.astype(np.int32)
+    return torch.from_numpy(ids)
+
+
+def check_input_ids(ids: torch.Tensor, config):
+    """Make sure that the token ids can be fed to the model (vocabulary size)"""
+    if ids.numel() == 0:
+        raise HTTPException(status_code=422, detail="Empty token ids")
+    if int(ids.min()) < 0 or int(ids.max()) >= config.vocab_size:
+        raise HTTPException(status_code=422, detail=f"Token ids must be in [0, {config.vocab_size})")
+
+
 def predict_probs(text, model, tokenizer):
     """
     Use a specific model and tokenizer to predict the probablility for the 
@@ -39,22 +336,140 @@ def predict_probs(text, model, tokenizer):
         tokenizer   : tokenizer of the model used to convert text into tokens
         
     Returns:   
-        list[float] : for each label, probability that the label is the right label
+        np.ndarray : array of shape (1, n_classes) - for each label, probability that the label is the right label
     """
     t = tokenizer(text, return_tensors="pt", truncation=True)
     with torch.no_grad():
         logits = model(**t).logits
-    return torch.softmax(logits, dim=-1).squeeze().tolist()
+    return torch.softmax(logits, dim=-1).numpy()
 
 
-@app.post("/predict")
-async def predict(inp: Inp):
-    model, tokenizer = FileManager.load_lora(model_id=inp.model_id, allow_gpu=False)
-    probs = predict_probs(inp.text, model, tokenizer)
+def format_prediction(probs):
+    """Format the probabilities of one item into the JSON response"""
     label = LABELS[max(range(len(probs)), key=lambda i: probs[i])]
     return {"label": label, "probs": {LABEL_NEGATIVE: probs[0], LABEL_POSITIVE: probs[1]}}
 
 
+def predict_item(inp: Inp):
+    """Blocking prediction of a single item (runs in the inference pool)"""
+    if inp.model_type != EModelType.LORA:
+        return get_predict_fn(inp.model_type, inp.model_id)([inp.text])
+    
+    model, tokenizer = get_lora(inp.model_id)
+    compiled = get_compiled(inp.model_id) if cfg_api.get("compiled", False) else None
+    if inp.text is not None:
+        if compiled is not None:
+            return compiled.predict_proba(tokenizer, [inp.text])
+        return predict_probs(inp.text, model, tokenizer)
+    
+    ids = decode_input_ids(inp.input_ids, inp.input_ids_b64, inp.ids_dtype)
+    check_input_ids(ids, model.config)
+    ids = truncate_input_ids(ids, tokenizer.model_max_length)
+    if compiled is not None:
+        return compiled.predict_proba_ids([ids])
+    return predict_proba_lora_ids(model, [ids], pad_token_id=tokenizer.pad_token_id)
+
+
+def predict_items(inp: BatchInp):
+    """Blocking prediction of a batch of items (runs in the inference pool)"""
+    if inp.input_ids is not None:
+        all_ids = [decode_input_ids(input_ids=item) for item in inp.input_ids]
+    else:
+        all_ids = [decode_input_ids(input_ids_b64=item, ids_dtype=inp.ids_dtype) for item in inp.input_ids_b64]
+    
+    model, tokenizer = get_lora(inp.model_id)
+    for ids in all_ids:
+        check_input_ids(ids, model.config)
+    all_ids = [truncate_input_ids(ids, tokenizer.model_max_length) for ids in all_ids]
+    if cfg_api.get("compiled", False):
+        return get_compiled(inp.model_id).predict_proba_ids(all_ids)
+    return predict_proba_lora_ids(model, all_ids, pad_token_id=tokenizer.pad_token_id)
+
+
+@app.post("/predict")
+async def predict(inp: Inp, request: Request):
+    deadline = get_deadline(request)
+
+    # degraded mode : LoRA path saturated -> answer right away with the (much cheaper) baseline
+    if inp.model_type == EModelType.LORA and inp.text is not None and cfg_api.get("degraded_mode", True) and admission.is_saturated():
+        if time.monotonic() >= deadline:
+            admission.reject(503, "deadline_expired")
+        baseline = await run_in_threadpool(guard_exit, get_baseline)
+        if baseline is not None:
+            admission.stats["degraded"] += 1
+            probs = await run_in_threadpool(guard_exit, predict_proba_baseline, baseline, [inp.text])
+            return build_predictions_response(request, probs, lambda p: format_prediction(p[0].tolist()), 
+                                              headers={DEGRADED_HEADER: EModelType.BASELINE.value})
+
+    async with admission.admit(deadline) as slot:
+        probs = await run_inference(predict_item, inp, slot=slot)
+    return build_predictions_response(request, probs, lambda p: format_prediction(p[0].tolist()))
+
+
+@app.post("/predict_batch")
+async def predict_batch(inp: BatchInp, request: Request):
+    deadline = get_deadline(request)
+    async with admission.admit(deadline) as slot:
+        probs = await run_inference(predict_items, inp, slot=slot)
+    return build_predictions_response(request, probs, lambda p: {"predictions": [format_prediction(row) for row in p.tolist()]})
+
+
+def find_similar(inp: SimilarInp):
+    """Embed the review and search its nearest neighbours in the index"""
+    model, tokenizer = get_lora(inp.model_id)
+    index = get_similarity_index(inp.model_id, inp.index or cfg_similarity["index"])
+    query = embed_lora(model, tokenizer, [inp.text])
+    rows, scores = index.search(query, k=inp.k, nprobe=inp.nprobe or cfg_similarity["nprobe"])
+    return [{"row": int(row), "score": float(score), **({"text": index.get_text(row)} if inp.return_text else {})}
+            for row, score in zip(rows[0], scores[0])]
+
+
+@app.post("/similar")
+async def similar(inp: SimilarInp, request: Request):
+    """Reviews most similar to a given one (cosine similarity of the pre-classifier vectors, approximate search)"""
+    deadline = get_deadline(request)
+    async with admission.admit(deadline) as slot:
+        neighbours = await run_inference(find_similar, inp, slot=slot)
+    return {"neighbours": neighbours}
+
+
+def explain_item(inp: ExplainInp):
+    """Word importances of the prediction of a review (occlusion, see 'explain_lora_occlusion')"""
+    model, tokenizer = get_lora(inp.model_id)
+    start = time.perf_counter()
+    probs, importances = explain_lora_occlusion(model, tokenizer, inp.text, max_variants=cfg_explain["max_variants"])
+    return {**format_prediction(probs.tolist()),
+            "importances": [{"word": word, "importance": weight} for word, weight in importances[:inp.top_k]],
+            "elapsed_ms": round((time.perf_counter() - start) * 1e3, 1)}
+
+
+@app.post("/explain")
+async def explain(inp: ExplainInp, request: Request):
+    """Fast explanation of a LoRA prediction : importance of each word toward 'pos' (drop of its probability when the word is hidden)"""
+    deadline = get_deadline(request)
+    async with admission.admit(deadline) as slot:
+        return await run_inference(explain_item, inp, slot=slot)
+
+
+@app.post("/feedback")
+async def feedback(inp: FeedbackInp):
+    """Append a labeled review to the feedback log (consumed by 'update_baseline')"""
+    await run_in_threadpool(feedback_log.append, inp.text, LABELS.index(inp.label), model_id=inp.model_id, 
+                            request_id=ErrorHandler.get_request_id())
+    return {"status": "accepted"}
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.get("/stats")
+async def stats():
+    """Admission control counters (queued / shed / degraded requests) and dropped log messages"""
+    return {"admission": admission.report(), "dropped_logs": ErrorHandler.dropped_count()}
+
+
 def main():
     uvicorn.run("app.fastapi_app:app", host="0.0.0.0", port=8000, reload=True)
 
@@ -0,0 +1,103 @@
+import struct
+import numpy as np
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse, Response
+
+try:
+    import msgpack
+except ImportError:     # optional dependency : pip install msgpack
+    msgpack = None
+
+# -- internal
+from src.utils.utils import LABELS
+
+# -- content types
+MEDIA_TYPE_JSON:        str = "application/json"
+MEDIA_TYPE_MSGPACK:     str = "application/x-msgpack"
+MEDIA_TYPE_BINARY:      str = "application/octet-stream"
+
+# -- raw binary format : header (magic, version, n_items, n_classes) + float32 probs + uint8 label indexes
+BINARY_MAGIC:           bytes = b"IMDP"
+BINARY_VERSION:         int = 1
+BINARY_HEADER:          struct.Struct = struct.Struct("<4sBIH")
+
+
+def negotiate_media_type(request: Request) -> str:
+    """
+    Select the response format from the 'Accept' header of the request (JSON by default).
+    """
+    accept = request.headers.get("accept", "")
+    if MEDIA_TYPE_MSGPACK in accept:
+        if msgpack is None:
+            raise HTTPException(status_code=406, detail="MessagePack responses require the 'msgpack' package")
+        return MEDIA_TYPE_MSGPACK
+    if MEDIA_TYPE_BINARY in accept:
+        return MEDIA_TYPE_BINARY
+    return MEDIA_TYPE_JSON
+
+
+def as_probs_matrix(probs: np.ndarray) -> np.ndarray:
+    """Contiguous little-endian float32 probabilities of shape (n_items, n_classes), also for an empty batch"""
+    return np.ascontiguousarray(probs, dtype="<f4").reshape(-1, len(LABELS))
+
+
+def encode_binary(probs: np.ndarray) -> bytes:
+    """
+    Encode predictions as : header | probs (n_items x n_classes float32, little-endian) | labels (n_items uint8)
+
+    Args:
+        probs (np.ndarray) : probabilities of shape (n_items, n_classes)
+    """
+    probs = as_probs_matrix(probs)
+    labels = probs.argmax(axis=1).astype(np.uint8)
+    header = BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, probs.shape[0], probs.shape[1])
+    return b"".join((header, probs.data, labels.data))
+
+
+def decode_binary(content: bytes):
+    """
+    Decode a response encoded with 'encode_binary' (client side helper)
+
+    Returns:
+        np.ndarray : probabilities (n_items, n_classes)
+        np.ndarray : label indexes (n_items,)
+    """
+    magic, version, n_items, n_classes = BINARY_HEADER.unpack_from(content)
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        raise ValueError(f"Unsupported binary predictions (magic={magic}, version={version})")
+    offset = BINARY_HEADER.size
+    probs = np.frombuffer(content, dtype="<f4", count=n_items * n_classes, offset=offset).reshape(n_items, n_classes)
+    labels = np.frombuffer(content, dtype=np.uint8, count=n_items, offset=offset + probs.nbytes)
+    return probs, labels
+
+
+def encode_msgpack(probs: np.ndarray) -> bytes:
+    """
+    Encode predictions as a MessagePack map. Probabilities are stored as a single float32 binary blob
+    (no per-element conversion) with their shape and the label names.
+    """
+    probs = as_probs_matrix(probs)
+    return msgpack.packb({
+        "labels":   LABELS,
+        "shape":    list(probs.shape),
+        "probs":    probs.tobytes(),
+        "label_ids": probs.argmax(axis=1).astype(np.uint8).tobytes(),
+    })
+
+
+def build_predictions_response(request: Request, probs: np.ndarray, format_json, headers: dict = None):
+    """
+    Build the response of a prediction endpoint in the format requested by the client.
+
+    Args:
+        request (Request)   : incoming request (used for content negotiation)
+        probs (np.ndarray)  : probabilities of shape (n_items, n_classes)
+        format_json         : method converting the probabilities into the JSON content
+        headers (dict)      : extra response headers
+    """
+    media_type = negotiate_media_type(request)
+    if media_type == MEDIA_TYPE_BINARY:
+        return Response(content=encode_binary(probs), media_type=MEDIA_TYPE_BINARY, headers=headers)
+    if media_type == MEDIA_TYPE_MSGPACK:
+        return Response(content=encode_msgpack(probs), media_type=MEDIA_TYPE_MSGPACK, headers=headers)
+    return JSONResponse(content=format_json(probs), headers=headers)
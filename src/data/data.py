@@ -1,4 +1,5 @@
 from re import U
+import numpy as np
 import pandas as pd
 import datasets
 from sklearn.model_selection import train_test_split
@@ -6,6 +7,8 @@ from src.utils.ErrorHandler import ErrorHandler
 
 # -- internal
 from src.utils.FileManager import FileManager
+from src.data.profiling import as_compiled_strings
+from src.data.dedup import MinHasher, LSHIndex
 
 
 # ===============================================================================================
@@ -46,13 +49,54 @@ def load_imdb(train_size=1.0, seed=None):
     return train, test
 
 
+def load_imdb_unlabeled(n_samples: int = None, seed=None):
+    """
+    Load the unlabeled reviews of the dataset "IMDB" ("unsupervised" split) as a DataFrame.
+    
+    Parameters:
+        n_samples : (int, optional)
+            Number of reviews randomly selected (all if "None")
+        
+        seed : (int, optional)
+            Seed determinist of the "random" selection. If "None", use cfg seed
+        
+    Returns:
+        pd.DataFrame : unlabeled reviews (column "text")
+    """
+    df = datasets.load_dataset("imdb", split="unsupervised").to_pandas()[["text"]]
+    df["text"] = (df["text"].str.replace("<br />", " ", regex=False)
+                            .str.replace("\n", " ", regex=False)
+                            .str.strip())
+    
+    if n_samples is not None and n_samples < len(df):
+        if seed == None:
+            seed = FileManager.load_config()["seed"]
+        df = df.sample(n=n_samples, random_state=seed)
+    
+    return df
+
+
 # ===============================================================================================
 # PREPARING
-def prepare_dataset(dataset_name: str, tokenizer, max_length: int):    
+def prepare_dataset(dataset_name: str, tokenizer, max_length: int, dedup: bool = False, val_ratio: float = 0.1, seed: int = None):
+    """
+    Tokenized training and validation sets. The validation set is carved out of the training split (stratified),
+    the testing split is kept for the final evaluation only (never used to select checkpoints).
+
+    Returns:
+        datasets.Dataset : training set
+        datasets.Dataset : validation set
+    """
     # load train / test dataframes
     if dataset_name == "imdb":
         train_df, test_df = load_imdb()
-        return tokenize_data(train_df, tokenizer, max_length), tokenize_data(train_df, tokenizer, max_length)
+        # drop near duplicates before tokenization (within train + train reviews overlapping the test set)
+        if dedup:
+            train_df, test_df, _ = deduplicate(train_df, test_df, drop=True, index_name=dataset_name)
+        if seed == None:
+            seed = FileManager.load_config()["seed"]
+        train_df, val_df = train_test_split(train_df, test_size=val_ratio, random_state=seed, stratify=train_df["label"])
+        return tokenize_data(train_df, tokenizer, max_length), tokenize_data(val_df, tokenizer, max_length)
     
     ErrorHandler.fatal("Unhandled dataset : " + dataset_name);
     
@@ -86,6 +130,120 @@ def tokenize_data(df: pd.DataFrame, tokenizer, max_length: int):
     return tokenized_ds
 
 
+# ===============================================================================================
+# DEDUPLICATING
+def get_dedup_tools(cfg_dedup: dict = None):
+    """Build the MinHash signer and an empty LSH index from the 'dedup' section of the config"""
+    if cfg_dedup is None:
+        cfg_dedup = FileManager.load_config()["dedup"]
+    hasher = MinHasher(num_perm=cfg_dedup["num_perm"], shingle_size=cfg_dedup["shingle_size"], seed=FileManager.load_config()["seed"])
+    index = LSHIndex(num_perm=cfg_dedup["num_perm"], bands=cfg_dedup["bands"], threshold=cfg_dedup["threshold"])
+    return hasher, index
+
+
+def deduplicate(train_df: pd.DataFrame, test_df: pd.DataFrame, drop: bool = True, index_name: str = None):
+    """
+    Detect near duplicate reviews (MinHash / LSH over word n-grams) inside the training set and between the
+    training and testing sets.
+    
+    Parameters:
+        train_df, test_df : (pd.DataFrame)
+            DataFrames containing a column "text"
+        
+        drop : (bool)
+            Remove the duplicated training reviews (later occurrences, and reviews overlapping the test set).
+            The testing set is never modified, so that scores stay comparable.
+        
+        index_name : (str, optional)
+            Persist the signatures of both sets (artifacts/dedup/<index_name>.npz) to check new data incrementally
+    
+    Returns:
+        pd.DataFrame : training set
+        pd.DataFrame : testing set
+        dict : report of the duplicates found
+    """
+    cfg_dedup = FileManager.load_config()["dedup"]
+    hasher, index = get_dedup_tools(cfg_dedup)
+    train_sig = hasher.signatures(train_df["text"], chunk_size=cfg_dedup["chunk_size"])
+    test_sig = hasher.signatures(test_df["text"], chunk_size=cfg_dedup["chunk_size"])
+
+    # duplicates inside each set (first occurrence kept)
+    train_dup = index.duplicates_within(train_sig)
+    test_dup = index.duplicates_within(test_sig)
+
+    # train / test overlap : test reviews queried against the indexed training reviews
+    index.add(train_sig, [f"train:{i}" for i in train_df.index])
+    test_rows, train_rows, _ = index.query(test_sig)
+    overlap = np.zeros(len(train_df), dtype=bool)
+    overlap[train_rows] = True
+
+    report = {
+        "threshold":                index.threshold,
+        "n_train":                  len(train_df),
+        "n_test":                   len(test_df),
+        "train_duplicates":         int(train_dup.sum()),
+        "test_duplicates":          int(test_dup.sum()),
+        "train_overlapping_test":   int(overlap.sum()),
+        "test_overlapping_train":   int(len(np.unique(test_rows))),
+    }
+    ErrorHandler.log(f"Near duplicates : {report}")
+
+    if index_name:
+        index.add(test_sig, [f"test:{i}" for i in test_df.index])
+        path = FileManager.get_dedup_index_path(index_name)
+        index.save(path)
+        FileManager.write_json(path.replace(".npz", "_report.json"), report)
+        ErrorHandler.log("Saved dedup index : " + path)
+
+    if drop:
+        train_df = train_df[~(train_dup | overlap)]
+        ErrorHandler.log(f"Dropped {report['n_train'] - len(train_df)} duplicated training reviews")
+    return train_df, test_df, report
+
+
+def find_indexed_duplicates(df: pd.DataFrame, index_name: str, add: bool = False):
+    """
+    Check new data incrementally against a persisted signature index (see 'deduplicate').
+    
+    Parameters:
+        df : (pd.DataFrame)
+            DataFrame containing a column "text"
+        
+        index_name : (str)
+            Name of the persisted index
+        
+        add : (bool)
+            Add the new (non duplicated) texts to the index and save it
+    
+    Returns:
+        pd.Series : key of the closest indexed text of each row ("" if no near duplicate), aligned on df
+    """
+    path = FileManager.get_dedup_index_path(index_name)
+    cfg_dedup = FileManager.load_config()["dedup"]
+    hasher, index = get_dedup_tools(cfg_dedup)
+    if FileManager.exists(path):
+        index = LSHIndex.load(path)
+    signatures = hasher.signatures(df["text"], chunk_size=cfg_dedup["chunk_size"])
+
+    rows, matches, similarity = index.query(signatures)
+    # best match of each row
+    order = np.lexsort((-similarity, rows))
+    rows, matches = rows[order], matches[order]
+    first = np.r_[True, rows[1:] != rows[:-1]] if len(rows) else np.empty(0, dtype=bool)
+    keys = np.full(len(df), "", dtype=object)
+    keys[rows[first]] = index.keys[matches[first]]
+
+    # duplicates inside the new data itself
+    within = index.duplicates_within(signatures)
+    ErrorHandler.log(f"{int((keys != '').sum())} / {len(df)} rows near-duplicate indexed texts, {int(within.sum())} duplicated inside the new data")
+
+    if add:
+        new = (keys == "") & ~within
+        index.add(signatures[new], [f"{index_name}:{i}" for i in df.index[new]])
+        index.save(path)
+    return pd.Series(keys, index=df.index, name="duplicate_of")
+
+
 # ===============================================================================================
 # TESTING & EVALUATING data
 def describe_dataset(df: pd.DataFrame):
@@ -107,7 +265,8 @@ def describe_dataset(df: pd.DataFrame):
             - n_tokens_p95 (float): 95th percentile of token counts 
               (useful for max sequence length).
     """
-    lengths = df["text"].str.split().apply(len)
+    # compiled regex count of the words : no per-review list of words (see src.data.profiling for large corpora)
+    lengths = as_compiled_strings(df["text"]).str.count(r"\S+").astype(np.int64)
     return {
         "n_samples":        len(df),
         "class_balance":    df["label"].value_counts(normalize=True).to_dict(),
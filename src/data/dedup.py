@@ -0,0 +1,164 @@
+import numpy as np
+import pandas as pd
+
+# -- internal
+from src.data.profiling import as_compiled_strings, hash_values
+
+MERSENNE_61:    int = (1 << 61) - 1
+
+
+class MinHasher:
+    """
+    Vectorized MinHash signatures of texts (sets of lower cased word n-grams), computed by chunks of documents :
+    every shingle of a chunk is hashed by every permutation in a single NumPy operation.
+    """
+
+    def __init__(self, num_perm: int = 64, shingle_size: int = 3, seed: int = 42):
+        self.num_perm       = num_perm
+        self.shingle_size   = shingle_size
+        rng = np.random.default_rng(seed)
+        # universal hashing (a * x + b) mod p on 61 bits values
+        self._a = rng.integers(1, MERSENNE_61, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, MERSENNE_61, size=num_perm, dtype=np.uint64)
+
+    def shingles(self, texts: pd.Series):
+        """
+        Hash the word n-grams of every text.
+
+        Returns:
+            np.ndarray : flat array of shingle hashes (61 bits)
+            np.ndarray : index of the text of each shingle
+        """
+        words = as_compiled_strings(texts.reset_index(drop=True).fillna("")).str.lower().str.split().explode()
+        doc_ids = words.index.to_numpy(dtype=np.int64)
+        word_hashes = hash_values(words.fillna("")) & np.uint64(MERSENNE_61)
+
+        # n-gram hash = combination of n consecutive word hashes of the same text
+        n = self.shingle_size
+        if len(word_hashes) < n:      # only short texts : one shingle per word
+            return word_hashes, doc_ids
+        hashes = word_hashes[:len(word_hashes) - n + 1].copy()
+        for k in range(1, n):
+            hashes = (hashes * np.uint64(31) + word_hashes[k:len(word_hashes) - n + 1 + k]) & np.uint64(MERSENNE_61)
+        same_doc = doc_ids[:len(doc_ids) - n + 1] == doc_ids[n - 1:]
+
+        # texts shorter than n words : one shingle per word (all their words are compared)
+        shingle_docs = doc_ids[:len(doc_ids) - n + 1][same_doc]
+        short_words = np.isin(doc_ids, np.setdiff1d(np.unique(doc_ids), shingle_docs))
+        hashes = np.concatenate([hashes[same_doc], word_hashes[short_words]])
+        docs = np.concatenate([shingle_docs, doc_ids[short_words]])
+        order = np.argsort(docs, kind="stable")
+        return hashes[order], docs[order]
+
+    def signatures(self, texts: pd.Series, chunk_size: int = 1000) -> np.ndarray:
+        """
+        Compute the MinHash signatures of texts.
+
+        Returns:
+            np.ndarray : signatures of shape (n_texts, num_perm), uint32
+        """
+        texts = texts.reset_index(drop=True)
+        signatures = np.empty((len(texts), self.num_perm), dtype=np.uint32)
+        for start in range(0, len(texts), chunk_size):
+            chunk = texts.iloc[start:start+chunk_size].reset_index(drop=True)
+            hashes, docs = self.shingles(chunk)
+            # (n_shingles, num_perm) permuted hashes - 61 bits values, products reduced modulo 2^64 then p
+            permuted = ((hashes[:, None] * self._a[None, :] + self._b[None, :]) % np.uint64(MERSENNE_61)) >> np.uint64(29)
+            # minimum per text : segments of consecutive shingles of the same text
+            starts = np.flatnonzero(np.r_[True, docs[1:] != docs[:-1]])
+            signatures[start + docs[starts]] = np.minimum.reduceat(permuted, starts, axis=0).astype(np.uint32)
+        return signatures
+
+
+class LSHIndex:
+    """
+    Locality Sensitive Hashing index over MinHash signatures ('bands' bands of num_perm / bands rows). Two texts
+    sharing a band are candidates, confirmed if their estimated Jaccard similarity reaches 'threshold'.
+    The index can be saved / loaded so that new data is checked incrementally.
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 8, threshold: float = 0.8):
+        if num_perm % bands != 0:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.num_perm   = num_perm
+        self.bands      = bands
+        self.threshold  = threshold
+        self.signatures = np.empty((0, num_perm), dtype=np.uint32)
+        self.keys       = np.empty(0, dtype=object)                  # identifier of each indexed text
+        self._band_keys = np.empty((0, bands), dtype=np.uint64)
+
+    def band_keys(self, signatures: np.ndarray) -> np.ndarray:
+        """Hash each band of the signatures into a single key (n, bands)"""
+        rows = self.num_perm // self.bands
+        multipliers = np.uint64(0x9E3779B97F4A7C15) ** np.arange(1, rows + 1, dtype=np.uint64)
+        bands = signatures.astype(np.uint64).reshape(len(signatures), self.bands, rows)
+        return (bands * multipliers).sum(axis=2, dtype=np.uint64)
+
+    def add(self, signatures: np.ndarray, keys):
+        """Add signatures (with their identifiers) to the index"""
+        self.signatures = np.concatenate([self.signatures, signatures])
+        self.keys       = np.concatenate([self.keys, np.asarray(list(keys), dtype=object)])
+        self._band_keys = np.concatenate([self._band_keys, self.band_keys(signatures)])
+
+    def query(self, signatures: np.ndarray):
+        """
+        Find the indexed texts similar to each queried signature.
+
+        Returns:
+            np.ndarray : index of the queried signature of each match
+            np.ndarray : position in the index of each match
+            np.ndarray : estimated Jaccard similarity of each match
+        """
+        if len(self.signatures) == 0 or len(signatures) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+
+        query_keys = self.band_keys(signatures)
+        pairs = []
+        for band in range(self.bands):
+            order = np.argsort(self._band_keys[:, band], kind="stable")
+            sorted_keys = self._band_keys[order, band]
+            left = np.searchsorted(sorted_keys, query_keys[:, band], side="left")
+            right = np.searchsorted(sorted_keys, query_keys[:, band], side="right")
+            counts = right - left
+            if not counts.any():
+                continue
+            # expand the [left, right) ranges into (query, indexed) candidate pairs
+            queries = np.repeat(np.arange(len(signatures)), counts)
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            pairs.append(np.stack([queries, order[np.repeat(left, counts) + offsets]], axis=1))
+        if not pairs:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+
+        pairs = np.unique(np.concatenate(pairs), axis=0)
+        similarity = (signatures[pairs[:, 0]] == self.signatures[pairs[:, 1]]).mean(axis=1)
+        keep = similarity >= self.threshold
+        return pairs[keep, 0], pairs[keep, 1], similarity[keep]
+
+    def duplicates_within(self, signatures: np.ndarray) -> np.ndarray:
+        """
+        Find the near duplicates inside a set of signatures : the first occurrence is kept, later ones are flagged.
+
+        Returns:
+            np.ndarray : boolean mask of the duplicated signatures
+        """
+        index = LSHIndex(self.num_perm, self.bands, self.threshold)
+        index.add(signatures, range(len(signatures)))
+        queries, matches, _ = index.query(signatures)
+        later = matches < queries
+        duplicated = np.zeros(len(signatures), dtype=bool)
+        duplicated[queries[later]] = True
+        return duplicated
+
+    # ===============================================================================================
+    # SAVE / LOAD
+    def save(self, path: str):
+        np.savez_compressed(path, signatures=self.signatures, keys=self.keys.astype(str),
+                            config=np.array([self.num_perm, self.bands]), threshold=np.array([self.threshold]))
+
+    @staticmethod
+    def load(path: str) -> "LSHIndex":
+        data = np.load(path, allow_pickle=False)
+        num_perm, bands = data["config"].tolist()
+        index = LSHIndex(num_perm=num_perm, bands=bands, threshold=float(data["threshold"][0]))
+        index.add(data["signatures"], data["keys"].tolist())
+        return index
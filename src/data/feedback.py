@@ -0,0 +1,64 @@
+import os
+import json
+import time
+import threading
+import pandas as pd
+
+
+class FeedbackLog:
+    """
+    Append-only log of labeled reviews (one JSON object per line). Each record is written with a single
+    'write' on a file opened in append mode, so concurrent writers never interleave lines. Readers consume the
+    log incrementally from a byte offset.
+    """
+
+    def __init__(self, path: str, fsync: bool = False):
+        self.path   = path
+        self.fsync  = fsync
+        self._lock  = threading.Lock()
+
+    def append(self, text: str, label: int, **fields):
+        """Add a labeled review to the log"""
+        record = {"ts": time.time(), "text": text, "label": int(label), **fields}
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+                if self.fsync:
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def end_offset(self, block_size: int = 1 << 16) -> int:
+        """Offset of the end of the last complete record : the records written from now on start after it"""
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, "rb") as f:
+            end = f.seek(0, os.SEEK_END)
+            # scan backwards from the end of the file (only the tail is read)
+            while end > 0:
+                start = max(0, end - block_size)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b"\n")
+                if newline >= 0:
+                    return start + newline + 1
+                end = start
+        return 0
+
+    def read_from(self, offset: int = 0):
+        """
+        Read the records written after 'offset' (a partially written last line is left for the next read).
+
+        Returns:
+            pd.DataFrame : records (columns "text", "label", ...)
+            int : offset of the end of the last complete record
+        """
+        if not os.path.exists(self.path):
+            return pd.DataFrame(columns=["text", "label"]), offset
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        records = [json.loads(line) for line in data[:end].decode("utf-8").splitlines() if line.strip()]
+        return pd.DataFrame(records, columns=None if records else ["text", "label"]), offset + end
@@ -0,0 +1,290 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+# -- internal
+from src.utils.ErrorHandler import ErrorHandler
+from src.utils.FileManager import FileManager
+
+# -- word count histogram (fixed bins so that per-chunk histograms can be summed)
+LENGTH_BIN_WIDTH:       int = 8
+LENGTH_MAX:             int = 4096
+# -- token count histogram
+TOKEN_BIN_WIDTH:        int = 8
+TOKEN_MAX:              int = 1024
+# -- HyperLogLog precision (2^p registers, ~1.04 / sqrt(2^p) relative error on the vocabulary size)
+HLL_PRECISION:          int = 14
+
+
+def as_compiled_strings(texts: pd.Series) -> pd.Series:
+    """Use Arrow backed strings when available : str methods then run in compiled kernels instead of a Python loop"""
+    try:
+        return texts.astype("string[pyarrow]")
+    except (ImportError, TypeError):
+        return texts.astype(str)
+
+
+def hash_values(values: pd.Series) -> np.ndarray:
+    """Vectorized 64 bits hashes of a Series"""
+    return pd.util.hash_pandas_object(values, index=False).to_numpy(dtype=np.uint64)
+
+
+def word_hashes(texts: pd.Series) -> np.ndarray:
+    """
+    64 bits hashes of the distinct (lower cased, whitespace separated) words of a chunk. Lower casing, splitting
+    and deduplication run in Arrow kernels : only the distinct words of the chunk become Python strings.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+    except ImportError:
+        return hash_values(texts.str.lower().str.split().explode().dropna().drop_duplicates())
+    words = pc.unique(pc.list_flatten(pc.utf8_split_whitespace(pc.utf8_lower(pa.array(texts, type=pa.string())))))
+    return hash_values(pd.Series(words.to_numpy(zero_copy_only=False), dtype=object))
+
+
+class ProfileAggregate:
+    """
+    Mergeable statistics of a text dataset, updated chunk by chunk (single pass, bounded memory apart from the
+    8 bytes per distinct text of a chunk used for exact duplicate counts). Aggregates computed on different
+    chunks / files / processes are combined with 'merge'.
+    """
+
+    def __init__(self):
+        self.n_samples          = 0
+        self.label_counts       = {}
+        # word counts
+        self.length_sum         = 0.0
+        self.length_sq_sum      = 0.0
+        self.length_min         = np.inf
+        self.length_max         = 0
+        self.length_hist        = np.zeros(LENGTH_MAX // LENGTH_BIN_WIDTH + 1, dtype=np.int64)
+        # token counts (only if a tokenizer is provided)
+        self.token_hist         = np.zeros(TOKEN_MAX // TOKEN_BIN_WIDTH + 1, dtype=np.int64)
+        self.n_tokenized        = 0
+        # duplicates : unique hashes of the texts of each chunk, merged once when the result is computed
+        self.text_hashes        = []
+        # vocabulary : HyperLogLog registers
+        self.hll                = np.zeros(2 ** HLL_PRECISION, dtype=np.uint8)
+
+    # ===============================================================================================
+    # UPDATE / MERGE
+    def update(self, texts: pd.Series, labels: pd.Series = None, tokenizer = None, vocab: bool = True):
+        """
+        Add a chunk of data to the statistics.
+
+        Args:
+            texts (pd.Series)   : texts of the chunk
+            labels (pd.Series)  : labels of the chunk (optional)
+            tokenizer           : Hugging Face tokenizer used for the token length histogram (optional)
+            vocab (bool)        : estimate the vocabulary size (requires splitting the texts into words)
+        """
+        texts = as_compiled_strings(texts.reset_index(drop=True).fillna(""))
+        self.n_samples += len(texts)
+
+        if labels is not None:
+            for label, count in labels.value_counts().items():
+                label = label.item() if hasattr(label, "item") else label
+                self.label_counts[label] = self.label_counts.get(label, 0) + int(count)
+
+        # word counts : compiled regex count, no per-review list of words
+        lengths = texts.str.count(r"\S+").to_numpy(dtype=np.int64)
+        self.length_sum += float(lengths.sum())
+        self.length_sq_sum += float((lengths.astype(np.float64) ** 2).sum())
+        if len(lengths):
+            self.length_min = min(self.length_min, int(lengths.min()))
+            self.length_max = max(self.length_max, int(lengths.max()))
+        self.length_hist += np.bincount(np.minimum(lengths // LENGTH_BIN_WIDTH, len(self.length_hist) - 1), minlength=len(self.length_hist))
+
+        # token counts : batched (Rust) tokenization
+        if tokenizer is not None:
+            n_tokens = np.fromiter((len(ids) for ids in tokenizer(texts.tolist(), truncation=False)["input_ids"]), dtype=np.int64, count=len(texts))
+            self.token_hist += np.bincount(np.minimum(n_tokens // TOKEN_BIN_WIDTH, len(self.token_hist) - 1), minlength=len(self.token_hist))
+            self.n_tokenized += len(texts)
+
+        # exact duplicates
+        self.text_hashes.append(np.unique(hash_values(texts)))
+
+        # vocabulary
+        if vocab:
+            self._hll_add(word_hashes(texts))
+        return self
+
+    def merge(self, other: "ProfileAggregate"):
+        """Combine the statistics of another aggregate (other chunk, file or process) into this one"""
+        self.n_samples      += other.n_samples
+        for label, count in other.label_counts.items():
+            self.label_counts[label] = self.label_counts.get(label, 0) + count
+        self.length_sum     += other.length_sum
+        self.length_sq_sum  += other.length_sq_sum
+        self.length_min     = min(self.length_min, other.length_min)
+        self.length_max     = max(self.length_max, other.length_max)
+        self.length_hist    += other.length_hist
+        self.token_hist     += other.token_hist
+        self.n_tokenized    += other.n_tokenized
+        self.text_hashes    += other.text_hashes
+        self.hll            = np.maximum(self.hll, other.hll)
+        return self
+
+    def _hll_add(self, hashes: np.ndarray):
+        """Add hashed values to the HyperLogLog registers"""
+        if len(hashes) == 0:
+            return
+        index = (hashes >> np.uint64(64 - HLL_PRECISION)).astype(np.int64)
+        rest = (hashes << np.uint64(HLL_PRECISION)) | np.uint64(1 << (HLL_PRECISION - 1))     # sentinel bit : rank <= 64 - p + 1
+        # rank = position of the first 1 bit (leading zeros + 1)
+        rank = (64 - np.floor(np.log2(rest.astype(np.float64))).astype(np.int64)).astype(np.uint8)
+        np.maximum.at(self.hll, index, rank)
+
+    # ===============================================================================================
+    # RESULTS
+    def n_distinct_texts(self) -> int:
+        """Number of distinct texts (the per-chunk hashes are merged into a single sorted array once)"""
+        if len(self.text_hashes) > 1:
+            self.text_hashes = [np.unique(np.concatenate(self.text_hashes))]
+        return len(self.text_hashes[0]) if self.text_hashes else 0
+
+    def vocab_size(self) -> int:
+        """HyperLogLog estimate of the number of distinct (lower cased, whitespace separated) words"""
+        m = len(self.hll)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(2.0 ** -self.hll.astype(np.float64))
+        zeros = int(np.sum(self.hll == 0))
+        if estimate <= 2.5 * m and zeros > 0:
+            estimate = m * np.log(m / zeros)        # small range correction (linear counting)
+        return int(round(estimate))
+
+    @staticmethod
+    def histogram_quantile(hist: np.ndarray, bin_width: int, q: float) -> float:
+        """Quantile estimated from a histogram (upper bound of the bin containing it)"""
+        total = hist.sum()
+        if total == 0:
+            return 0.0
+        return float((np.searchsorted(np.cumsum(hist), q * total) + 1) * bin_width)
+
+    def result(self) -> dict:
+        n = max(self.n_samples, 1)
+        mean = self.length_sum / n
+        var = max(self.length_sq_sum / n - mean ** 2, 0.0) * n / max(n - 1, 1)
+        report = {
+            "n_samples":        self.n_samples,
+            "class_balance":    {label: count / n for label, count in sorted(self.label_counts.items())},
+            "n_tokens_mean":    mean,
+            "n_tokens_std":     float(np.sqrt(var)),
+            "n_tokens_min":     int(self.length_min) if self.n_samples else 0,
+            "n_tokens_max":     int(self.length_max),
+            "n_tokens_p95":     self.histogram_quantile(self.length_hist, LENGTH_BIN_WIDTH, 0.95),
+            "n_duplicates":     self.n_samples - self.n_distinct_texts(),
+            "vocab_size":       self.vocab_size(),
+            "words_histogram":  {"bin_width": LENGTH_BIN_WIDTH, "counts": self.length_hist.tolist()},
+        }
+        if self.n_tokenized:
+            report["subword_tokens_p95"] = self.histogram_quantile(self.token_hist, TOKEN_BIN_WIDTH, 0.95)
+            report["subword_tokens_histogram"] = {"bin_width": TOKEN_BIN_WIDTH, "counts": self.token_hist.tolist()}
+        return report
+
+
+# ===============================================================================================
+# STREAMING
+def iter_chunks(path: str, chunksize: int = 50000):
+    """
+    Read a csv / jsonl / parquet file chunk by chunk (never fully loaded in memory).
+
+    Yields:
+        pd.DataFrame : chunk of the file
+    """
+    suffix = Path(path).suffix.lower()
+    if suffix == ".parquet":
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+        return
+
+    if suffix in (".jsonl", ".json"):
+        reader = pd.read_json(path, lines=True, chunksize=chunksize)
+    else:
+        reader = pd.read_csv(path, chunksize=chunksize)
+    for chunk in reader:
+        yield chunk
+
+
+def profile_file(path: str, chunksize: int = 50000, text_col: str = "text", label_col: str = "label",
+                 tokenizer_name: str = None, vocab: bool = True) -> ProfileAggregate:
+    """Single pass profile of one file"""
+    tokenizer = None
+    if tokenizer_name:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+
+    aggregate = ProfileAggregate()
+    for chunk in iter_chunks(path, chunksize=chunksize):
+        if text_col not in chunk.columns:
+            ErrorHandler.fatal(f"unable to find the column '{text_col}' in : {path}")
+        labels = chunk[label_col] if label_col in chunk.columns else None
+        aggregate.update(chunk[text_col], labels, tokenizer=tokenizer, vocab=vocab)
+    return aggregate
+
+
+def profile_dataframe(df: pd.DataFrame, chunksize: int = 50000, tokenizer = None, vocab: bool = True) -> ProfileAggregate:
+    """Profile a DataFrame (columns 'text' and optionally 'label') chunk by chunk"""
+    aggregate = ProfileAggregate()
+    for i in range(0, len(df), chunksize):
+        chunk = df.iloc[i:i+chunksize]
+        aggregate.update(chunk["text"], chunk["label"] if "label" in chunk.columns else None, tokenizer=tokenizer, vocab=vocab)
+    return aggregate
+
+
+def profile_files(paths: list, n_jobs: int = 1, **kwargs) -> ProfileAggregate:
+    """Profile several files (in parallel processes if n_jobs > 1) and merge the aggregates"""
+    aggregate = ProfileAggregate()
+    if n_jobs <= 1:
+        for path in paths:
+            aggregate.merge(profile_file(path, **kwargs))
+        return aggregate
+
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        futures = [pool.submit(profile_file, path, **kwargs) for path in paths]
+        for future in futures:
+            aggregate.merge(future.result())
+    return aggregate
+
+
+def main():
+    ap = argparse.ArgumentParser("Profile text datasets (length statistics, class balance, duplicates, vocabulary size, token length histograms) in a single streaming pass")
+    ap.add_argument("--files",      type=str,   nargs="*", default=None,    help="csv / jsonl / parquet files to profile (default: IMDB train + test)")
+    ap.add_argument("--text_col",   type=str,   default="text",             help="Name of the text column")
+    ap.add_argument("--label_col",  type=str,   default="label",            help="Name of the label column")
+    ap.add_argument("--chunksize",  type=int,   default=50000,              help="Number of rows read at once")
+    ap.add_argument("--n_jobs",     type=int,   default=1,                  help="Number of processes (one file per process)")
+    ap.add_argument("--tokenizer",  type=str,   default=None,               help="Hugging Face tokenizer used for the sub-word token histogram (e.g. distilbert-base-uncased)")
+    ap.add_argument("--no_vocab",   action="store_true",                    help="Skip the vocabulary size estimation (fastest)")
+    ap.add_argument("--output",     type=str,   default=None,               help="Json file where the profile is written")
+    args = ap.parse_args()
+
+    kwargs = {"chunksize": args.chunksize, "text_col": args.text_col, "label_col": args.label_col,
+              "tokenizer_name": args.tokenizer, "vocab": not args.no_vocab}
+    if args.files:
+        report = profile_files(args.files, n_jobs=args.n_jobs, **kwargs).result()
+    else:
+        from src.data.data import load_imdb
+        tokenizer = None
+        if args.tokenizer:
+            from transformers import AutoTokenizer
+            tokenizer = AutoTokenizer.from_pretrained(args.tokenizer)
+        report = {}
+        for name, df in zip(("train", "test"), load_imdb()):
+            report[name] = profile_dataframe(df, chunksize=args.chunksize, tokenizer=tokenizer, vocab=not args.no_vocab).result()
+
+    if args.output:
+        FileManager.write_json(args.output, report)
+        ErrorHandler.log("Saved : " + args.output)
+    else:
+        # histograms are only written in the output file
+        drop_histograms = lambda r: {k: v for k, v in r.items() if not k.endswith("histogram")}
+        ErrorHandler.log(f"{drop_histograms(report) if args.files else {k: drop_histograms(v) for k, v in report.items()}}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import time
+import threading
+import numpy as np
+import torch
+from torch import nn
+
+
+class LogitsOnly(nn.Module):
+    """Hugging Face classifier returning a plain logits tensor (traceable)"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+
+
+class CompiledClassifier:
+    """
+    Static-shape inference of a sequence classifier : inputs are padded to a small set of (batch size, sequence
+    length) buckets, and the model is compiled once per bucket ("trace" : frozen TorchScript graph, "compile" :
+    torch.compile without dynamic shapes). 'warmup' runs every bucket once, so that no compilation happens on
+    a real request.
+    """
+
+    def __init__(self, model, length_buckets: list, batch_buckets: list, pad_token_id: int = 0, backend: str = "trace"):
+        if backend not in ("trace", "compile"):
+            raise ValueError(f"Unknown backend : {backend}")
+        self.model          = LogitsOnly(model).eval()
+        self.length_buckets = sorted(length_buckets)
+        self.batch_buckets  = sorted(batch_buckets)
+        self.pad_token_id   = pad_token_id
+        self.backend        = backend
+        self.device         = next(model.parameters()).device
+        self._compiled      = {}
+        self._lock          = threading.Lock()
+        self._compiled_fn   = torch.compile(self.model, dynamic=False) if backend == "compile" else None
+
+    def _get(self, batch_size: int, length: int):
+        """Compiled model of a bucket (built on first use)"""
+        key = (batch_size, length)
+        if key in self._compiled:
+            return self._compiled[key]
+        with self._lock:        # concurrent callers : a single compilation per bucket
+            if key not in self._compiled:
+                self._compile(key)
+        return self._compiled[key]
+
+    def _compile(self, key: tuple):
+        """Build and warm the compiled model of a bucket, published once ready"""
+        batch_size, length = key
+        ids = torch.full((batch_size, length), self.pad_token_id, dtype=torch.long, device=self.device)
+        # example mask with padding : the traced graph must keep the masking path
+        mask = torch.ones_like(ids)
+        if length > 1:
+            mask[:, -1] = 0
+        with torch.no_grad():
+            if self.backend == "trace":
+                traced = torch.jit.trace(self.model, (ids, mask), check_trace=False)
+                compiled = torch.jit.optimize_for_inference(torch.jit.freeze(traced.eval()))
+            else:
+                compiled = self._compiled_fn
+            # first calls run the compilation / graph optimization passes
+            for _ in range(2):
+                compiled(ids, mask)
+        self._compiled[key] = compiled
+
+    def warmup(self):
+        """Compile and run every bucket once"""
+        start = time.perf_counter()
+        for batch_size in self.batch_buckets:
+            for length in self.length_buckets:
+                self._get(batch_size, length)
+        return time.perf_counter() - start
+
+    def bucket(self, buckets: list, value: int) -> int:
+        """Smallest bucket holding 'value' (the largest one otherwise)"""
+        return next((b for b in buckets if b >= value), buckets[-1])
+
+    def predict_proba_ids(self, input_ids: list):
+        """
+        Probabilities of token id sequences (1D tensors, truncated to the largest length bucket). Sequences are
+        grouped by length bucket then cut into batches of the largest batch bucket.
+
+        Returns:
+            np.ndarray : Array of shape (n_samples, n_classes)
+        """
+        max_length, max_batch = self.length_buckets[-1], self.batch_buckets[-1]
+        lengths = np.array([min(len(ids), max_length) for ids in input_ids])
+        buckets = np.array([self.bucket(self.length_buckets, n) for n in lengths])
+        probs = [None] * len(input_ids)
+
+        for length in np.unique(buckets):
+            rows = np.flatnonzero(buckets == length)
+            for i in range(0, len(rows), max_batch):
+                chunk = rows[i:i+max_batch]
+                batch_size = self.bucket(self.batch_buckets, len(chunk))
+                ids = torch.full((batch_size, int(length)), self.pad_token_id, dtype=torch.long)
+                mask = torch.zeros((batch_size, int(length)), dtype=torch.long)
+                for j, row in enumerate(chunk):
+                    seq = input_ids[row]
+                    if len(seq) > max_length:
+                        seq = torch.cat((seq[:max_length - 1], seq[-1:]))
+                    ids[j, :len(seq)] = seq
+                    mask[j, :len(seq)] = 1
+                mask[len(chunk):, 0] = 1        # padding rows : one visible token, results ignored
+
+                with torch.no_grad():
+                    logits = self._get(batch_size, int(length))(ids.to(self.device), mask.to(self.device))
+                batch_probs = torch.softmax(logits.float(), dim=-1).cpu().numpy()
+                for j, row in enumerate(chunk):
+                    probs[row] = batch_probs[j]
+        return np.array(probs)
+
+    def predict_proba(self, tokenizer, texts):
+        """Probabilities of texts (tokenized without padding, truncated at the inference length of the tokenizer)"""
+        if isinstance(texts, str):
+            texts = [texts]
+        encoded = tokenizer(list(texts), truncation=True)["input_ids"]
+        return self.predict_proba_ids([torch.tensor(ids, dtype=torch.long) for ids in encoded])
@@ -0,0 +1,123 @@
+import torch
+import transformers
+from packaging import version
+from torch import nn
+
+# DistilBERT blocks take the 2D padding mask up to transformers 4.x, a 4D additive mask from 5.0 (eager attention)
+ADDITIVE_BLOCK_MASK: bool = version.parse(transformers.__version__).major >= 5
+
+
+class EarlyExitHeads(nn.Module):
+    """
+    Lightweight classifier heads plugged on the [CLS] hidden state of intermediate layers of a (merged LoRA) DistilBERT.
+    Each head mirrors the final classifier (pre_classifier -> ReLU -> classifier) and is initialized from it.
+    """
+
+    def __init__(self, exit_layers: list, dim: int = 768, num_labels: int = 2):
+        super().__init__()
+        self.config = {"exit_layers": list(exit_layers), "dim": dim, "num_labels": num_labels}
+        self.heads = nn.ModuleDict({
+            str(layer): nn.Sequential(nn.Linear(dim, dim), nn.ReLU(), nn.Linear(dim, num_labels)) for layer in exit_layers
+        })
+
+    @staticmethod
+    def from_model(model, exit_layers: list):
+        """Create heads for the requested layers, initialized with the final classifier of the model"""
+        heads = EarlyExitHeads(exit_layers, dim=model.config.dim, num_labels=model.config.num_labels)
+        for head in heads.heads.values():
+            head[0].load_state_dict(model.pre_classifier.state_dict())
+            head[2].load_state_dict(model.classifier.state_dict())
+        return heads
+
+    def forward(self, layer: int, hidden_states: torch.Tensor):
+        """Logits of the head of 'layer' (1-based index of the transformer layer) from its hidden states"""
+        return self.heads[str(layer)](hidden_states[:, 0])
+
+
+def run_layer(model, layer_module, hidden: torch.Tensor, attention_mask: torch.Tensor):
+    """
+    Run one DistilBERT transformer block. The model must be loaded with the "eager" attention : the 2D padding mask
+    is converted to the format expected by the blocks of the installed transformers version (see 'block_mask').
+    """
+    # positional : the argument is named 'attn_mask' in 4.x, 'attention_mask' in 5.x
+    out = layer_module(hidden, block_mask(attention_mask, hidden.dtype))
+    return out[0] if isinstance(out, tuple) else out
+
+
+def block_mask(attention_mask: torch.Tensor, dtype: torch.dtype) -> torch.Tensor:
+    """2D padding mask (1 = token, 0 = padding) as given to the blocks : as is, or additive (batch, 1, 1, seq) mask"""
+    if not ADDITIVE_BLOCK_MASK:
+        return attention_mask
+    return (1.0 - attention_mask[:, None, None, :].to(dtype)) * torch.finfo(dtype).min
+
+
+def final_logits(model, hidden: torch.Tensor):
+    """Logits of the model's own classifier on the last hidden states"""
+    pooled = torch.relu(model.pre_classifier(hidden[:, 0]))
+    return model.classifier(model.dropout(pooled))
+
+
+def forward_early_exit(model, heads: EarlyExitHeads, input_ids: torch.Tensor, attention_mask: torch.Tensor, threshold: float):
+    """
+    Forward a batch layer by layer and stop each row at the first exit head whose confidence (max probability)
+    reaches 'threshold'. Exited rows are removed from the batch (and the padding trimmed) before the next layer.
+
+    Returns:
+        torch.Tensor : probabilities (batch, num_labels)
+        torch.Tensor : number of transformer layers used by each row (batch,)
+    """
+    batch_size = input_ids.size(0)
+    probs = torch.zeros(batch_size, model.config.num_labels, device=input_ids.device)
+    layers_used = torch.zeros(batch_size, dtype=torch.long, device=input_ids.device)
+
+    active = torch.arange(batch_size, device=input_ids.device)      # original index of the rows still running
+    hidden = model.distilbert.embeddings(input_ids)
+    layers = model.distilbert.transformer.layer
+    exit_layers = set(heads.config["exit_layers"])
+
+    for i, layer_module in enumerate(layers, start=1):
+        hidden = run_layer(model, layer_module, hidden, attention_mask)
+
+        if i == len(layers):
+            probs[active] = torch.softmax(final_logits(model, hidden), dim=-1)
+            layers_used[active] = i
+            break
+        if i not in exit_layers:
+            continue
+
+        layer_probs = torch.softmax(heads(i, hidden), dim=-1)
+        done = layer_probs.max(dim=-1).values >= threshold
+        if done.any():
+            probs[active[done]] = layer_probs[done]
+            layers_used[active[done]] = i
+            keep = ~done
+            if not keep.any():
+                break
+            active, hidden, attention_mask = active[keep], hidden[keep], attention_mask[keep]
+            # trim the padding no longer needed by the remaining rows
+            max_len = int(attention_mask.sum(dim=1).max())
+            hidden, attention_mask = hidden[:, :max_len], attention_mask[:, :max_len]
+
+    return probs, layers_used
+
+
+def forward_all_exits(model, heads: EarlyExitHeads, input_ids: torch.Tensor, attention_mask: torch.Tensor):
+    """
+    Forward a batch through every layer and return the probabilities of every exit (+ the final classifier).
+
+    Returns:
+        list[int]       : layer of each exit (the last one being the final classifier)
+        torch.Tensor    : probabilities (n_exits, batch, num_labels)
+    """
+    hidden = model.distilbert.embeddings(input_ids)
+    layers = model.distilbert.transformer.layer
+    exit_layers, exit_probs = [], []
+    for i, layer_module in enumerate(layers, start=1):
+        hidden = run_layer(model, layer_module, hidden, attention_mask)
+        if i == len(layers):
+            exit_layers.append(i)
+            exit_probs.append(torch.softmax(final_logits(model, hidden), dim=-1))
+        elif i in heads.config["exit_layers"]:
+            exit_layers.append(i)
+            exit_probs.append(torch.softmax(heads(i, hidden), dim=-1))
+    return exit_layers, torch.stack(exit_probs)
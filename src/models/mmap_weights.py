@@ -0,0 +1,88 @@
+import os
+import json
+import mmap
+import struct
+import torch
+from transformers import AutoConfig, AutoModelForSequenceClassification
+
+SAFETENSORS_FILE:   str = "model.safetensors"
+
+SAFETENSORS_DTYPES = {
+    "F64":  torch.float64,
+    "F32":  torch.float32,
+    "F16":  torch.float16,
+    "BF16": torch.bfloat16,
+    "I64":  torch.int64,
+    "I32":  torch.int32,
+    "I16":  torch.int16,
+    "I8":   torch.int8,
+    "U8":   torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+def mmap_safetensors(path: str) -> dict:
+    """
+    Map a safetensors file copy-on-write and return its tensors as views over the mapping (no copy) : the pages
+    are loaded lazily and shared through the page cache by every process mapping the same file. The mapping is
+    writable for torch (no "non-writable buffer" warning) but a write only copies the page, never the file.
+
+    Returns:
+        dict[str, torch.Tensor] : state dict (must not be modified in place : a written page is no longer shared)
+    """
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    # layout : header size (u64 little endian) | json header | raw data
+    (header_size,) = struct.unpack("<Q", buffer[:8])
+    header = json.loads(buffer[8:8 + header_size])
+    header.pop("__metadata__", None)
+    data_start = 8 + header_size
+
+    state_dict = {}
+    for name, info in header.items():
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        count = (end - begin) // torch.tensor([], dtype=dtype).element_size()
+        tensor = torch.frombuffer(buffer, dtype=dtype, count=count, offset=data_start + begin) if count else torch.empty(0, dtype=dtype)
+        state_dict[name] = tensor.reshape(info["shape"])
+    return state_dict
+
+
+def load_sequence_classifier_mmap(model_path: str, **kwargs):
+    """
+    Build a Hugging Face sequence classifier over the memory-mapped weights of its 'model.safetensors' : the
+    modules are created on the "meta" device (no allocation, no random init) then the mapped tensors are
+    assigned as parameters.
+
+    Returns:
+        model (on CPU, eval mode) or None if the artifact cannot be mapped (no safetensors file, missing weights)
+    """
+    weights_path = os.path.join(model_path, SAFETENSORS_FILE)
+    if not os.path.exists(weights_path):
+        return None
+
+    config = AutoConfig.from_pretrained(model_path)
+    with torch.device("meta"):
+        model = AutoModelForSequenceClassification.from_config(config, **kwargs)
+
+    state_dict = mmap_safetensors(weights_path)
+    expected = {name: t.dtype for name, t in model.state_dict().items()}
+    if any(name in state_dict and state_dict[name].dtype != dtype for name, dtype in expected.items()):
+        return None     # casting would copy the weights
+    model.load_state_dict(state_dict, strict=False, assign=True)
+
+    # non persistent buffers (not stored in the file) are still on the meta device
+    for module in model.modules():
+        for name, buffer in list(module._buffers.items()):
+            if buffer is None or not buffer.is_meta:
+                continue
+            if name == "position_ids":
+                module._buffers[name] = torch.arange(buffer.shape[-1]).expand(buffer.shape).clone()
+            else:
+                return None
+    if any(p.is_meta for p in model.parameters()):
+        return None
+
+    model.eval()
+    return model
@@ -0,0 +1,53 @@
+import torch
+from torch import nn
+from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
+
+
+class StudentClassifier(nn.Module):
+    """
+    Small BiGRU classifier over (DistilBERT) word embeddings, trained to reproduce the logits of a LoRA teacher.
+    A fraction of the teacher's cost on CPU : one embedding lookup + a single recurrent layer.
+    """
+
+    def __init__(self, vocab_size: int, embedding_dim: int = 768, hidden_dim: int = 128, num_labels: int = 2, 
+                 dropout: float = 0.1, pad_token_id: int = 0):
+        super().__init__()
+        self.config = {
+            "vocab_size":       vocab_size,
+            "embedding_dim":    embedding_dim,
+            "hidden_dim":       hidden_dim,
+            "num_labels":       num_labels,
+            "dropout":          dropout,
+            "pad_token_id":     pad_token_id,
+        }
+        self.embeddings = nn.Embedding(vocab_size, embedding_dim, padding_idx=pad_token_id)
+        self.gru        = nn.GRU(embedding_dim, hidden_dim, batch_first=True, bidirectional=True)
+        self.dropout    = nn.Dropout(dropout)
+        # mean + max pooling of both directions
+        self.classifier = nn.Linear(4 * hidden_dim, num_labels)
+
+    @staticmethod
+    def from_teacher(teacher, **kwargs):
+        """Create a student initialized with the (frozen) word embeddings of a DistilBERT teacher"""
+        weights = teacher.get_input_embeddings().weight.detach().clone()
+        student = StudentClassifier(vocab_size=weights.size(0), embedding_dim=weights.size(1), 
+                                    num_labels=teacher.config.num_labels, pad_token_id=teacher.config.pad_token_id, **kwargs)
+        student.embeddings.weight.data.copy_(weights)
+        student.embeddings.weight.requires_grad_(False)
+        return student
+
+    def forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor):
+        """
+        Returns:
+            torch.Tensor : logits of shape (batch, num_labels)
+        """
+        lengths = attention_mask.sum(dim=1)
+        x = self.dropout(self.embeddings(input_ids))
+        packed = pack_padded_sequence(x, lengths.cpu(), batch_first=True, enforce_sorted=False)
+        out, _ = self.gru(packed)
+        out, _ = pad_packed_sequence(out, batch_first=True, total_length=input_ids.size(1))
+
+        mask = attention_mask.unsqueeze(-1).to(out.dtype)
+        mean = (out * mask).sum(dim=1) / lengths.clamp(min=1).unsqueeze(-1).to(out.dtype)
+        max_ = out.masked_fill(mask == 0, float("-inf")).max(dim=1).values
+        return self.classifier(self.dropout(torch.cat([mean, max_], dim=-1)))
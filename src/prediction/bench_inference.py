@@ -0,0 +1,80 @@
+import time
+import argparse
+import numpy as np
+
+# -- internal
+from src.utils.ErrorHandler import ErrorHandler
+from src.utils.FileManager import FileManager
+from src.utils.enums import EModelType
+from src.utils.utils import init_model_id_context
+from src.utils.prediction_methods import predict_proba_lora, compile_lora
+from src.data.data import load_imdb
+
+
+def time_predictions(predict_fn, texts, batch_size: int, repeats: int = 1):
+    """Latency per batch (ms) of the predictions of 'texts' by batches of 'batch_size'"""
+    latencies = []
+    for _ in range(repeats):
+        for i in range(0, len(texts), batch_size):
+            start = time.perf_counter()
+            predict_fn(texts[i:i+batch_size])
+            latencies.append((time.perf_counter() - start) * 1e3)
+    return np.array(latencies)
+
+
+def summarize(latencies: np.ndarray, batch_size: int) -> dict:
+    p50, p95 = np.percentile(latencies, [50, 95])
+    return {"p50_ms": round(float(p50), 2), "p95_ms": round(float(p95), 2),
+            "samples_per_sec": round(float(batch_size * len(latencies) / latencies.sum() * 1e3), 1)}
+
+
+def bench_inference(model_id: str, npreds: int = 256, batch_sizes: list = None):
+    """
+    Compare eager and static-shape compiled inference of a LoRA model on test reviews : latency percentiles and
+    throughput per batch size (first calls excluded : the compiled buckets are warmed up before measuring).
+
+    Returns:
+        dict : report
+    """
+    init_model_id_context(EModelType.LORA, model_id, use_last_model_id=True)
+    model_id = FileManager.get_model_id()
+    batch_sizes = batch_sizes or [1, 32]
+
+    model, tokenizer = FileManager.load_lora(model_id)
+    _, test_df = load_imdb()
+    texts = test_df.sample(n=min(npreds, len(test_df)), random_state=FileManager.load_config()["seed"])["text"].tolist()
+
+    compiled = compile_lora(model, tokenizer, batch_size=max(batch_sizes))
+    eager_fn = lambda batch: predict_proba_lora(model, tokenizer, batch, batch_size=len(batch))
+    compiled_fn = lambda batch: compiled.predict_proba(tokenizer, batch)
+
+    # same predictions (up to float precision)
+    diff = np.abs(eager_fn(texts[:8]) - compiled_fn(texts[:8])).max()
+    report = {"model_id": model_id, "backend": compiled.backend, "n_reviews": len(texts), "max_abs_diff": float(diff), "batch_sizes": {}}
+
+    for batch_size in batch_sizes:
+        time_predictions(eager_fn, texts[:batch_size], batch_size)      # warm up eager kernels as well
+        eager = summarize(time_predictions(eager_fn, texts, batch_size), batch_size)
+        comp = summarize(time_predictions(compiled_fn, texts, batch_size), batch_size)
+        report["batch_sizes"][batch_size] = {"eager": eager, "compiled": comp,
+                                             "speedup": round(comp["samples_per_sec"] / eager["samples_per_sec"], 2)}
+        ErrorHandler.log(f"batch_size={batch_size} eager={eager} compiled={comp} speedup=x{report['batch_sizes'][batch_size]['speedup']}")
+
+    path = FileManager.get_model_reports_file(file_name=FileManager.COMPILED_BENCHMARK_FILE, model_id=model_id)
+    FileManager.write_json(path, report)
+    ErrorHandler.log("Saved : " + path)
+    return report
+
+
+def main():
+    ap = argparse.ArgumentParser("Benchmark eager vs static-shape compiled inference of a LoRA model (configs 'compiled')")
+    ap.add_argument("--model_id",       type=str,                               help="Unique identifier of the lora model (default: use latest model).")
+    ap.add_argument("--npreds",         type=int, default=256,                  help="Number of test reviews (default = 256)")
+    ap.add_argument("--batch_sizes",    type=int, nargs="+", default=[1, 32],   help="Batch sizes measured (default = 1 32)")
+    args = ap.parse_args()
+
+    bench_inference(model_id=args.model_id, npreds=args.npreds, batch_sizes=args.batch_sizes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+import os
+import math
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+
+# -- internal
+from src.utils.ErrorHandler import ErrorHandler
+from src.utils.FileManager import FileManager
+from src.utils.enums import EModelType
+from src.utils.utils import init_logging
+from src.utils.prediction_methods import predict_proba_baseline, predict_proba_lora_ids, truncate_input_ids
+from src.prediction.metrics import dataset_hash, inference_variant, save_predictions, load_predictions
+from src.data.data import load_imdb
+
+# -- models running on token ids (tokenization shared by the models using the same tokenizer)
+TOKEN_MODELS = (EModelType.LORA, EModelType.STUDENT)
+
+
+def parse_model(value: str):
+    """'<model_type>[:<model_id>]' -> (EModelType, model_id) - latest model if the id is omitted"""
+    model_type, _, model_id = value.partition(":")
+    model_type = EModelType(model_type)
+    if not model_id or model_id == "latest":
+        model_id = FileManager.get_last_model_id(model_type)
+    if not model_id or not FileManager.check_model_exists(model_type, model_id=model_id):
+        raise argparse.ArgumentTypeError(f"model not found : {value}")
+    return model_type, model_id
+
+
+def estimate_memory_mb(model_type: EModelType, model_id: str) -> float:
+    """Rough resident memory of a loaded model : size of its artifact on disk"""
+    path = FileManager.get_model_path(model_type=model_type, model_id=model_id, must_exist=True)
+    if os.path.isdir(path):
+        size = sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+    else:
+        size = os.path.getsize(path)
+    return size / 2**20
+
+
+def tokenizer_fingerprint(tokenizer) -> str:
+    """Same fingerprint = same token ids for the same texts"""
+    vocab = sorted(tokenizer.get_vocab().items())
+    return hashlib.sha1(repr((type(tokenizer).__name__, vocab)).encode("utf-8")).hexdigest()
+
+
+def mcnemar_test(correct_a: np.ndarray, correct_b: np.ndarray) -> dict:
+    """
+    McNemar test on paired predictions : exact binomial test when there are few discordant pairs, chi2 with
+    continuity correction otherwise.
+    """
+    b = int(np.sum(correct_a & ~correct_b))
+    c = int(np.sum(~correct_a & correct_b))
+    n = b + c
+    if n == 0:
+        return {"b": b, "c": c, "statistic": 0.0, "p_value": 1.0}
+    if n < 25:
+        p_value = min(1.0, 2 * sum(math.comb(n, k) for k in range(min(b, c) + 1)) / 2**n)
+        return {"b": b, "c": c, "statistic": float(min(b, c)), "p_value": p_value}
+    statistic = (abs(b - c) - 1) ** 2 / n
+    return {"b": b, "c": c, "statistic": statistic, "p_value": math.erfc(math.sqrt(statistic / 2))}
+
+
+class MemoryBudget:
+    """Blocks until the estimated memory of a model fits in the budget (a model larger than the budget runs alone)"""
+
+    def __init__(self, budget_mb: float):
+        self.budget_mb = budget_mb
+        self.used_mb = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self, size_mb: float):
+        with self._cond:
+            self._cond.wait_for(lambda: self.used_mb == 0 or self.used_mb + size_mb <= self.budget_mb)
+            self.used_mb += size_mb
+
+    def release(self, size_mb: float):
+        with self._cond:
+            self.used_mb -= size_mb
+            self._cond.notify_all()
+
+
+def run_model(model_type: EModelType, model_id: str, texts, encodings: dict, batch_size: int):
+    """
+    Load a model and predict every text (token models use the shared encodings, sorted by length so that the
+    batches contain little padding).
+
+    Returns:
+        np.ndarray : probabilities (n_samples, n_classes)
+        float : prediction time (seconds, loading excluded)
+    """
+    if model_type == EModelType.BASELINE:
+        model = FileManager.load_model(model_type, model_id)
+        start = time.perf_counter()
+        return predict_proba_baseline(model, texts, batch_size=batch_size), time.perf_counter() - start
+
+    if model_type == EModelType.LORA:
+        model, tokenizer = FileManager.load_lora(model_id)
+    else:
+        model, tokenizer = FileManager.load_student(model_id)
+    all_ids, order = encodings[tokenizer_fingerprint(tokenizer)]
+    ids = [truncate_input_ids(all_ids[i], tokenizer.model_max_length) for i in order]
+
+    start = time.perf_counter()
+    sorted_probs = predict_proba_lora_ids(model, ids, batch_size=batch_size, pad_token_id=tokenizer.pad_token_id or 0)
+    elapsed = time.perf_counter() - start
+    probs = np.empty_like(sorted_probs)
+    probs[order] = sorted_probs
+    return probs, elapsed
+
+
+def compare(models: list, batch_size: int = 32, npreds: int = None, memory_budget_mb: float = 4096, max_workers: int = 2,
+            force: bool = False):
+    """
+    Compare several models on the same IMDB test data : data loaded once, tokenization shared by the token models
+    using the same tokenizer, models run concurrently within a memory budget.
+
+    Args:
+        models (list[tuple[EModelType, str]])   : (model_type, model_id) of each model
+        batch_size (int)                        : size of the prediction batches
+        npreds (int, optional)                  : number of test reviews (all if None)
+        memory_budget_mb (float)                : max estimated memory of the models loaded at the same time
+        max_workers (int)                       : max models running at the same time
+        force (bool)                            : re-run models whose predictions on this data are already persisted
+
+    Returns:
+        dict : report (accuracy and throughput per model, agreement matrix, McNemar tests)
+    """
+    init_logging()
+    ErrorHandler.init("compare")
+    cfg = FileManager.load_config()
+
+    # a model given twice (ex : 'lora' and 'lora:<latest id>') is run once and never compared with itself
+    unique_models = list(dict.fromkeys(models))
+    if len(unique_models) < len(models):
+        ErrorHandler.warning(f"Duplicate models ignored : {len(models) - len(unique_models)}")
+    models = unique_models
+
+    # data loaded once
+    _, test_df = load_imdb()
+    if npreds is not None and npreds > 0:
+        test_df = test_df.sample(n=npreds, random_state=cfg["seed"])
+    texts, labels = test_df["text"].tolist(), test_df["label"].to_numpy()
+    data_hash = dataset_hash(test_df)
+    names = [f"{model_type.value}:{model_id}" for model_type, model_id in models]
+
+    # persisted predictions are reused (see 'evaluate')
+    variants = {name: inference_variant(model_type, model_id) for name, (model_type, model_id) in zip(names, models)}
+    paths = {name: FileManager.get_predictions_file(model_type, data_hash, model_id, variant=variants[name]) for name, (model_type, model_id) in zip(names, models)}
+    to_run = [(name, model) for name, model in zip(names, models) if force or not FileManager.exists(paths[name])]
+
+    # tokenization shared by the token models with the same tokenizer (longest inference length of the group)
+    encodings, max_lengths = {}, {}
+    for _, (model_type, model_id) in to_run:
+        if model_type in TOKEN_MODELS:
+            tokenizer = FileManager.load_tokenizer(model_type, model_id)
+            key = tokenizer_fingerprint(tokenizer)
+            max_lengths[key] = (tokenizer, max(max_lengths.get(key, (None, 0))[1], tokenizer.model_max_length))
+    for key, (tokenizer, max_length) in max_lengths.items():
+        ErrorHandler.log(f"Tokenizing {len(texts)} reviews (max_length={max_length}) for tokenizer {key[:8]}")
+        all_ids = [torch.tensor(ids) for ids in tokenizer(texts, truncation=True, max_length=max_length)["input_ids"]]
+        encodings[key] = (all_ids, np.argsort([len(ids) for ids in all_ids], kind="stable"))
+
+    # models run concurrently within the memory budget
+    budget = MemoryBudget(memory_budget_mb)
+    timings = {}
+
+    def task(name, model_type, model_id):
+        size_mb = estimate_memory_mb(model_type, model_id)
+        budget.acquire(size_mb)
+        try:
+            ErrorHandler.log(f"Running {name} (~{size_mb:.0f} MB)")
+            probs, elapsed = run_model(model_type, model_id, texts, encodings, batch_size)
+        finally:
+            budget.release(size_mb)
+        save_predictions(paths[name], probs, test_df, model_type, model_id, variant=variants[name])
+        timings[name] = elapsed
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for future in [executor.submit(task, name, *model) for name, model in to_run]:
+            future.result()
+
+    # per-item predictions of every model
+    preds = np.stack([np.argmax(load_predictions(paths[name])["probs"], axis=1) for name in names])   # (n_models, n_samples)
+    correct = preds == labels
+
+    agreement = (preds[:, None, :] == preds[None, :, :]).mean(axis=2)
+    report = {
+        "dataset_hash":     data_hash,
+        "n_samples":        len(texts),
+        "models": {name: {
+            "accuracy":         float(correct[i].mean()),
+            "samples_per_sec":  len(texts) / timings[name] if name in timings else None,    # None : persisted predictions reused
+        } for i, name in enumerate(names)},
+        "agreement":        {a: {b: float(agreement[i, j]) for j, b in enumerate(names)} for i, a in enumerate(names)},
+        "all_agree":        float(np.mean((preds == preds[0]).all(axis=0))),
+        "mcnemar":          [{"model_a": names[i], "model_b": names[j], **mcnemar_test(correct[i], correct[j])}
+                             for i in range(len(names)) for j in range(i + 1, len(names))],
+    }
+
+    # console summary
+    print(f"{'model':<40} {'accuracy':>9} {'samples/s':>10}")
+    for name, row in report["models"].items():
+        throughput = f"{row['samples_per_sec']:.1f}" if row["samples_per_sec"] else "cached"
+        print(f"{name:<40} {row['accuracy']:>9.4f} {throughput:>10}")
+    for row in report["mcnemar"]:
+        print(f"McNemar {row['model_a']} vs {row['model_b']} : b={row['b']} c={row['c']} p={row['p_value']:.4g} agreement={report['agreement'][row['model_a']][row['model_b']]:.4f}")
+
+    path = os.path.join(FileManager.get_root(), FileManager.RESULTS_DIR, f"compare_{data_hash}_{hashlib.sha1(' '.join(names).encode()).hexdigest()[:8]}.json")
+    FileManager.write_json(path, report)
+    ErrorHandler.log("Saved : " + path)
+    return report
+
+
+def main():
+    cfg_compare = FileManager.load_config()["compare"]
+    ap = argparse.ArgumentParser("Compare several models on the same test data : accuracy, throughput, per-item agreement and McNemar tests")
+    ap.add_argument("--models",         type=parse_model, nargs="+", required=True, metavar="TYPE[:ID]",
+                    help=f"Models to compare, ex : 'baseline lora:1712345678 student' (latest model of the type if the id is omitted). Types : {[e.value for e in EModelType]}")
+    ap.add_argument("--batch_size",     type=int,   default=32,     help="Size of prediction batches (default = 32)")
+    ap.add_argument("--npreds",         type=int,   default=None,   help="Number of random test reviews (default : use the entire test set)")
+    ap.add_argument("--memory_budget_mb", type=float, default=cfg_compare["memory_budget_mb"], help="Max estimated memory of the models loaded at the same time.")
+    ap.add_argument("--max_workers",    type=int,   default=cfg_compare["max_workers"], help="Max models running at the same time.")
+    ap.add_argument("--force",          action="store_true",        help="Re-run models whose predictions on the same data are already persisted")
+    args = ap.parse_args()
+
+    compare(models=args.models, batch_size=args.batch_size, npreds=args.npreds, memory_budget_mb=args.memory_budget_mb,
+            max_workers=args.max_workers, force=args.force)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import time
 import argparse
 import numpy as np
 from re import I
@@ -8,11 +9,33 @@ from src.utils.ErrorHandler import ErrorHandler
 from src.utils.FileManager import FileManager
 from src.utils.enums import EModelType
 from src.utils.utils import LABELS, init_model_id_context
-from src.utils.prediction_methods import delegate_predict_fn
+from src.utils.prediction_methods import delegate_predict_fn, predict_proba_all_exits, simulate_early_exit
 from src.data.data import load_imdb
+from src.prediction.metrics import dataset_hash, inference_variant, save_predictions, load_predictions, compute_metrics
 
 
-def evaluate(model_type: EModelType, model_id: str, batch_size:int=32, npreds:int=None):
+def early_exit_report(labels, exit_layers, exit_probs, thresholds):
+    """
+    Accuracy and average number of layers used for each early exit threshold (simulated from the probabilities of every exit)
+
+    Returns:
+        list[dict] : one row per threshold
+    """
+    labels = np.asarray(labels)
+    rows = []
+    for threshold in thresholds:
+        probs, layers = simulate_early_exit(exit_layers, exit_probs, threshold)
+        rows.append({
+            "threshold":    threshold,
+            "accuracy":     float(np.mean(np.argmax(probs, axis=1) == labels)),
+            "avg_layers":   float(layers.mean()),
+            "exit_rates":   {int(l): float(np.mean(layers == l)) for l in exit_layers},
+        })
+    return rows
+
+
+def evaluate(model_type: EModelType, model_id: str, batch_size:int=32, npreds:int=None, early_exit_thresholds:list=None,
+             probs_dtype: str = "float32", force: bool = False, compiled: bool = False):
     """
     Evaluate the fine-tuned LoRA transformer model on the IMDB test set.
         - Loads the tokenizer and model from artifacts,
@@ -24,6 +47,11 @@ def evaluate(model_type: EModelType, model_id: str, batch_size:int=32, npreds:in
         model_type  (EModelType): Type of model to use ("baseline" or "lora").
         batch_size (int)        : size of the batch
         npreds (int, optional)  : max number of predictions (all provided data if is None)
+        early_exit_thresholds (list[float], optional) : (lora only) evaluate the early exit heads with these 
+                                  thresholds (the first one is used for the classification report)
+        probs_dtype (str)       : precision of the persisted probabilities ("float16" or "float32")
+        force (bool)            : re-run the model even if its predictions on this data are already persisted
+        compiled (bool)         : (lora only) static-shape compiled inference (buckets warmed before timing)
     Returns:
         None 
     """ 
@@ -35,16 +63,45 @@ def evaluate(model_type: EModelType, model_id: str, batch_size:int=32, npreds:in
     
     # adjuste size of predictions
     if npreds is not None and npreds > 0:
-        test_df = test_df.sample(n=npreds)
+        test_df = test_df.sample(n=npreds, random_state=FileManager.load_config()["seed"])
     texts = test_df["text"].tolist();
 
-    # get the prediction method that works for the requested model
-    predict_fn = delegate_predict_fn(model_type=model_type, model_id=FileManager.get_model_id())    
-    preds = predict_fn(texts)           # batch predict the test data     
-    preds = np.argmax(preds, axis=1)    # take the class with highest prob
+    # early exit : probabilities of every exit computed once, each threshold is simulated from them
+    if early_exit_thresholds:
+        if model_type != EModelType.LORA:
+            ErrorHandler.fatal("Early exit is only available for 'lora' models")
+        model, tokenizer, heads = FileManager.load_early_exit(FileManager.get_model_id())
+        exit_layers, exit_probs = predict_proba_all_exits(model, heads, tokenizer, texts, batch_size=batch_size)
+        
+        print(f"{'threshold':>10} {'accuracy':>10} {'avg_layers':>11}")
+        for row in early_exit_report(test_df["label"], exit_layers, exit_probs, early_exit_thresholds):
+            print(f"{row['threshold']:>10.3f} {row['accuracy']:>10.4f} {row['avg_layers']:>11.2f}")
+        
+        preds, _ = simulate_early_exit(exit_layers, exit_probs, early_exit_thresholds[0])
+        preds = np.argmax(preds, axis=1)
+        print(classification_report(test_df["label"], preds, target_names=LABELS))
+        return
+
+    # per-item probabilities are persisted (keyed by model id, data hash and inference settings) : reused instead of re-running the model
+    variant = inference_variant(model_type, FileManager.get_model_id(), compiled=compiled)
+    predictions_path = FileManager.get_predictions_file(model_type, dataset_hash(test_df), FileManager.get_model_id(), variant=variant)
+    if force or not FileManager.exists(predictions_path):
+        # get the prediction method that works for the requested model
+        predict_fn = delegate_predict_fn(model_type=model_type, model_id=FileManager.get_model_id(), batch_size=batch_size, compiled=compiled)    
+        start = time.perf_counter()
+        probs = predict_fn(texts)           # batch predict the test data     
+        elapsed = time.perf_counter() - start
+        ErrorHandler.log(f"Predicted {len(texts)} reviews in {elapsed:.1f}s ({len(texts) / elapsed:.1f} reviews/sec{', compiled' if compiled else ''})")
+        save_predictions(predictions_path, probs, test_df, model_type, FileManager.get_model_id(), dtype=probs_dtype, variant=variant)
+    else:
+        ErrorHandler.log("Reusing persisted predictions : " + predictions_path)
+    predictions = load_predictions(predictions_path)
+    preds = np.argmax(predictions["probs"], axis=1)    # take the class with highest prob
 
     # display predictions to the console
     print(classification_report(test_df["label"], preds, target_names=LABELS))
+    metrics = compute_metrics(predictions)
+    print(f"roc_auc={metrics['roc_auc']} ece={metrics['ece']:.4f} best threshold (f1)={metrics['best_threshold_f1']['threshold']:.2f} (run 'metrics' for the full report)")
     
 
 def main():
@@ -53,9 +110,18 @@ def main():
     ap.add_argument("--model_id",   type=str,               help="Unique identifier for this model that you want to use in the prediction (default: use latest model).")    
     ap.add_argument("--batch_size", type=int, default=32,   help="Size of prediction batches (default = 32)")    
     ap.add_argument("--npreds",     type=int, default=None, help="Limit number of predictions - it will select n random values in the test dataset. (default : use the entire test set)")
+    ap.add_argument("--early_exit", type=float, default=None, nargs="*", metavar="THRESHOLD", 
+                    help="(lora only) Evaluate the early exit heads with these confidence thresholds (default: configs 'early_exit.threshold') : accuracy and average number of layers used per threshold.")
+    ap.add_argument("--probs_dtype", type=str, choices=["float16", "float32"], default="float32", help="Precision of the persisted probabilities (default = float32)")
+    ap.add_argument("--force",      action="store_true",    help="Re-run the model even if its predictions on the same data are already persisted")
+    ap.add_argument("--compiled",   action="store_true",    help="(lora only) Static-shape compiled inference (configs 'compiled'), see also 'bench_inference'")
     args = ap.parse_args()
     
-    evaluate(model_type=args.model_type, model_id=args.model_id, batch_size=args.batch_size, npreds=args.npreds)
+    if args.early_exit is not None and len(args.early_exit) == 0:
+        args.early_exit = [FileManager.load_config()["early_exit"]["threshold"]]
+    
+    evaluate(model_type=args.model_type, model_id=args.model_id, batch_size=args.batch_size, npreds=args.npreds, early_exit_thresholds=args.early_exit,
+             probs_dtype=args.probs_dtype, force=args.force, compiled=args.compiled)
 
 
 if __name__ == "__main__":
@@ -1,14 +1,18 @@
+import re
+import time
 import argparse
 import torch
 import numpy as np
 import pathlib
 import joblib
+from scipy.stats import spearmanr
 from lime.lime_text import LimeTextExplainer
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 
 # -- internal
 from src.utils.utils import LABELS, init_model_id_context
-from src.utils.prediction_methods import delegate_predict_fn
+from src.utils.prediction_methods import delegate_predict_fn, predict_proba_lora, explain_lora_occlusion
+from src.data.data import load_imdb
 from src.utils.enums import EModelType
 from src.utils.FileManager import FileManager
 from src.utils.ErrorHandler import ErrorHandler
@@ -53,16 +57,159 @@ def explain(text: str, model_type: EModelType, model_id: str = ""):
     ErrorHandler.log("Saved : " + report_path)
 
 
+def explain_occlusion(text: str, model_id: str = "", top_k: int = 10, max_variants: int = None):
+    """
+    Fast explanation of a LoRA prediction : importance of each word by occlusion (at most two batched passes of
+    'max_variants' occluded copies of the review, see 'explain_lora_occlusion'), printed to the console.
+
+    Returns:
+        list[tuple[str, float]] : (word, importance toward 'pos') sorted by decreasing absolute importance
+    """
+    init_model_id_context(EModelType.LORA, model_id, use_last_model_id=True)
+    model_id = FileManager.get_model_id()
+    model, tokenizer = FileManager.load_lora(model_id)
+    cfg_explain = FileManager.load_config()["explain"]
+
+    start = time.perf_counter()
+    probs, importances = explain_lora_occlusion(model, tokenizer, text, max_variants=max_variants or cfg_explain["max_variants"])
+    elapsed_ms = (time.perf_counter() - start) * 1e3
+
+    print(f"prediction : {LABELS[int(np.argmax(probs))]} (pos={probs[1]:.4f}) - {len(importances)} words explained in {elapsed_ms:.1f} ms (target {cfg_explain['target_ms']} ms)")
+    for word, weight in importances[:top_k]:
+        print(f"{word:>20} {weight:+.4f}")
+    return importances
+
+
+def lime_importances(explainer: LimeTextExplainer, predict_fn, text: str, num_samples: int = 5000) -> dict:
+    """LIME weights toward 'pos' of every word of a text (lowercased, like the occlusion words)"""
+    n_words = len(set(w for w in re.split(r"\W+", text) if w))
+    exp = explainer.explain_instance(text, predict_fn, num_features=max(n_words, 1), labels=[1], num_samples=num_samples)
+    weights = {}
+    for word, weight in exp.as_list(label=1):
+        weights[word.lower()] = weights.get(word.lower(), 0.0) + weight
+    return weights
+
+
+def remove_words(text: str, words: list) -> str:
+    """Text without any occurrence of the words"""
+    for word in words:
+        text = re.sub(r"(?i)\b" + re.escape(word) + r"\b", "", text)
+    return text
+
+
+def deletion_drop(predict_fn, text: str, importances: dict, label: int, k: int) -> float:
+    """
+    Drop of the probability of the predicted 'label' when the 'k' words that support it the most are removed
+    (higher = the explanation found the words the prediction actually depends on)
+    """
+    sign = 1 if label == 1 else -1
+    support = sorted((w for w, v in importances.items() if sign * v > 0), key=lambda w: -sign * importances[w])[:k]
+    if not support:
+        return 0.0
+    probs = predict_fn([text, remove_words(text, support)])
+    return float(probs[0, label] - probs[1, label])
+
+
+def fidelity(model_id: str = "", n_reviews: int = 20, num_samples: int = 1000, k: int = 5, max_variants: int = None):
+    """
+    Compare the occlusion explanations with LIME on test reviews :
+        - agreement : rank correlation (Spearman) of the word importances, overlap of the top-k words, and sign
+          agreement on the words of the LIME top-k
+        - deletion fidelity : probability drop of the predicted class when the top-k supporting words of each
+          method (and of a random ranking) are removed from the review
+        - latency of each method per review, and latency percentiles of the occlusion against 'explain.target_ms'
+    Report : 'explain_fidelity.json' in the model reports.
+
+    Returns:
+        dict : report
+    """
+    init_model_id_context(EModelType.LORA, model_id, use_last_model_id=True)
+    model_id = FileManager.get_model_id()
+    cfg = FileManager.load_config()
+    max_variants = max_variants or cfg["explain"]["max_variants"]
+    model, tokenizer = FileManager.load_lora(model_id)
+    predict_fn = lambda texts: predict_proba_lora(model, tokenizer, texts)
+    explainer = LimeTextExplainer(class_names=LABELS, random_state=cfg["seed"])
+    rng = np.random.default_rng(cfg["seed"])
+
+    _, test_df = load_imdb()
+    texts = test_df.sample(n=min(n_reviews, len(test_df)), random_state=cfg["seed"])["text"].tolist()
+
+    rows = []
+    for i, text in enumerate(texts):
+        start = time.perf_counter()
+        probs, occlusion = explain_lora_occlusion(model, tokenizer, text, max_variants=max_variants)
+        occlusion_ms = (time.perf_counter() - start) * 1e3
+        occlusion = dict(occlusion)
+
+        start = time.perf_counter()
+        lime = lime_importances(explainer, predict_fn, text, num_samples=num_samples)
+        lime_ms = (time.perf_counter() - start) * 1e3
+
+        common = [w for w in occlusion if w in lime]
+        top_occlusion = sorted(occlusion, key=lambda w: -abs(occlusion[w]))[:k]
+        top_lime = sorted(lime, key=lambda w: -abs(lime[w]))[:k]
+        label = int(np.argmax(probs))
+        random_ranking = dict(zip(occlusion, (rng.permutation(len(occlusion)) + 1) * (1 if label == 1 else -1)))
+        rows.append({
+            "occlusion_ms":         occlusion_ms,
+            "lime_ms":              lime_ms,
+            "spearman":             float(spearmanr([occlusion[w] for w in common], [lime[w] for w in common])[0]) if len(common) > 2 else np.nan,
+            "top_k_overlap":        len(set(top_occlusion) & set(top_lime)) / max(len(top_lime), 1),
+            "top_k_sign_agreement": float(np.mean([np.sign(occlusion.get(w, 0.0)) == np.sign(lime[w]) for w in top_lime])) if top_lime else np.nan,
+            "deletion_occlusion":   deletion_drop(predict_fn, text, occlusion, label, k),
+            "deletion_lime":        deletion_drop(predict_fn, text, lime, label, k),
+            "deletion_random":      deletion_drop(predict_fn, text, random_ranking, label, k),
+        })
+        ErrorHandler.log(f"[{i + 1}/{len(texts)}] occlusion {occlusion_ms:.0f} ms, lime {lime_ms:.0f} ms, spearman {rows[-1]['spearman']:.3f}")
+
+    occlusion_ms = np.array([row["occlusion_ms"] for row in rows])
+    report = {"model_id": model_id, "n_reviews": len(texts), "lime_num_samples": num_samples, "k": k, "max_variants": max_variants,
+              **{key: float(np.nanmean([row[key] for row in rows])) for key in rows[0]},
+              "occlusion_ms_p50":   float(np.percentile(occlusion_ms, 50)),
+              "occlusion_ms_p95":   float(np.percentile(occlusion_ms, 95)),
+              "target_ms":          cfg["explain"]["target_ms"],
+              "within_target":      float(np.mean(occlusion_ms <= cfg["explain"]["target_ms"]))}
+    report_path = FileManager.get_model_reports_file(file_name=FileManager.EXPLAIN_FIDELITY_FILE, model_id=model_id)
+    FileManager.write_json(report_path, report)
+    for key, value in report.items():
+        print(f"{key:>22} : {value}")
+    ErrorHandler.log("Saved : " + report_path)
+    return report
+
+
 def main():
     ap = argparse.ArgumentParser("Explain a model prediction on a provided text. Save results into an html local file at 'reports/MODEL_FILE'")
-    ap.add_argument("--text",       type=str, required=True, 
+    ap.add_argument("--text",       type=str, 
                     help="Text that you want to see analysed")
     ap.add_argument("--model_type", type=EModelType, choices=list(EModelType), default=EModelType.LORA, 
                     help=f"Type of model you want to use for the prediction : {[e.value for e in EModelType]}")
     ap.add_argument("--model_id",   type=str, 
                     help="Unique identifier for this model that you want to use in the prediction (default: use latest model).")    
+    ap.add_argument("--method",     type=str, choices=["lime", "occlusion"], default="lime", 
+                    help="lime : LIME html report (thousands of forward passes) | occlusion : (lora only) word importances from at most two batched passes, printed to the console")
+    ap.add_argument("--max_variants", type=int, default=None, 
+                    help="(occlusion) Max occluded copies of the review per pass (default: configs 'explain.max_variants')")
+    ap.add_argument("--top_k",      type=int, default=10, 
+                    help="(occlusion) Number of words printed")
+    ap.add_argument("--fidelity",   type=int, default=None, metavar="N_REVIEWS", 
+                    help="(lora only) Compare the occlusion explanations with LIME on N test reviews (agreement, deletion fidelity, latency) instead of explaining '--text'")
+    ap.add_argument("--lime_samples", type=int, default=1000, 
+                    help="(fidelity) Number of LIME perturbed samples per review")
+    ap.add_argument("--deletion_k", type=int, default=5, 
+                    help="(fidelity) Number of top words compared / removed per review")
     args = ap.parse_args()
     
+    if args.fidelity:
+        fidelity(model_id=args.model_id, n_reviews=args.fidelity, num_samples=args.lime_samples, k=args.deletion_k, max_variants=args.max_variants)
+        return
+    if not args.text:
+        ap.error("--text is required (unless --fidelity is used)")
+    if args.method == "occlusion":
+        if args.model_type != EModelType.LORA:
+            ErrorHandler.fatal("Occlusion explanations are only available for 'lora' models")
+        explain_occlusion(text=args.text, model_id=args.model_id, top_k=args.top_k, max_variants=args.max_variants)
+        return
     explain(text=args.text, model_type=args.model_type, model_id=args.model_id)
 
     
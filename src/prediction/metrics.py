@@ -0,0 +1,208 @@
+import os
+import hashlib
+import argparse
+import numpy as np
+import pandas as pd
+from sklearn.metrics import roc_auc_score, average_precision_score
+
+# -- internal
+from src.utils.ErrorHandler import ErrorHandler
+from src.utils.FileManager import FileManager
+from src.utils.enums import EModelType
+from src.utils.utils import init_model_id_context
+from src.data.profiling import as_compiled_strings, hash_values
+
+DEFAULT_LENGTH_BUCKETS = [64, 128, 256, 512]        # word count edges
+DEFAULT_N_BINS = 15                                 # calibration bins
+DEFAULT_N_THRESHOLDS = 101                          # threshold sweep resolution
+
+
+# ===============================================================================================
+# PERSISTED PREDICTIONS
+def dataset_hash(df: pd.DataFrame) -> str:
+    """Short content hash of an evaluated dataset (texts, labels and order)"""
+    digest = hashlib.sha1(hash_values(df["text"]).tobytes())
+    digest.update(df["label"].to_numpy(dtype=np.int64).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def inference_variant(model_type: EModelType, model_id: str, compiled: bool = False) -> str:
+    """
+    Inference settings that change the probabilities of a model, part of the key of its persisted predictions :
+    inference max length of the token models (see 'profile_max_length --save') and compiled backend
+    """
+    parts = []
+    if model_type != EModelType.BASELINE:
+        max_length = FileManager.get_inference_max_length(model_type, model_id)
+        if max_length:
+            parts.append(f"len{max_length}")
+    if compiled:
+        parts.append("compiled")
+    return "_".join(parts)
+
+
+def save_predictions(path: str, probs: np.ndarray, df: pd.DataFrame, model_type: EModelType, model_id: str, dtype: str = "float32",
+                     variant: str = ""):
+    """
+    Persist the per-item probabilities of a model with what the metrics need (labels, word counts, row ids), so
+    that any metric can be computed later without re-running the model.
+    """
+    lengths = as_compiled_strings(df["text"]).str.count(r"\S+").to_numpy(dtype=np.int32)
+    np.savez_compressed(path,
+                        probs=np.asarray(probs, dtype=dtype),
+                        labels=df["label"].to_numpy(dtype=np.int8),
+                        lengths=lengths,
+                        row_ids=df.index.to_numpy(dtype=np.int64),
+                        model_type=np.array(model_type.value), model_id=np.array(model_id), dataset_hash=np.array(dataset_hash(df)),
+                        variant=np.array(variant))
+    ErrorHandler.log("Saved predictions : " + path)
+
+
+def load_predictions(path: str) -> dict:
+    """Load persisted predictions (probabilities as float32)"""
+    if not FileManager.exists(path):
+        ErrorHandler.fatal("Predictions file not found : " + path)
+    with np.load(path, allow_pickle=False) as data:
+        predictions = {key: data[key] for key in data.files}
+    predictions["probs"] = predictions["probs"].astype(np.float32)
+    predictions.setdefault("variant", np.array(""))
+    for key in ("model_type", "model_id", "dataset_hash", "variant"):
+        predictions[key] = str(predictions[key])
+    return predictions
+
+
+# ===============================================================================================
+# METRICS (vectorized, from the persisted probabilities)
+def threshold_sweep(scores: np.ndarray, labels: np.ndarray, thresholds: np.ndarray) -> dict:
+    """
+    Confusion counts of 'score >= threshold' for every threshold at once : the scores of each class are sorted
+    once, each count is a binary search.
+
+    Returns:
+        dict : arrays (one value per threshold) of tp, fp, precision, recall (tpr), fpr, f1 and accuracy
+    """
+    pos, neg = np.sort(scores[labels == 1]), np.sort(scores[labels == 0])
+    tp = len(pos) - np.searchsorted(pos, thresholds, side="left")
+    fp = len(neg) - np.searchsorted(neg, thresholds, side="left")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(tp + fp > 0, tp / (tp + fp), 1.0)
+        recall = tp / max(len(pos), 1)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+    return {
+        "thresholds":   thresholds,
+        "tp":           tp,
+        "fp":           fp,
+        "precision":    precision,
+        "recall":       recall,
+        "fpr":          fp / max(len(neg), 1),
+        "f1":           f1,
+        "accuracy":     (tp + len(neg) - fp) / len(labels),
+    }
+
+
+def reliability_curve(probs: np.ndarray, labels: np.ndarray, n_bins: int = DEFAULT_N_BINS):
+    """
+    Reliability curve (accuracy vs confidence per confidence bin) and Expected Calibration Error.
+
+    Returns:
+        float : ECE
+        list[dict] : one row per non empty bin
+    """
+    confidence = probs.max(axis=1)
+    correct = (probs.argmax(axis=1) == labels).astype(np.float64)
+    bins = np.minimum((confidence * n_bins).astype(np.int64), n_bins - 1)
+    counts = np.bincount(bins, minlength=n_bins)
+    acc_sum = np.bincount(bins, weights=correct, minlength=n_bins)
+    conf_sum = np.bincount(bins, weights=confidence, minlength=n_bins)
+
+    filled = counts > 0
+    accuracy, mean_conf = acc_sum[filled] / counts[filled], conf_sum[filled] / counts[filled]
+    ece = float(np.sum(counts[filled] / len(labels) * np.abs(accuracy - mean_conf)))
+    rows = [{"bin": int(b), "count": int(c), "confidence": float(mc), "accuracy": float(a)}
+            for b, c, mc, a in zip(np.flatnonzero(filled), counts[filled], mean_conf, accuracy)]
+    return ece, rows
+
+
+def length_bucket_accuracy(preds: np.ndarray, labels: np.ndarray, lengths: np.ndarray, edges: list = DEFAULT_LENGTH_BUCKETS):
+    """Accuracy per review length bucket (word counts, buckets split at 'edges')"""
+    buckets = np.digitize(lengths, edges)
+    counts = np.bincount(buckets, minlength=len(edges) + 1)
+    correct = np.bincount(buckets, weights=(preds == labels), minlength=len(edges) + 1)
+    bounds = [0] + list(edges) + [None]
+    return [{"min_words": bounds[i], "max_words": bounds[i + 1], "count": int(counts[i]), "accuracy": float(correct[i] / counts[i])}
+            for i in range(len(counts)) if counts[i] > 0]
+
+
+def compute_metrics(predictions: dict, n_thresholds: int = DEFAULT_N_THRESHOLDS, n_bins: int = DEFAULT_N_BINS,
+                    length_buckets: list = DEFAULT_LENGTH_BUCKETS) -> dict:
+    """
+    Compute every metric of a binary classifier from its persisted predictions (see 'load_predictions').
+
+    Returns:
+        dict : report (threshold sweep with ROC / PR points, best thresholds, AUCs, calibration, length buckets)
+    """
+    probs, labels, lengths = predictions["probs"], predictions["labels"].astype(np.int64), predictions["lengths"]
+    scores = probs[:, 1]
+    preds = probs.argmax(axis=1)
+
+    sweep = threshold_sweep(scores, labels, np.linspace(0.0, 1.0, n_thresholds))
+    best_f1, best_acc = int(np.argmax(sweep["f1"])), int(np.argmax(sweep["accuracy"]))
+    ece, reliability = reliability_curve(probs, labels, n_bins=n_bins)
+    has_both = len(np.unique(labels)) == 2
+
+    return {
+        "model_type":       predictions["model_type"],
+        "model_id":         predictions["model_id"],
+        "dataset_hash":     predictions["dataset_hash"],
+        "n_samples":        int(len(labels)),
+        "accuracy":         float(np.mean(preds == labels)),
+        "roc_auc":          float(roc_auc_score(labels, scores)) if has_both else None,
+        "average_precision": float(average_precision_score(labels, scores)) if has_both else None,
+        "best_threshold_f1":       {"threshold": float(sweep["thresholds"][best_f1]), "f1": float(sweep["f1"][best_f1])},
+        "best_threshold_accuracy": {"threshold": float(sweep["thresholds"][best_acc]), "accuracy": float(sweep["accuracy"][best_acc])},
+        "ece":              ece,
+        "reliability":      reliability,
+        "length_buckets":   length_bucket_accuracy(preds, labels, lengths, edges=length_buckets),
+        # ROC (fpr, recall) and PR (recall, precision) curves are the columns of the sweep
+        "threshold_sweep":  {key: np.asarray(values).tolist() for key, values in sweep.items()},
+    }
+
+
+def find_predictions_file(model_type: EModelType, model_id: str) -> str:
+    """Most recent persisted predictions of a model (any dataset)"""
+    dirpath = os.path.join(FileManager.get_root(), FileManager.RESULTS_DIR, FileManager.PREDICTIONS_DIR)
+    prefix = f"predictions_{model_type.value}_{model_id}_"
+    files = [os.path.join(dirpath, f) for f in os.listdir(dirpath) if f.startswith(prefix)] if os.path.isdir(dirpath) else []
+    if not files:
+        ErrorHandler.fatal(f"No persisted predictions for {model_type.value} model {model_id} (run 'evaluate' first)")
+    return max(files, key=os.path.getmtime)
+
+
+def main():
+    ap = argparse.ArgumentParser("Compute evaluation metrics (threshold sweep, ROC / PR, calibration, accuracy per length) from the predictions persisted by 'evaluate', without re-running the model")
+    ap.add_argument("--model_type",     type=EModelType, choices=list(EModelType), default=EModelType.LORA, help=f"Type of the evaluated model : {[e.value for e in EModelType]}")
+    ap.add_argument("--model_id",       type=str,               help="Unique identifier of the evaluated model (default: use latest model).")
+    ap.add_argument("--predictions",    type=str,               help="Predictions file (default: latest predictions of the model in results/predictions)")
+    ap.add_argument("--n_thresholds",   type=int, default=DEFAULT_N_THRESHOLDS, help=f"Number of thresholds of the sweep (default = {DEFAULT_N_THRESHOLDS})")
+    ap.add_argument("--n_bins",         type=int, default=DEFAULT_N_BINS,       help=f"Number of calibration bins (default = {DEFAULT_N_BINS})")
+    ap.add_argument("--length_buckets", type=int, nargs="+", default=DEFAULT_LENGTH_BUCKETS, help=f"Word count edges of the length buckets (default = {DEFAULT_LENGTH_BUCKETS})")
+    args = ap.parse_args()
+
+    init_model_id_context(model_type=args.model_type, model_id=args.model_id, use_last_model_id=True)
+    path = args.predictions or find_predictions_file(args.model_type, FileManager.get_model_id())
+    report = compute_metrics(load_predictions(path), n_thresholds=args.n_thresholds, n_bins=args.n_bins, length_buckets=args.length_buckets)
+
+    print(f"accuracy={report['accuracy']:.4f} roc_auc={report['roc_auc']} average_precision={report['average_precision']} ece={report['ece']:.4f}")
+    print(f"best threshold (f1)       : {report['best_threshold_f1']}")
+    print(f"best threshold (accuracy) : {report['best_threshold_accuracy']}")
+    print(f"{'words':>12} {'count':>7} {'accuracy':>9}")
+    for row in report["length_buckets"]:
+        print(f"{str(row['min_words']) + '-' + str(row['max_words'] or ''):>12} {row['count']:>7} {row['accuracy']:>9.4f}")
+
+    report_path = FileManager.get_model_reports_file(file_name=FileManager.METRICS_FILE, model_id=FileManager.get_model_id())
+    FileManager.write_json(report_path, report)
+    ErrorHandler.log("Saved : " + report_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import time
+import argparse
+import numpy as np
+from sklearn.metrics import accuracy_score
+
+# -- internal
+from src.utils.ErrorHandler import ErrorHandler
+from src.utils.FileManager import FileManager
+from src.utils.enums import EModelType
+from src.utils.utils import init_model_id_context
+from src.utils.prediction_methods import predict_proba_lora, predict_proba_student
+from src.data.data import load_imdb, describe_dataset
+
+DEFAULT_LENGTHS = [64, 128, 192, 256, 320, 384, 512]
+
+
+def profile_max_length(model_type: EModelType, model_id: str, lengths: list = None, batch_size: int = 32, npreds: int = 2000,
+                       tolerance: float = 0.002, save: bool = False):
+    """
+    Measure accuracy and latency of a model on the IMDB test set for a grid of inference max lengths, and select
+    the shortest length whose accuracy is within 'tolerance' of the best one.
+
+    Args:
+        model_type (EModelType) : type of model ("lora" or "student")
+        model_id (str)          : id of the model (default: latest model)
+        lengths (list[int])     : max lengths to profile (default: DEFAULT_LENGTHS)
+        batch_size (int)        : size of the prediction batches
+        npreds (int)            : number of test reviews used (0 = all)
+        tolerance (float)       : max accuracy drop accepted compared to the best length
+        save (bool)             : store the selected length in the model metadata (used by every inference path)
+
+    Returns:
+        dict : report (one row per length + selected length)
+    """
+    init_model_id_context(model_type=model_type, model_id=model_id, use_last_model_id=True)
+    model_id = FileManager.get_model_id()
+    lengths = lengths or DEFAULT_LENGTHS
+
+    if model_type == EModelType.LORA:
+        model, tokenizer = FileManager.load_lora(model_id)
+        predict = lambda texts: predict_proba_lora(model, tokenizer, texts, batch_size=batch_size)
+    elif model_type == EModelType.STUDENT:
+        model, tokenizer = FileManager.load_student(model_id)
+        predict = lambda texts: predict_proba_student(model, tokenizer, texts, batch_size=batch_size)
+    else:
+        ErrorHandler.fatal("Max length profiling is only available for token based models (lora, student)")
+
+    _, test_df = load_imdb()
+    if npreds and npreds < len(test_df):
+        test_df = test_df.sample(n=npreds, random_state=FileManager.load_config()["seed"])
+    texts, labels = test_df["text"].tolist(), test_df["label"].to_numpy()
+
+    # reference : word counts of the evaluated reviews
+    stats = describe_dataset(test_df)
+    ErrorHandler.log(f"Profiling max lengths {lengths} on {len(texts)} reviews (n_tokens_p95 = {stats['n_tokens_p95']:.0f} words)")
+
+    # warm up (first batches are always slower)
+    tokenizer.model_max_length = max(lengths)
+    predict(texts[:batch_size])
+
+    rows = []
+    for length in sorted(lengths):
+        tokenizer.model_max_length = length
+        start = time.perf_counter()
+        probs = predict(texts)
+        elapsed = time.perf_counter() - start
+        rows.append({
+            "max_length":       length,
+            "accuracy":         accuracy_score(labels, np.argmax(probs, axis=1)),
+            "ms_per_review":    elapsed / len(texts) * 1e3,
+        })
+        ErrorHandler.log(f"max_length={length:>4} accuracy={rows[-1]['accuracy']:.4f} ms/review={rows[-1]['ms_per_review']:.2f}")
+
+    # shortest length within the tolerance of the best accuracy
+    best_accuracy = max(row["accuracy"] for row in rows)
+    selected = next(row for row in rows if row["accuracy"] >= best_accuracy - tolerance)
+    report = {"model_type": model_type.value, "model_id": model_id, "n_reviews": len(texts), "tolerance": tolerance,
+              "n_tokens_p95": stats["n_tokens_p95"], "lengths": rows, "selected_max_length": selected["max_length"]}
+    ErrorHandler.log(f"Selected max_length={selected['max_length']} (accuracy={selected['accuracy']:.4f}, best={best_accuracy:.4f})")
+
+    FileManager.write_json(FileManager.get_model_reports_file(file_name=FileManager.MAX_LENGTH_PROFILE_FILE, model_id=model_id), report)
+    if save:
+        FileManager.update_model_metadata(model_type, model_id, inference_max_length=selected["max_length"])
+        ErrorHandler.log(f"Saved inference max length in the metadata of model {model_id}")
+    return report
+
+
+def main():
+    ap = argparse.ArgumentParser("Profile accuracy and latency of a model for several inference max lengths (number of tokens) and select the shortest one that keeps the accuracy")
+    ap.add_argument("--model_type", type=EModelType, choices=[EModelType.LORA, EModelType.STUDENT], default=EModelType.LORA, help="Type of model to profile")
+    ap.add_argument("--model_id",   type=str,                                   help="Unique identifier of the model (default: use latest model).")
+    ap.add_argument("--lengths",    type=int,   nargs="+", default=DEFAULT_LENGTHS, help=f"Max lengths to profile (default = {DEFAULT_LENGTHS})")
+    ap.add_argument("--batch_size", type=int,   default=32,                     help="Size of prediction batches (default = 32)")
+    ap.add_argument("--npreds",     type=int,   default=2000,                   help="Number of test reviews used (default = 2000, 0 = all)")
+    ap.add_argument("--tolerance",  type=float, default=0.002,                  help="Max accuracy drop accepted compared to the best length (default = 0.002)")
+    ap.add_argument("--save",       action="store_true",                        help="Store the selected length in the model metadata : applied by every inference path (evaluate, explain, API, ...)")
+    args = ap.parse_args()
+
+    profile_max_length(model_type=args.model_type, model_id=args.model_id, lengths=args.lengths, batch_size=args.batch_size,
+                       npreds=args.npreds, tolerance=args.tolerance, save=args.save)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+import os
+import time
+import shutil
+import sqlite3
+import argparse
+import multiprocessing as mp
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import torch
+
+# -- internal
+from src.utils.ErrorHandler import ErrorHandler
+from src.utils.FileManager import FileManager
+from src.utils.enums import EModelType
+from src.utils.utils import LABELS, init_logging
+from src.utils.prediction_methods import delegate_predict_fn
+from src.data.profiling import iter_chunks
+
+# -- spool layout : files dropped in 'incoming' are moved to 'queued' when enqueued, scores are published in 'done'
+INCOMING_DIR:   str = "incoming"
+QUEUED_DIR:     str = "queued"
+DONE_DIR:       str = "done"
+FAILED_DIR:     str = "failed"
+INPUT_SUFFIXES: tuple = (".csv", ".jsonl", ".json", ".parquet")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id              INTEGER PRIMARY KEY AUTOINCREMENT,
+    path            TEXT UNIQUE NOT NULL,
+    model_type      TEXT NOT NULL,
+    model_id        TEXT NOT NULL,
+    chunksize       INTEGER NOT NULL,
+    status          TEXT NOT NULL DEFAULT 'pending',    -- pending | running | done | failed
+    rows_done       INTEGER NOT NULL DEFAULT 0,         -- input rows scored (whole chunks)
+    output_bytes    INTEGER NOT NULL DEFAULT 0,         -- committed size of the partial output
+    partial         TEXT,                               -- partial output holding the committed rows
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    worker          TEXT,
+    heartbeat       REAL,
+    output          TEXT,
+    error           TEXT,
+    created         REAL NOT NULL
+)
+"""
+
+
+class JobQueue:
+    """
+    Durable queue of scoring jobs in a local SQLite database (one connection per process). A job is claimed by
+    a single worker for 'lease_s' seconds, renewed at each checkpoint : the job of a crashed worker is picked up
+    again once its lease expires, and resumes from its last checkpoint.
+    """
+
+    def __init__(self, path: str, lease_s: float = 600, max_attempts: int = 3):
+        self.lease_s        = lease_s
+        self.max_attempts   = max_attempts
+        self.conn           = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.execute(SCHEMA)
+        columns = [row["name"] for row in self.conn.execute("PRAGMA table_info(jobs)")]
+        if "partial" not in columns:
+            self.conn.execute("ALTER TABLE jobs ADD COLUMN partial TEXT")
+
+    def submit(self, path: str, model_type: EModelType, model_id: str, chunksize: int) -> int:
+        cursor = self.conn.execute("INSERT OR IGNORE INTO jobs (path, model_type, model_id, chunksize, created) VALUES (?, ?, ?, ?, ?)",
+                                   (path, model_type.value, model_id, chunksize, time.time()))
+        return cursor.lastrowid
+
+    def claim(self, worker: str):
+        """Oldest pending job (or running job with an expired lease), None if the queue is empty"""
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            job = self.conn.execute("SELECT * FROM jobs WHERE status = 'pending' OR (status = 'running' AND heartbeat < ?) ORDER BY id LIMIT 1",
+                                    (now - self.lease_s,)).fetchone()
+            if job is not None:
+                self.conn.execute("UPDATE jobs SET status = 'running', worker = ?, heartbeat = ?, attempts = attempts + 1 WHERE id = ?",
+                                  (worker, now, job["id"]))
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return None if job is None else self.get(job["id"])
+
+    def checkpoint(self, job_id: int, worker: str, rows_done: int, output_bytes: int, partial: str):
+        """Record the progress of a job (and renew its lease) - fails if the job was taken over by another worker"""
+        cursor = self.conn.execute("UPDATE jobs SET rows_done = ?, output_bytes = ?, partial = ?, heartbeat = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                                   (rows_done, output_bytes, partial, time.time(), job_id, worker))
+        if cursor.rowcount != 1:
+            raise RuntimeError(f"job {job_id} is no longer owned by {worker}")
+
+    def finish(self, job_id: int, worker: str, output: str) -> bool:
+        """Mark a job as done, returns False if the job was taken over by another worker"""
+        cursor = self.conn.execute("UPDATE jobs SET status = 'done', output = ?, partial = NULL, heartbeat = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                                   (output, time.time(), job_id, worker))
+        return cursor.rowcount == 1
+
+    def fail(self, job_id: int, worker: str, error: str) -> bool:
+        """
+        Put a job back in the queue (failed once 'max_attempts' is reached), returns True if it is given up. A
+        worker whose job was taken over leaves it to its new owner.
+        """
+        cursor = self.conn.execute("UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, error = ?, worker = NULL "
+                                   "WHERE id = ? AND worker = ? AND status = 'running'", (self.max_attempts, error, job_id, worker))
+        return cursor.rowcount == 1 and self.get(job_id)["status"] == "failed"
+
+    def get(self, job_id: int):
+        return self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+    def counts(self) -> dict:
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def jobs(self):
+        return self.conn.execute("SELECT * FROM jobs ORDER BY id").fetchall()
+
+
+def open_queue(cfg_worker: dict) -> JobQueue:
+    return JobQueue(os.path.join(FileManager.get_spool_dir(), FileManager.JOBS_DB_FILE),
+                    lease_s=cfg_worker["lease_s"], max_attempts=cfg_worker["max_attempts"])
+
+
+def submit_file(queue: JobQueue, path: str, model_type: EModelType, model_id: str, chunksize: int):
+    """
+    Move a file to the spool and enqueue it. The model id is resolved now (latest model if empty), so that a
+    resumed job keeps scoring with the same model. Raise a ValueError (the file is left in place) if there is no
+    model to score it with.
+    """
+    model_id = model_id or FileManager.get_last_model_id(model_type)
+    if not model_id or not FileManager.check_model_exists(model_type, model_id=model_id):
+        raise ValueError(f"No {model_type.value} model to score : {path}")
+    queued = os.path.join(FileManager.get_spool_dir(QUEUED_DIR), f"{int(time.time() * 1e6)}_{Path(path).name}")
+    shutil.move(path, queued)
+    job_id = queue.submit(queued, model_type, model_id, chunksize)
+    ErrorHandler.log(f"Queued job {job_id} : {Path(path).name} ({model_type.value} {model_id})")
+    return job_id
+
+
+def scan_incoming(queue: JobQueue, model_type: EModelType, model_id: str, chunksize: int, settle_s: float = 2.0) -> int:
+    """Enqueue the files of the 'incoming' directory (hidden files and files modified less than 'settle_s' ago are still being written)"""
+    n = 0
+    for path in sorted(Path(FileManager.get_spool_dir(INCOMING_DIR)).iterdir()):
+        if path.name.startswith(".") or path.suffix.lower() not in INPUT_SUFFIXES or not path.is_file():
+            continue
+        if time.time() - path.stat().st_mtime < settle_s:
+            continue
+        try:
+            submit_file(queue, str(path), model_type, model_id, chunksize)
+        except ValueError as e:
+            ErrorHandler.warning(f"Not queued : {path.name}", exception=e)
+            continue
+        n += 1
+    return n
+
+
+def output_path(job) -> str:
+    return os.path.join(FileManager.get_spool_dir(DONE_DIR), f"{Path(job['path']).stem}_scores.csv")
+
+
+def score_job(queue: JobQueue, job, worker: str, predict_fn, text_col: str = "text", id_col: str = "id", fsync: bool = True):
+    """
+    Score a file chunk by chunk. The scores are appended to a partial output, then the progress (input rows,
+    output size) is checkpointed in the queue : a resumed job copies the committed part of the previous partial
+    output into its own (one partial per claim, a worker that lost its lease never shares a file with the new
+    owner) and skips the chunks already scored. The complete output is published with an atomic rename.
+
+    Returns:
+        str : path to the output file
+    """
+    final_path = output_path(job)
+    partial_path = os.path.join(os.path.dirname(final_path), f".tmp_{job['id']}_{job['attempts']}_{os.path.basename(final_path)}")
+    previous_path = job["partial"]
+    rows_done, output_bytes = job["rows_done"], job["output_bytes"]
+    if output_bytes and not (previous_path and os.path.exists(previous_path)):
+        if os.path.exists(final_path):      # interrupted between the publication and the end of the job
+            if queue.finish(job["id"], worker, final_path):
+                os.remove(job["path"])
+            return final_path
+        rows_done, output_bytes = 0, 0
+
+    # committed rows of the previous claim (rows appended after its last checkpoint are not copied)
+    with open(partial_path, "wb") as f_out:
+        if output_bytes:
+            with open(previous_path, "rb") as f_in:
+                remaining = output_bytes
+                while remaining:
+                    block = f_in.read(min(remaining, 1 << 20))
+                    if not block:
+                        raise RuntimeError(f"partial output of job {job['id']} is shorter than its checkpoint : {previous_path}")
+                    f_out.write(block)
+                    remaining -= len(block)
+        if fsync:
+            f_out.flush()
+            os.fsync(f_out.fileno())
+    if previous_path and previous_path != partial_path:
+        queue.checkpoint(job["id"], worker, rows_done, output_bytes, partial_path)
+        if os.path.exists(previous_path):
+            os.remove(previous_path)
+
+    skip_chunks = rows_done // job["chunksize"]
+    if rows_done:
+        ErrorHandler.log(f"Resuming job {job['id']} at row {rows_done}")
+
+    start = time.perf_counter()
+    fd = os.open(partial_path, os.O_WRONLY | os.O_APPEND)
+    try:
+        for i, chunk in enumerate(iter_chunks(job["path"], chunksize=job["chunksize"])):
+            if i < skip_chunks:
+                continue
+            if text_col not in chunk.columns:
+                raise ValueError(f"unable to find the column '{text_col}' in : {job['path']}")
+            probs = np.asarray(predict_fn(chunk[text_col].fillna("").astype(str).tolist()))
+            scores = pd.DataFrame({
+                id_col:         chunk[id_col].to_numpy() if id_col in chunk.columns else np.arange(rows_done, rows_done + len(chunk)),
+                "prob_neg":     probs[:, 0],
+                "prob_pos":     probs[:, 1],
+                "label":        np.array(LABELS)[np.argmax(probs, axis=1)],
+            })
+            data = scores.to_csv(index=False, header=output_bytes == 0).encode("utf-8")
+            os.write(fd, data)
+            if fsync:
+                os.fsync(fd)
+            rows_done += len(chunk)
+            output_bytes += len(data)
+            queue.checkpoint(job["id"], worker, rows_done, output_bytes, partial_path)
+        if fsync:
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    os.replace(partial_path, final_path)
+    if not queue.finish(job["id"], worker, final_path):
+        raise RuntimeError(f"job {job['id']} is no longer owned by {worker}")
+    os.remove(job["path"])
+    elapsed = time.perf_counter() - start
+    ErrorHandler.log(f"Job {job['id']} done : {rows_done} rows ({rows_done / max(elapsed, 1e-9):.1f} rows/sec this run) -> {final_path}")
+    return final_path
+
+
+def worker_loop(worker: str, cfg_worker: dict, torch_threads: int, once: bool = False):
+    """
+    Worker process : claims jobs until the queue is empty ('once') or forever. The models stay loaded between
+    jobs (one predict method per model, see 'delegate_predict_fn').
+    """
+    init_logging()
+    ErrorHandler.init(worker)
+    torch.set_num_threads(torch_threads)
+    queue = open_queue(cfg_worker)
+    predict_fns = {}
+
+    while True:
+        job = queue.claim(worker)
+        if job is None:
+            if once:
+                return
+            time.sleep(cfg_worker["poll_interval_s"])
+            continue
+
+        key = (job["model_type"], job["model_id"])
+        try:
+            if key not in predict_fns:
+                predict_fns[key] = delegate_predict_fn(EModelType(job["model_type"]), job["model_id"], batch_size=cfg_worker["batch_size"],
+                                                       compiled=cfg_worker["compiled"] and job["model_type"] == EModelType.LORA.value)
+            score_job(queue, job, worker, predict_fns[key], text_col=cfg_worker["text_col"], id_col=cfg_worker["id_col"], fsync=cfg_worker["fsync"])
+        except (Exception, SystemExit) as e:
+            # SystemExit : ErrorHandler.fatal in a loader (missing model files, ...) is a failure of the job, not of the worker
+            given_up = queue.fail(job["id"], worker, repr(e))
+            ErrorHandler.warning(f"Job {job['id']} failed (attempt {job['attempts']})", exception=e)
+            if given_up and os.path.exists(job["path"]):
+                os.replace(job["path"], os.path.join(FileManager.get_spool_dir(FAILED_DIR), Path(job["path"]).name))
+
+
+def run_workers(model_type: EModelType, model_id: str, processes: int = None, once: bool = False):
+    """
+    Watch the spool directory and score the queued files with 'processes' worker processes (one job per process
+    at a time). With 'once', the incoming files are enqueued and the workers stop when the queue is empty.
+    """
+    init_logging()
+    ErrorHandler.init("score_worker")
+    cfg_worker = FileManager.load_config()["worker"]
+    processes = processes or cfg_worker["processes"]
+    torch_threads = cfg_worker.get("torch_threads") or max(1, (os.cpu_count() or 1) // processes)
+    queue = open_queue(cfg_worker)
+    scan_incoming(queue, model_type, model_id, cfg_worker["chunksize"], settle_s=0 if once else cfg_worker["settle_s"])
+
+    # spawn : no torch state inherited from the parent process
+    ctx = mp.get_context("spawn")
+    workers = [ctx.Process(target=worker_loop, args=(f"worker-{os.getpid()}-{i}", cfg_worker, torch_threads, once), daemon=True)
+               for i in range(processes)]
+    for p in workers:
+        p.start()
+    ErrorHandler.log(f"Scoring with {processes} processes x {torch_threads} torch threads, spool : {FileManager.get_spool_dir()}")
+
+    try:
+        while any(p.is_alive() for p in workers):
+            if not once:
+                scan_incoming(queue, model_type, model_id, cfg_worker["chunksize"], settle_s=cfg_worker["settle_s"])
+            time.sleep(cfg_worker["poll_interval_s"])
+    except KeyboardInterrupt:
+        ErrorHandler.log("Stopping workers (running jobs resume from their last checkpoint)")
+    finally:
+        for p in workers:
+            p.terminate()
+            p.join()
+    ErrorHandler.log(f"Jobs : {queue.counts()}")
+
+
+def main():
+    cfg_worker = FileManager.load_config()["worker"]
+    ap = argparse.ArgumentParser("Durable scoring worker : score the review files dropped in spool/incoming (csv, jsonl, parquet with a 'text' column) into spool/done, resuming interrupted files from their last checkpoint")
+    ap.add_argument("--model_type", type=EModelType, choices=list(EModelType), default=EModelType(cfg_worker["model_type"]), help="Type of model scoring the new files")
+    ap.add_argument("--model_id",   type=str,   default="",                         help="Id of the model scoring the new files (default: latest model at submission time).")
+    ap.add_argument("--processes",  type=int,   default=cfg_worker["processes"],    help="Number of worker processes (jobs scored in parallel)")
+    ap.add_argument("--submit",     type=str,   nargs="+",                          help="Move these files to the spool and enqueue them, then exit")
+    ap.add_argument("--once",       action="store_true",                            help="Score the queued and incoming files then exit (instead of watching the spool)")
+    ap.add_argument("--status",     action="store_true",                            help="Print the jobs and exit")
+    args = ap.parse_args()
+
+    if args.status:
+        init_logging()
+        for job in open_queue(cfg_worker).jobs():
+            print(f"{job['id']:>5} {job['status']:>8} {job['rows_done']:>9} rows  {job['model_type']}:{job['model_id']}  {Path(job['path']).name}  {job['error'] or ''}")
+        return
+    if args.submit:
+        init_logging()
+        queue = open_queue(cfg_worker)
+        for path in args.submit:
+            try:
+                submit_file(queue, path, args.model_type, args.model_id, cfg_worker["chunksize"])
+            except ValueError as e:
+                ErrorHandler.fatal("Cannot submit", exception=e)
+        return
+
+    run_workers(model_type=args.model_type, model_id=args.model_id, processes=args.processes, once=args.once)
+
+
+if __name__ == "__main__":
+    main()
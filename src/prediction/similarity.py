@@ -0,0 +1,186 @@
+import os
+import time
+import argparse
+import numpy as np
+from scipy import sparse
+
+# -- internal
+from src.utils.ErrorHandler import ErrorHandler
+from src.utils.FileManager import FileManager
+from src.utils.enums import EModelType
+from src.utils.utils import init_model_id_context
+from src.utils.prediction_methods import embed_lora
+from src.data.data import load_imdb, load_imdb_unlabeled
+from src.data.profiling import iter_chunks
+
+EMBEDDINGS_FILE:    str = "embeddings.f16"      # raw float16 matrix (n, dim), memory-mapped at query time
+IVF_FILE:           str = "ivf.npz"             # centroids + rows grouped by inverted list
+TEXTS_FILE:         str = "texts.bin"           # utf-8 texts, concatenated
+TEXT_OFFSETS_FILE:  str = "text_offsets.npy"    # text i = texts[offsets[i]:offsets[i+1]]
+
+
+def spherical_kmeans(vectors: np.ndarray, n_clusters: int, n_iter: int = 10, seed: int = 42) -> np.ndarray:
+    """K-means on L2 normalized vectors (cosine similarity), returns the normalized centroids (n_clusters, dim)"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        # sum of the vectors of each cluster : (n_clusters, n) one-hot sparse matrix x vectors
+        one_hot = sparse.csr_matrix((np.ones(len(vectors), dtype=np.float32), (assign, np.arange(len(vectors)))), shape=(n_clusters, len(vectors)))
+        sums = np.asarray(one_hot @ vectors)
+        counts = np.bincount(assign, minlength=n_clusters)
+        # empty clusters are re-seeded with random vectors
+        empty = counts == 0
+        sums[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()), replace=False)]
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return centroids.astype(np.float32)
+
+
+class IVFIndex:
+    """
+    Inverted file index over memory-mapped float16 embeddings : the vectors are clustered (spherical k-means), a
+    query only scans the rows of its 'nprobe' closest clusters. The embedding matrix is mapped read-only, so
+    its pages are loaded lazily and shared by every process serving the same index.
+    """
+
+    def __init__(self, dirpath: str):
+        self.dirpath = dirpath
+        with np.load(os.path.join(dirpath, IVF_FILE)) as ivf:
+            self.centroids  = ivf["centroids"]
+            self.offsets    = ivf["offsets"]
+            self.rows       = ivf["rows"]
+        n, dim = len(self.rows), self.centroids.shape[1]
+        self.embeddings     = np.memmap(os.path.join(dirpath, EMBEDDINGS_FILE), dtype=np.float16, mode="r", shape=(n, dim))
+        self.texts          = np.memmap(os.path.join(dirpath, TEXTS_FILE), dtype=np.uint8, mode="r")
+        self.text_offsets   = np.load(os.path.join(dirpath, TEXT_OFFSETS_FILE), mmap_mode="r")
+
+    def __len__(self):
+        return len(self.rows)
+
+    def search(self, queries: np.ndarray, k: int = 10, nprobe: int = 8):
+        """
+        Approximate top-k rows by cosine similarity.
+
+        Args:
+            queries (np.ndarray)    : L2 normalized query vectors (n_queries, dim)
+            k (int)                 : number of neighbours
+            nprobe (int)            : number of clusters scanned per query
+
+        Returns:
+            list[np.ndarray] : rows of the neighbours of each query (best first)
+            list[np.ndarray] : cosine similarities of the neighbours
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        nprobe = min(nprobe, len(self.centroids))
+        probes = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+
+        all_rows, all_scores = [], []
+        for query, lists in zip(queries, probes):
+            candidates = np.sort(np.concatenate([self.rows[self.offsets[l]:self.offsets[l + 1]] for l in lists]))
+            if len(candidates) == 0:
+                all_rows.append(np.empty(0, dtype=np.int64))
+                all_scores.append(np.empty(0, dtype=np.float32))
+                continue
+            scores = self.embeddings[candidates].astype(np.float32) @ query
+            top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            all_rows.append(candidates[top])
+            all_scores.append(scores[top])
+        return all_rows, all_scores
+
+    def get_text(self, row: int) -> str:
+        return bytes(self.texts[self.text_offsets[row]:self.text_offsets[row + 1]]).decode("utf-8")
+
+
+def iter_texts(source: str, files: list = None, chunksize: int = 10000, text_col: str = "text"):
+    """Texts to index, by chunks : IMDB splits ('train', 'test', 'unsupervised', 'all') or files (csv / jsonl / parquet)"""
+    if files:
+        for path in files:
+            for chunk in iter_chunks(path, chunksize=chunksize):
+                yield chunk[text_col].fillna("").astype(str).tolist()
+        return
+    splits = ["train", "test", "unsupervised"] if source == "all" else [source]
+    for split in splits:
+        df = load_imdb_unlabeled() if split == "unsupervised" else load_imdb()[0 if split == "train" else 1]
+        for i in range(0, len(df), chunksize):
+            yield df["text"].iloc[i:i+chunksize].tolist()
+
+
+def build_index(model_id: str, name: str, source: str = "all", files: list = None, batch_size: int = 64,
+                n_lists: int = 0, sample_size: int = 100000, n_iter: int = 10):
+    """
+    Embed texts with a lora model (pre-classifier vectors) and build an IVF similarity index.
+
+    Args:
+        model_id (str)      : id of the lora model (default: latest)
+        name (str)          : name of the index
+        source (str)        : IMDB split(s) to index, when no files are provided
+        files (list[str])   : files to index instead of IMDB
+        batch_size (int)    : size of the embedding batches
+        n_lists (int)       : number of clusters (0 = 4 x sqrt(n))
+        sample_size (int)   : vectors used to train the clusters
+        n_iter (int)        : k-means iterations
+
+    Returns:
+        str : path to the index directory
+    """
+    init_model_id_context(EModelType.LORA, model_id, use_last_model_id=True)
+    model_id = FileManager.get_model_id()
+    model, tokenizer = FileManager.load_lora(model_id)
+    dirpath = FileManager.get_embedding_index_dir(model_id, name)
+    cfg = FileManager.load_config()
+
+    # embeddings and texts are streamed to disk, chunk by chunk
+    n, text_offsets = 0, [0]
+    start = time.perf_counter()
+    with open(os.path.join(dirpath, EMBEDDINGS_FILE), "wb") as f_emb, open(os.path.join(dirpath, TEXTS_FILE), "wb") as f_txt:
+        for texts in iter_texts(source, files):
+            f_emb.write(embed_lora(model, tokenizer, texts, batch_size=batch_size).astype(np.float16).tobytes())
+            for text in texts:
+                encoded = text.encode("utf-8")
+                f_txt.write(encoded)
+                text_offsets.append(text_offsets[-1] + len(encoded))
+            n += len(texts)
+            ErrorHandler.log(f"Embedded {n} texts ({n / (time.perf_counter() - start):.1f} texts/sec)")
+    np.save(os.path.join(dirpath, TEXT_OFFSETS_FILE), np.asarray(text_offsets, dtype=np.int64))
+    if n == 0:
+        ErrorHandler.fatal("No text to index")
+
+    # clusters trained on a sample, then every row is assigned by chunks
+    dim = model.config.dim
+    embeddings = np.memmap(os.path.join(dirpath, EMBEDDINGS_FILE), dtype=np.float16, mode="r", shape=(n, dim))
+    n_lists = n_lists or max(1, min(int(4 * np.sqrt(n)), n))
+    rng = np.random.default_rng(cfg["seed"])
+    sample = np.sort(rng.choice(n, size=min(n, max(sample_size, n_lists)), replace=False))
+    centroids = spherical_kmeans(embeddings[sample].astype(np.float32), n_lists, n_iter=n_iter, seed=cfg["seed"])
+
+    assign = np.empty(n, dtype=np.int64)
+    for i in range(0, n, 100000):
+        assign[i:i+100000] = np.argmax(embeddings[i:i+100000].astype(np.float32) @ centroids.T, axis=1)
+    rows = np.argsort(assign, kind="stable")
+    offsets = np.zeros(n_lists + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(assign, minlength=n_lists))
+    np.savez(os.path.join(dirpath, IVF_FILE), centroids=centroids, offsets=offsets, rows=rows)
+
+    ErrorHandler.log(f"Built index '{name}' : {n} texts, {n_lists} lists, in {time.perf_counter() - start:.1f}s -> {dirpath}")
+    return dirpath
+
+
+def main():
+    cfg_similarity = FileManager.load_config()["similarity"]
+    ap = argparse.ArgumentParser("Build a similarity index (memory-mapped float16 embeddings + IVF) of reviews, queried by the API '/similar' endpoint")
+    ap.add_argument("--model_id",   type=str,                           help="Unique identifier of the lora model computing the embeddings (default: use latest model).")
+    ap.add_argument("--name",       type=str, default=cfg_similarity["index"], help="Name of the index.")
+    ap.add_argument("--source",     type=str, default="all", choices=["train", "test", "unsupervised", "all"], help="IMDB split(s) to index (default = all).")
+    ap.add_argument("--files",      type=str, nargs="+",                help="Files to index instead of IMDB (csv, jsonl, parquet with a 'text' column).")
+    ap.add_argument("--batch_size", type=int, default=64,               help="Size of the embedding batches (default = 64)")
+    ap.add_argument("--n_lists",    type=int, default=cfg_similarity["n_lists"], help="Number of clusters (0 = 4 x sqrt(number of texts)).")
+    ap.add_argument("--sample_size", type=int, default=cfg_similarity["sample_size"], help="Number of vectors used to train the clusters.")
+    args = ap.parse_args()
+
+    build_index(model_id=args.model_id, name=args.name, source=args.source, files=args.files, batch_size=args.batch_size,
+                n_lists=args.n_lists, sample_size=args.sample_size)
+
+
+if __name__ == "__main__":
+    main()
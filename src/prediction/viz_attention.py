@@ -1,68 +1,145 @@
+import os
+import html
 import argparse
-from transformers import AutoConfig, AutoTokenizer, AutoModelForSequenceClassification
+from functools import reduce
+from transformers import AutoConfig, AutoModelForSequenceClassification
+import numpy as np
 import torch
 # -- internal
 from src.utils.FileManager import FileManager
+from src.utils.ErrorHandler import ErrorHandler
 from src.utils.enums import EModelType
 from src.utils.utils import init_model_id_context
 
 
 def attention_rollout(attentions):
-    attn = torch.stack(attentions).mean(1)
-    eye = torch.eye(attn.size(-1))
-    aug = attn + eye
-    rollout = aug[0]
-    for i in range(1, aug.size(0)):
-        rollout = rollout @ aug[i]
-    return rollout
+    """
+    Compute the attention rollout of a batch of sequences.
+
+    Args:
+        attentions (tuple[torch.Tensor]) : attentions of each layer, shape (batch, heads, seq_len, seq_len)
+
+    Returns:
+        torch.Tensor : rollout of shape (batch, seq_len, seq_len)
+    """
+    attn = torch.stack(attentions).mean(2)                      # (layers, batch, seq_len, seq_len)
+    aug = attn + torch.eye(attn.size(-1), device=attn.device)
+    return reduce(torch.matmul, aug.unbind(0))                  # batched matmul chain over the layers
+
+
+def read_texts(path: str):
+    """Read the texts to analyse (one per line, empty lines are ignored)"""
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def to_html(tokens, scores):
+    """Write an html file content highlighting each token with its (normalized) score"""
+    # scale alpha to max 0.9 for readability
+    spans = [f"<span style='padding:2px 4px;background-color:rgba(255,0,0,{0.9*s:.3f})'>{html.escape(t)}</span>"
+             for t, s in zip(tokens, scores)]
+    rows = " ".join(spans)
+    return f"""
+    <html><body><h3>Attention rollout</h3><p>{rows}</p></body></html>
+    """
+
+
+def compute_attention_scores(model, tokenizer, texts, batch_size: int=16, max_length: int=None):
+    """
+    Compute the (normalized 0..1) attention rollout score of each token of each text, by batch.
+
+    Args:
+        model:                  model loaded with 'output_attentions=True'
+        tokenizer:              tokenizer of the model
+        texts (list[str]):      texts to analyse
+        batch_size (int):       size of the batches
+        max_length (int):       max number of tokens (default: tokenizer's model_max_length)
+
+    Returns:
+        list[np.ndarray] : token ids of each text
+        list[np.ndarray] : scores of each token of each text
+    """
+    device = next(model.parameters()).device
+    all_ids, all_scores = [], []
+    for i in range(0, len(texts), batch_size):
+        batch_texts = texts[i:i+batch_size]
+        tokens = tokenizer(batch_texts, return_tensors="pt", padding=True, truncation=True, max_length=max_length).to(device)
+        with torch.no_grad():
+            out = model(**tokens, output_attentions=True)
+            # CLS row of the rollout : contribution of each token to the sentence representation
+            scores = attention_rollout(out.attentions)[:, 0, :]
+
+            # normalize 0..1 on the real tokens only (padding excluded)
+            mask = tokens["attention_mask"].bool()
+            smin = scores.masked_fill(~mask, float("inf")).min(dim=1, keepdim=True).values
+            smax = scores.masked_fill(~mask, float("-inf")).max(dim=1, keepdim=True).values
+            scores = ((scores - smin) / (smax - smin + 1e-9)).cpu().numpy()
+
+        lengths = mask.sum(dim=1).tolist()
+        input_ids = tokens["input_ids"].cpu().numpy()
+        for j, n in enumerate(lengths):
+            all_ids.append(input_ids[j, :n].astype(np.int32))
+            all_scores.append(scores[j, :n].astype(np.float16))
+    return all_ids, all_scores
+
+
+def save_scores(path: str, all_ids, all_scores):
+    """
+    Save the token scores of every texts in a compact NumPy file : flat arrays 'token_ids' (int32) and
+    'scores' (float16), text i being [offsets[i]:offsets[i+1]].
+    """
+    offsets = np.zeros(len(all_ids) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(ids) for ids in all_ids])
+    FileManager.ensure_dir(os.path.dirname(path))
+    np.savez_compressed(path, token_ids=np.concatenate(all_ids), scores=np.concatenate(all_scores), offsets=offsets)
 
 
 def main():
     ap = argparse.ArgumentParser("Visualise the attention of a LoRA model ")
-    ap.add_argument("--text",       type=str, required=True, help="Text that you want to see analysed")
+    ap.add_argument("--text",       type=str, help="Text that you want to see analysed")
+    ap.add_argument("--texts_file", type=str, help="File containing the texts that you want to see analysed (one per line)")
+    ap.add_argument("--batch_size", type=int, default=16,   help="Size of the batches (default = 16)")
+    ap.add_argument("--max_length", type=int, default=None, help="Max number of tokens per text (default: inference max length of the model)")
     ap.add_argument("--model_id",   type=str, help="Unique identifier for this model that you want to use in the prediction (default: use latest model).")
     args = ap.parse_args()
-    
+
+    if (args.text is None) == (args.texts_file is None):
+        ap.error("exactly one of --text or --texts_file must be provided")
+
     # init context
     init_model_id_context(EModelType.LORA, args.model_id, use_last_model_id=True)
 
     # get path to the model (fatal error if not existing)
     model_path = FileManager.get_model_path(model_type=EModelType.LORA, model_id=FileManager.get_model_id(), must_exist=True);
-        
+
     # load tokenizer and model from the config files
-    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    tokenizer = FileManager.load_tokenizer(EModelType.LORA, FileManager.get_model_id(), model_path)
     config = AutoConfig.from_pretrained(model_path, output_attentions=True)
-    model = AutoModelForSequenceClassification.from_pretrained(model_path, config=config)
-    
-    # setup
-    tokens = tokenizer(args.text, return_tensors="pt", truncation=True)
-    out = model(**tokens, output_attentions=True)
-    rollout = attention_rollout(out.attentions)
-
-    idx_to_tok = tokenizer.convert_ids_to_tokens(tokens["input_ids"][0])
-    seq_len = len(idx_to_tok)
-    scores = rollout[0, 0, :seq_len].detach().cpu().numpy()
-    
-    # Normalize 0..1
-    smin, smax = float(scores.min()), float(scores.max())
-    scores = (scores - smin) / (smax - smin + 1e-9)
-
-    # write an html file content
-    spans = []
-    for t, s in zip(idx_to_tok, scores):
-        # scale alpha to max 0.9 for readability
-        spans.append(f"<span style='padding:2px 4px;background-color:rgba(255,0,0,{0.9*s:.3f})'>{t}</span>")
-    rows = " ".join(spans)
-    html = f"""
-    <html><body><h3>Attention rollout</h3><p>{rows}</p></body></html>
-    """
+    # eager attention : fused (sdpa) kernels do not return the attention weights
+    model = AutoModelForSequenceClassification.from_pretrained(model_path, config=config, attn_implementation="eager")
+    model.eval()
+
+    # compute rollout scores by batch
+    texts = [args.text] if args.text is not None else read_texts(args.texts_file)
+    all_ids, all_scores = compute_attention_scores(model, tokenizer, texts, batch_size=args.batch_size, max_length=args.max_length)
+
+    # single text : same report as before
+    if args.text is not None:
+        report_path = FileManager.get_model_reports_file(file_name=FileManager.ATTENTION_HTML_FILE, model_id=FileManager.get_model_id())
+        FileManager.write(report_path, content=to_html(tokenizer.convert_ids_to_tokens(all_ids[0]), all_scores[0]), append=False)
+        ErrorHandler.log("Saved : " + report_path)
+        return
 
-    # save html file content in reports (of the model)
-    report_path = FileManager.get_model_reports_file(file_name=FileManager.ATTENTION_HTML_FILE, model_id=FileManager.get_model_id())
-    FileManager.write(report_path, content=html, append=False)
+    # batch : one html per text + compact dump of all the scores
+    for i, (ids, scores) in enumerate(zip(all_ids, all_scores)):
+        report_path = FileManager.get_model_reports_file(file_name=os.path.join(FileManager.ATTENTION_DIR, f"attention_{i}.html"), model_id=FileManager.get_model_id())
+        FileManager.write(report_path, content=to_html(tokenizer.convert_ids_to_tokens(ids), scores.astype(np.float32)), append=False)
 
-    print("Saved : " + report_path)
+    scores_path = FileManager.get_model_reports_file(file_name=FileManager.ATTENTION_SCORES_FILE, model_id=FileManager.get_model_id())
+    save_scores(scores_path, all_ids, all_scores)
+    ErrorHandler.log(f"Saved {len(texts)} html reports in : {os.path.dirname(report_path)}")
+    ErrorHandler.log("Saved : " + scores_path)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,7 +1,6 @@
 import argparse
 import json
-import joblib
-from sklearn.linear_model import LogisticRegression
+from sklearn.linear_model import LogisticRegression, SGDClassifier
 from sklearn.pipeline import Pipeline
 from sklearn.metrics import accuracy_score, f1_score, classification_report
 from transformers.trainer import TRAINER_STATE_NAME
@@ -9,15 +8,26 @@ from datetime import datetime
 
 # -- internal
 from src.data.data import load_imdb
+from src.data.feedback import FeedbackLog
 from src.utils.FileManager import FileManager
 from src.utils.enums import EModelType
-from src.utils.prediction_methods import build_vectorizer
+from src.utils.prediction_methods import build_vectorizer, build_hashing_vectorizer
 from src.utils.ErrorHandler import ErrorHandler
-from src.utils.utils import set_seed, LABELS
+from src.utils.utils import set_seed, init_logging, LABELS
 
 
-def train_baseline(model_id: str):
+def build_online_pipeline(cfg: dict):
+    """Hashing features + logistic loss SGD : can be updated later with 'partial_fit' on new data only (see 'update_baseline')"""
+    cfg_online = cfg["baseline"]["online"]
+    return Pipeline([
+        ("hashing", build_hashing_vectorizer(n_features=cfg_online["n_features"], ngram_range=tuple(cfg["baseline"]["ngram_range"]))),
+        ("clf", SGDClassifier(loss="log_loss", alpha=cfg_online["alpha"], max_iter=cfg_online["max_iter"], random_state=cfg["seed"])),
+    ])
+
+
+def train_baseline(model_id: str, online: bool = False):
     FileManager.init(model_id)
+    init_logging()
     ErrorHandler.init(model_id)
     
     # loading config and setting seed
@@ -28,13 +38,18 @@ def train_baseline(model_id: str):
     train, test = load_imdb()
     
     # setup pipeline (vectorization + LogReg)  
-    pipe = Pipeline([
-        ("tfidf", build_vectorizer()),
-        ("clf", LogisticRegression(max_iter=cfg["baseline"]["max_iter"], C=cfg["baseline"]["C"], n_jobs=None)),
-    ])
+    if online:
+        pipe = build_online_pipeline(cfg)
+        # feedback already logged is not replayed by the first 'update_baseline' : it starts from the current end of the log
+        pipe.feedback_offset = FeedbackLog(FileManager.get_feedback_file()).end_offset()
+    else:
+        pipe = Pipeline([
+            ("tfidf", build_vectorizer()),
+            ("clf", LogisticRegression(max_iter=cfg["baseline"]["max_iter"], C=cfg["baseline"]["C"], n_jobs=None)),
+        ])
     
     # traning the baseline
-    ErrorHandler.log("Training baseline TF‑IDF + LogReg…")    
+    ErrorHandler.log("Training baseline hashing + SGD (updatable with feedback)…" if online else "Training baseline TF‑IDF + LogReg…")    
     pipe.fit(train["text"], train["label"])
     
     # make predictions on the "test" data and analyse the results
@@ -49,17 +64,18 @@ def train_baseline(model_id: str):
     # save the results in the "reports/" file
     FileManager.write_json(FileManager.get_model_results_file(), {"accuracy": acc, "f1": f1})
 
-    # save model
-    joblib.dump(pipe, FileManager.get_model_path(EModelType.BASELINE))
+    # save model (atomically : the API may be reloading the latest baseline)
+    FileManager.publish_baseline(pipe)
     
 
 def main():
     # setup training argumentes
     ap = argparse.ArgumentParser("Train a baseline TF‑IDF + LogReg model on the IMDB dataset")
     ap.add_argument("--model_id",       type=str,   default=str(int(datetime.now().timestamp() * 1e6)), help="Unique identifier for this model (default: current timestamp).")
+    ap.add_argument("--online",         action="store_true", help="Train the updatable variant (hashing features + SGD) that 'update_baseline' refines with the labeled feedback.")
     args = ap.parse_args()
     
-    train_baseline(args.model_id)
+    train_baseline(args.model_id, online=args.online)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,106 @@
+import argparse
+import torch
+import torch.nn.functional as F
+
+# -- internal
+from src.data.data import load_imdb
+from src.models.early_exit import EarlyExitHeads, run_layer, final_logits
+from src.utils.enums import EModelType
+from src.utils.utils import init_model_id_context, set_seed
+from src.utils.FileManager import FileManager
+from src.utils.ErrorHandler import ErrorHandler
+
+
+def train_early_exit(model_id: str = "", exit_layers=(1, 2, 3, 4, 5), epochs=1, batch_size=32, max_length=256, lr=1e-4,
+                     n_train=10000, alpha=0.5):
+    """
+    Train early exit heads on the intermediate layers of an existing (merged) LoRA model. The model itself is frozen :
+    each head learns from the labels and from the final classifier predictions (distillation).
+
+    Args:
+        model_id (str)          : id of the LoRA model (default: latest)
+        exit_layers (list[int]) : transformer layers (1-based) receiving an exit head
+        epochs (int)            : number of training epochs
+        batch_size (int)        : size of the batches
+        max_length (int)        : max number of tokens per text
+        lr (float)              : learning rate of the heads
+        n_train (int)           : number of training reviews (0 = full train split)
+        alpha (float)           : weight of the distillation loss (1 - alpha : cross entropy on labels)
+    """
+    # initialize context (logging, files, ...)
+    init_model_id_context(EModelType.LORA, model_id, use_last_model_id=True)
+    model_id = FileManager.get_model_id()
+    cfg = FileManager.load_config()
+    set_seed(cfg["seed"])
+
+    ErrorHandler.log(f"Training early exit heads on layers {list(exit_layers)} of model {model_id}")
+
+    # frozen base model (eager attention : layers are run one by one)
+    model, tokenizer = FileManager.load_lora(model_id, attn_implementation="eager")
+    model.requires_grad_(False)
+    device = next(model.parameters()).device
+
+    heads = EarlyExitHeads.from_model(model, exit_layers).to(device)
+    optimizer = torch.optim.AdamW(heads.parameters(), lr=lr)
+
+    train_df, _ = load_imdb()
+    if n_train and n_train < len(train_df):
+        train_df = train_df.sample(n=n_train, random_state=cfg["seed"])
+    texts, labels = train_df["text"].tolist(), torch.tensor(train_df["label"].tolist())
+
+    layers = model.distilbert.transformer.layer
+    for epoch in range(epochs):
+        heads.train()
+        order = torch.randperm(len(texts))
+        for step, i in enumerate(range(0, len(texts), batch_size)):
+            idx = order[i:i+batch_size]
+            inputs = tokenizer([texts[j] for j in idx], padding=True, truncation=True, max_length=max_length, return_tensors="pt").to(device)
+            batch_labels = labels[idx].to(device)
+
+            # frozen forward : keep the [CLS] hidden state of every exit layer
+            with torch.no_grad():
+                hidden, exit_hidden = model.distilbert.embeddings(inputs["input_ids"]), {}
+                for layer_idx, layer_module in enumerate(layers, start=1):
+                    hidden = run_layer(model, layer_module, hidden, inputs["attention_mask"])
+                    if layer_idx in exit_layers:
+                        exit_hidden[layer_idx] = hidden[:, :1]
+                teacher_probs = torch.softmax(final_logits(model, hidden), dim=-1)
+
+            loss = 0
+            for layer_idx, layer_hidden in exit_hidden.items():
+                logits = heads(layer_idx, layer_hidden)
+                kd = F.kl_div(F.log_softmax(logits, dim=-1), teacher_probs, reduction="batchmean")
+                loss = loss + alpha * kd + (1 - alpha) * F.cross_entropy(logits, batch_labels)
+
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            if step % 50 == 0:
+                ErrorHandler.log(f"epoch={epoch} step={step} loss={loss.item():.4f}")
+
+    heads.eval()
+    FileManager.save_early_exit_heads(heads.cpu(), model_id)
+    ErrorHandler.log(f"Saved early exit heads of model {model_id}")
+
+
+def main():
+    cfg = FileManager.load_config()
+    cfg_exit = cfg["early_exit"]
+
+    ap = argparse.ArgumentParser(description="Train early exit heads on the intermediate layers of a LoRA model. The training arguments can be found in the config file : configs/default.yaml")
+    ap.add_argument("--model_id",       type=str,   default="",                             help="Id of the LoRA model (default: use latest model).")
+    ap.add_argument("--exit_layers",    type=int,   default=cfg_exit["exit_layers"], nargs="+", help="Transformer layers (1-based) receiving an exit head.")
+    ap.add_argument("--epochs",         type=int,   default=cfg_exit["epochs"],             help="Number of training epochs.")
+    ap.add_argument("--batch_size",     type=int,   default=cfg_exit["batch_size"],         help="Batch size.")
+    ap.add_argument("--max_length",     type=int,   default=cfg_exit["max_length"],         help="Maximum sequence length for tokenization.")
+    ap.add_argument("--lr",             type=float, default=cfg_exit["lr"],                 help="Learning rate of the heads.")
+    ap.add_argument("--n_train",        type=int,   default=cfg_exit["n_train"],            help="Number of training reviews (0 = full train split).")
+    ap.add_argument("--alpha",          type=float, default=cfg_exit["alpha"],              help="Weight of the distillation loss (1 - alpha for the cross entropy on labels).")
+    args = ap.parse_args()
+
+    train_early_exit(model_id=args.model_id, exit_layers=args.exit_layers, epochs=args.epochs, batch_size=args.batch_size,
+                     max_length=args.max_length, lr=args.lr, n_train=args.n_train, alpha=args.alpha)
+
+
+if __name__ == "__main__":
+    main()
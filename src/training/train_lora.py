@@ -1,9 +1,11 @@
+import time
 import argparse
 import json
 import numpy as np
+import torch
 import datasets as ds
 import pandas as pd
-from transformers import (AutoTokenizer, AutoModelForSequenceClassification, TrainingArguments, Trainer)
+from transformers import (AutoTokenizer, AutoModelForSequenceClassification, TrainingArguments, Trainer, TrainerCallback)
 from peft import LoraConfig, get_peft_model
 from sklearn.metrics import accuracy_score, f1_score
 from datetime import datetime
@@ -16,7 +18,72 @@ from src.utils.FileManager import FileManager
 from src.utils.ErrorHandler import ErrorHandler
 
 
-def train_lora(model_id: str = "", epochs=2, batch_size=16, max_length=256, lr=2e-5, weight_decay=0.01, warmup_ratio=0.1):
+class ThroughputCallback(TrainerCallback):
+    """Log the training throughput (samples/sec, tokens/sec) every 'logging_steps' optimizer steps"""
+
+    def __init__(self, samples_per_step: int, tokens_per_sample: float, logging_steps: int = 50):
+        self.samples_per_step   = samples_per_step
+        self.tokens_per_sample  = tokens_per_sample
+        self.logging_steps      = logging_steps
+        self._start             = None
+        self._start_step        = 0
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        if self._start is None:
+            self._start, self._start_step = time.perf_counter(), state.global_step
+
+    def on_step_end(self, args, state, control, **kwargs):
+        if self.logging_steps <= 0 or state.global_step % self.logging_steps != 0 or self._start is None:
+            return
+        elapsed = time.perf_counter() - self._start
+        samples_per_sec = (state.global_step - self._start_step) * self.samples_per_step / max(elapsed, 1e-9)
+        ErrorHandler.log(f"step={state.global_step} samples/sec={samples_per_sec:.1f} tokens/sec={samples_per_sec * self.tokens_per_sample:.0f}")
+        self._start, self._start_step = time.perf_counter(), state.global_step
+
+
+def is_cpu_bf16_supported() -> bool:
+    """Check if the CPU has native bf16 instructions (AVX512-BF16 / AMX) - otherwise bf16 is emulated and slower than fp32"""
+    try:
+        with open("/proc/cpuinfo", "r", encoding="utf-8") as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+def get_training_profile(device: str = "auto", precision: str = "auto"):
+    """
+    Select the device and the mixed precision used for the training.
+
+    Args:
+        device (str)    : "auto" (cuda if available), "cuda" or "cpu"
+        precision (str) : "auto" (fp16 on GPU, bf16 on CPU if natively supported), "fp16", "bf16" or "fp32"
+
+    Returns:
+        bool : True if training on CPU
+        dict : mixed precision arguments of the TrainingArguments ('fp16' / 'bf16')
+    """
+    use_cpu = device == "cpu" or not torch.cuda.is_available()
+    if device == "cuda" and use_cpu:
+        ErrorHandler.warning("CUDA requested but not available : training on CPU")
+
+    if precision == "auto":
+        if not use_cpu:
+            precision = "fp16"
+        elif is_cpu_bf16_supported():
+            precision = "bf16"
+        else:
+            precision = "fp32"
+    if precision == "fp16" and use_cpu:
+        ErrorHandler.warning("fp16 is not supported on CPU : using fp32")
+        precision = "fp32"
+
+    return use_cpu, {"fp16": precision == "fp16", "bf16": precision == "bf16"}
+
+
+def train_lora(model_id: str = "", epochs=2, batch_size=16, max_length=256, lr=2e-5, weight_decay=0.01, warmup_ratio=0.1,
+               device="auto", precision="auto", torch_threads=0, dataloader_workers=0, grad_accum=1, 
+               gradient_checkpointing=False, throughput_logging_steps=50, resume=False, dedup=False):
     # initialize context (logging, files, ...)
     init_model_id_context(EModelType.LORA, model_id)
     
@@ -28,9 +95,27 @@ def train_lora(model_id: str = "", epochs=2, batch_size=16, max_length=256, lr=2
     
     ErrorHandler.log(f"Starting training for model {model_name} with id {model_id}")
 
+    # find checkpoint to resume from (optimizer / scheduler / RNG states, already processed batches are skipped)
+    checkpoint = ""
+    if resume:
+        checkpoint = FileManager.get_last_checkpoint(EModelType.LORA)
+        if not checkpoint:
+            ErrorHandler.fatal(f"No checkpoint found to resume model id {model_id} in : {FileManager.get_training_output_dirpath(EModelType.LORA)}")
+        ErrorHandler.log(f"Resuming from checkpoint : {checkpoint}")
+    
+    # keep the training outputs (checkpoints) of a limited number of runs
+    FileManager.prune_training_outputs(EModelType.LORA, keep=cfg_lora["keep_training_runs"])
+
+    # device / precision / threads
+    use_cpu, precision_args = get_training_profile(device, precision)
+    if torch_threads > 0:
+        torch.set_num_threads(torch_threads)
+    ErrorHandler.log(f"Training profile : {'cpu' if use_cpu else 'cuda'} {precision_args} threads={torch.get_num_threads()} "
+                     f"dataloader_workers={dataloader_workers} grad_accum={grad_accum} gradient_checkpointing={gradient_checkpointing}")
+
     # setup dataset
     tokenizer = AutoTokenizer.from_pretrained(model_name)
-    train_ds, test_ds = prepare_dataset("imdb", tokenizer, max_length);
+    train_ds, val_ds = prepare_dataset("imdb", tokenizer, max_length, dedup=dedup, val_ratio=cfg_lora["val_ratio"]);
 
     # loaf pretrained model and set lables
     base = AutoModelForSequenceClassification.from_pretrained(model_name, num_labels=2)
@@ -38,6 +123,8 @@ def train_lora(model_id: str = "", epochs=2, batch_size=16, max_length=256, lr=2
     model = get_peft_model(base, peft_conf)
 
     # setup training arguments
+    checkpoint_steps = cfg_lora["checkpoint_steps"]
+    eval_strategy = "steps" if checkpoint_steps else "epoch"
     args = TrainingArguments(
         output_dir                  = FileManager.get_training_output_dirpath(model_type=EModelType.LORA),
         logging_dir                 = FileManager.get_training_output_dirpath(model_type=EModelType.LORA),
@@ -46,13 +133,21 @@ def train_lora(model_id: str = "", epochs=2, batch_size=16, max_length=256, lr=2
         per_device_eval_batch_size  = batch_size,                       # Evaluation batch size per device (GPU/CPU)
         num_train_epochs            = epochs,                           # Number of training epochs
         weight_decay                = weight_decay,                     # Weight decay for regularization
-        eval_strategy               = "epoch",                          # Evaluate at each epoch
-        save_strategy               = "epoch",                          # Save at each epoch
+        eval_strategy               = eval_strategy,                    # Evaluate at each epoch (or every 'checkpoint_steps')
+        save_strategy               = eval_strategy,                    # Save at each epoch (or every 'checkpoint_steps')
+        eval_steps                  = checkpoint_steps or None,
+        save_steps                  = checkpoint_steps or None,
+        save_total_limit            = cfg_lora["save_total_limit"],     # Max checkpoints kept for this run (best one is always kept)
         logging_steps               = 50,                               # Interval for logging updates
         load_best_model_at_end      = True,                             # Load the best model based on accuracy
         report_to                   = "none",                           # Disable reporting to Hugging Face Hub
         push_to_hub                 = False,                            # Do not push to Hugging Face Hub
-        fp16                        = True                              # Enable mixed precision
+        use_cpu                     = use_cpu,                          # Train on CPU (no GPU or explicitly requested)
+        gradient_accumulation_steps = grad_accum,                       # Effective batch size = batch_size x grad_accum
+        gradient_checkpointing      = gradient_checkpointing,           # Recompute activations in backward (less memory, slower steps)
+        gradient_checkpointing_kwargs = {"use_reentrant": False},       # Required with frozen (LoRA) base weights
+        dataloader_num_workers      = dataloader_workers,               # Processes preparing the batches
+        **precision_args                                                # Mixed precision (fp16 on GPU, bf16 on supported CPUs)
     )
 
     # setup Trainer that will retrain the base model
@@ -60,15 +155,18 @@ def train_lora(model_id: str = "", epochs=2, batch_size=16, max_length=256, lr=2
         model           = model, 
         args            = args, 
         train_dataset   = train_ds, 
-        eval_dataset    = test_ds,
+        eval_dataset    = val_ds,                                       # checkpoints selected on a split of train (test set kept for 'evaluate')
         tokenizer       = tokenizer, 
-        compute_metrics = compute_metrics
+        compute_metrics = compute_metrics,
+        callbacks       = [ThroughputCallback(samples_per_step=batch_size * grad_accum, 
+                                              tokens_per_sample=float(np.mean([len(ids) for ids in train_ds["input_ids"]])),
+                                              logging_steps=throughput_logging_steps)],
     )
     
     # start the traning
-    trainer.train()
+    trainer.train(resume_from_checkpoint=checkpoint or None)
     
-    # evaluate the models performance and save in a json local file
+    # evaluate the models performance (validation set) and save in a json local file
     FileManager.write_json(FileManager.get_model_results_file(), trainer.evaluate())
 
     # save the model with all the related config
@@ -76,6 +174,7 @@ def train_lora(model_id: str = "", epochs=2, batch_size=16, max_length=256, lr=2
     model = model.merge_and_unload()      # merge LoRA weights into DistilBERT
     model.save_pretrained(model_path)     # now its a full Hugging Face model
     tokenizer.save_pretrained(model_path)
+    FileManager.update_model_metadata(EModelType.LORA, model_id, max_length=max_length)
 
 
 def compute_metrics(eval_pred):
@@ -95,12 +194,31 @@ def main():
     ap.add_argument("--batch_size",     type=int,   default=cfg_lora["batch_size"],     help="Batch size per device for training and evaluation.")
     ap.add_argument("--max_length",     type=int,   default=cfg_lora["max_length"],     help="Maximum sequence length for tokenization.")
     ap.add_argument("--lr",             type=float, default=cfg_lora["lr"],             help="Learning rate for the AdamW optimizer.")
+    # -- training profile (CPU / GPU)
+    ap.add_argument("--device",         type=str,   default=cfg_lora["device"],         choices=["auto", "cpu", "cuda"],                help="Device used for the training.")
+    ap.add_argument("--precision",      type=str,   default=cfg_lora["precision"],      choices=["auto", "fp16", "bf16", "fp32"],       help="Mixed precision (auto : fp16 on GPU, bf16 on CPU if natively supported).")
+    ap.add_argument("--torch_threads",  type=int,   default=cfg_lora["torch_threads"],  help="Number of torch threads (0 = torch default).")
+    ap.add_argument("--dataloader_workers", type=int, default=cfg_lora["dataloader_workers"], help="Number of dataloader worker processes.")
+    ap.add_argument("--grad_accum",     type=int,   default=cfg_lora["gradient_accumulation_steps"], help="Gradient accumulation steps (effective batch size = batch_size x grad_accum).")
+    ap.add_argument("--gradient_checkpointing", action=argparse.BooleanOptionalAction, default=cfg_lora["gradient_checkpointing"], help="Recompute activations during backward to save memory.")
     
-    ap.add_argument("--model_id",       type=str,   default=str(int(datetime.now().timestamp() * 1e6)), help="Unique identifier for this model (default: current timestamp).")
+    ap.add_argument("--dedup",          action=argparse.BooleanOptionalAction, default=cfg_lora["dedup"], help="Drop near-duplicate training reviews (and reviews overlapping the test set) before tokenization.")
+    ap.add_argument("--resume",         action="store_true",                            help="Resume the training of '--model_id' from its latest checkpoint.")
+    
+    ap.add_argument("--model_id",       type=str,   default=None,                       help="Unique identifier for this model (default: current timestamp).")
     args = ap.parse_args()
     
+    if args.model_id is None:
+        if args.resume:
+            ap.error("--resume requires the --model_id of the training to resume")
+        args.model_id = str(int(datetime.now().timestamp() * 1e6))
+    
     # start training
-    train_lora(model_id=args.model_id, epochs=args.epochs, batch_size=args.batch_size, max_length=args.max_length, lr=args.lr)
+    train_lora(model_id=args.model_id, epochs=args.epochs, batch_size=args.batch_size, max_length=args.max_length, lr=args.lr,
+               weight_decay=cfg_lora["weight_decay"], warmup_ratio=cfg_lora["warmup_ratio"],
+               device=args.device, precision=args.precision, torch_threads=args.torch_threads, dataloader_workers=args.dataloader_workers,
+               grad_accum=args.grad_accum, gradient_checkpointing=args.gradient_checkpointing, 
+               throughput_logging_steps=cfg_lora["throughput_logging_steps"], resume=args.resume, dedup=args.dedup)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,163 @@
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn.functional as F
+from sklearn.metrics import accuracy_score, f1_score
+from datetime import datetime
+
+# -- internal
+from src.data.data import load_imdb, load_imdb_unlabeled
+from src.models.student import StudentClassifier
+from src.utils.enums import EModelType
+from src.utils.utils import init_model_id_context, set_seed
+from src.utils.FileManager import FileManager
+from src.utils.ErrorHandler import ErrorHandler
+from src.utils.prediction_methods import predict_proba_lora, predict_proba_student
+
+# label of the unlabeled reviews (ignored by the cross entropy)
+NO_LABEL = -100
+
+
+def compute_teacher_logits(teacher, tokenizer, texts, batch_size: int, max_length: int):
+    """Compute (once) the logits of the teacher on every training text"""
+    device = next(teacher.parameters()).device
+    logits = []
+    for i in range(0, len(texts), batch_size):
+        inputs = tokenizer(texts[i:i+batch_size], padding=True, truncation=True, max_length=max_length, return_tensors="pt").to(device)
+        with torch.no_grad():
+            logits.append(teacher(**inputs).logits.float().cpu())
+        if (i // batch_size) % 100 == 0:
+            ErrorHandler.log(f"Teacher logits : {i}/{len(texts)}")
+    return torch.cat(logits)
+
+
+def distillation_loss(student_logits, teacher_logits, labels, temperature: float, alpha: float):
+    """
+    alpha * KL(teacher || student) on temperature-softened distributions + (1 - alpha) * cross entropy on the
+    labeled reviews (unlabeled reviews only contribute to the first term)
+    """
+    kd = F.kl_div(F.log_softmax(student_logits / temperature, dim=-1), F.softmax(teacher_logits / temperature, dim=-1),
+                  reduction="batchmean") * temperature ** 2
+    if (labels != NO_LABEL).any():
+        ce = F.cross_entropy(student_logits, labels, ignore_index=NO_LABEL)
+    else:
+        ce = torch.zeros((), device=student_logits.device)
+    return alpha * kd + (1 - alpha) * ce
+
+
+def timed_predictions(predict_fn, texts):
+    """Run predictions and measure the throughput"""
+    start = time.perf_counter()
+    probs = predict_fn(texts)
+    elapsed = time.perf_counter() - start
+    return probs, elapsed
+
+
+def train_student(model_id: str = "", teacher_id: str = "", epochs=3, batch_size=64, max_length=256, lr=1e-3,
+                  temperature=2.0, alpha=0.5, n_unlabeled=20000, n_eval=2000):
+    # initialize context (logging, files, ...)
+    init_model_id_context(EModelType.STUDENT, model_id)
+
+    # load configs
+    cfg = FileManager.load_config()
+    cfg_student = cfg["student"]
+    set_seed(cfg["seed"])
+
+    if not teacher_id:
+        teacher_id = FileManager.get_last_model_id(EModelType.LORA)
+    ErrorHandler.log(f"Starting distillation of LoRA teacher {teacher_id} into student {model_id}")
+
+    # load teacher (its tokenizer is shared with the student)
+    teacher, tokenizer = FileManager.load_lora(teacher_id)
+    device = next(teacher.parameters()).device
+
+    # training texts : IMDB train split + unlabeled reviews
+    train_df, test_df = load_imdb()
+    unlabeled_df = load_imdb_unlabeled(n_samples=n_unlabeled) if n_unlabeled else pd.DataFrame(columns=["text"])
+    texts = train_df["text"].tolist() + unlabeled_df["text"].tolist()
+    labels = torch.tensor(train_df["label"].tolist() + [NO_LABEL] * len(unlabeled_df))
+
+    # soft targets
+    teacher_logits = compute_teacher_logits(teacher, tokenizer, texts, batch_size=batch_size, max_length=max_length)
+
+    # student initialized with the teacher's word embeddings
+    student = StudentClassifier.from_teacher(teacher, hidden_dim=cfg_student["hidden_dim"], dropout=cfg_student["dropout"]).to(device)
+    optimizer = torch.optim.AdamW([p for p in student.parameters() if p.requires_grad], lr=lr, weight_decay=cfg_student["weight_decay"])
+
+    # training loop
+    for epoch in range(epochs):
+        student.train()
+        order = torch.randperm(len(texts))
+        total_loss = 0.0
+        for step, i in enumerate(range(0, len(texts), batch_size)):
+            idx = order[i:i+batch_size]
+            inputs = tokenizer([texts[j] for j in idx], padding=True, truncation=True, max_length=max_length, return_tensors="pt").to(device)
+            logits = student(input_ids=inputs["input_ids"], attention_mask=inputs["attention_mask"])
+            loss = distillation_loss(logits, teacher_logits[idx].to(device), labels[idx].to(device), temperature, alpha)
+
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item()
+            if step % 50 == 0:
+                ErrorHandler.log(f"epoch={epoch} step={step} loss={loss.item():.4f}")
+        ErrorHandler.log(f"epoch={epoch} mean loss={total_loss / (step + 1):.4f}")
+    student.eval()
+
+    # save the model with its tokenizer
+    model_path = FileManager.get_model_path(EModelType.STUDENT)
+    FileManager.save_student(student.cpu(), tokenizer, model_path)
+    FileManager.update_model_metadata(EModelType.STUDENT, model_id, max_length=max_length, teacher_id=teacher_id)
+    student.to(device)
+
+    # speed / accuracy report against the teacher (on a sample of the test split)
+    eval_df = test_df.sample(n=min(n_eval, len(test_df)), random_state=cfg["seed"]) if n_eval else test_df
+    eval_texts = eval_df["text"].tolist()
+    report = {"teacher_id": teacher_id, "n_eval": len(eval_texts)}
+    preds = {}
+    for name, predict_fn in (("teacher", lambda t: predict_proba_lora(teacher, tokenizer, t, batch_size=batch_size)),
+                             ("student", lambda t: predict_proba_student(student, tokenizer, t, batch_size=batch_size))):
+        probs, elapsed = timed_predictions(predict_fn, eval_texts)
+        preds[name] = np.argmax(probs, axis=1)
+        report[name] = {
+            "accuracy":         accuracy_score(eval_df["label"], preds[name]),
+            "f1":               f1_score(eval_df["label"], preds[name]),
+            "samples_per_sec":  len(eval_texts) / elapsed,
+        }
+    report["agreement"] = float(np.mean(preds["teacher"] == preds["student"]))
+    report["speedup"] = report["student"]["samples_per_sec"] / report["teacher"]["samples_per_sec"]
+
+    ErrorHandler.log(f"Student report : {report}")
+    FileManager.write_json(FileManager.get_model_results_file(), report)
+
+
+def main():
+    # load configuration from config file (configs/default.yaml)
+    cfg = FileManager.load_config()
+    cfg_student = cfg["student"]
+
+    # setup training argumentes
+    ap = argparse.ArgumentParser(description="Distill a LoRA model (teacher) into a small BiGRU student over its word embeddings. The training arguments can be found in the config file : configs/default.yaml")
+    ap.add_argument("--teacher_id",     type=str,   default="",                             help="Id of the LoRA model used as teacher (default: use latest LoRA model).")
+    ap.add_argument("--epochs",         type=int,   default=cfg_student["epochs"],          help="Number of training epochs.")
+    ap.add_argument("--batch_size",     type=int,   default=cfg_student["batch_size"],      help="Batch size for training and evaluation.")
+    ap.add_argument("--max_length",     type=int,   default=cfg_student["max_length"],      help="Maximum sequence length for tokenization.")
+    ap.add_argument("--lr",             type=float, default=cfg_student["lr"],              help="Learning rate for the AdamW optimizer.")
+    ap.add_argument("--temperature",    type=float, default=cfg_student["temperature"],     help="Softmax temperature applied to teacher and student logits.")
+    ap.add_argument("--alpha",          type=float, default=cfg_student["alpha"],           help="Weight of the distillation loss (1 - alpha for the cross entropy on labels).")
+    ap.add_argument("--n_unlabeled",    type=int,   default=cfg_student["n_unlabeled"],     help="Number of unlabeled IMDB reviews added to the training set (0 = none).")
+    ap.add_argument("--n_eval",         type=int,   default=cfg_student["n_eval"],          help="Number of test reviews used for the speed / accuracy report (0 = all).")
+
+    ap.add_argument("--model_id",       type=str,   default=str(int(datetime.now().timestamp() * 1e6)), help="Unique identifier for this model (default: current timestamp).")
+    args = ap.parse_args()
+
+    # start training
+    train_student(model_id=args.model_id, teacher_id=args.teacher_id, epochs=args.epochs, batch_size=args.batch_size,
+                  max_length=args.max_length, lr=args.lr, temperature=args.temperature, alpha=args.alpha,
+                  n_unlabeled=args.n_unlabeled, n_eval=args.n_eval)
+
+
+if __name__ == "__main__":
+    main()
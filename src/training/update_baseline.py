@@ -0,0 +1,82 @@
+import argparse
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+from datetime import datetime
+
+# -- internal
+from src.data.feedback import FeedbackLog
+from src.utils.FileManager import FileManager
+from src.utils.enums import EModelType
+from src.utils.ErrorHandler import ErrorHandler
+from src.utils.utils import set_seed, init_logging
+
+CLASSES = np.array([0, 1])
+
+
+def update_baseline(model_id: str, base_model_id: str = "", epochs: int = 1, min_samples: int = 1):
+    """
+    Update an online baseline (hashing features + SGD, see 'train_baseline --online') with the feedback logged
+    since its last update : partial fits over the new reviews only, no vocabulary refit. The updated model is
+    published atomically as a new baseline artifact (picked up by the API without restarting).
+
+    Args:
+        model_id (str)      : id of the published model
+        base_model_id (str) : id of the model to update (default: latest baseline)
+        epochs (int)        : passes of 'partial_fit' over the new reviews
+        min_samples (int)   : min number of new reviews required to publish a new version
+
+    Returns:
+        str : id of the published model ("" if nothing was published)
+    """
+    FileManager.init(model_id)
+    init_logging()
+    ErrorHandler.init(model_id)
+    cfg = FileManager.load_config()
+    set_seed(cfg["seed"])
+
+    if not base_model_id:
+        base_model_id = FileManager.get_last_model_id(EModelType.BASELINE)
+    if not base_model_id:
+        ErrorHandler.fatal("No baseline model to update (run 'train_baseline --online' first)")
+    pipe = FileManager.load_model(EModelType.BASELINE, base_model_id)
+    if not isinstance(pipe.steps[0][1], HashingVectorizer) or not hasattr(pipe.steps[-1][1], "partial_fit"):
+        ErrorHandler.fatal(f"Baseline {base_model_id} cannot be updated incrementally (run 'train_baseline --online' first)")
+
+    # feedback logged since the last update of this model
+    offset = getattr(pipe, "feedback_offset", 0)
+    feedback, new_offset = FeedbackLog(FileManager.get_feedback_file()).read_from(offset)
+    if len(feedback) < min_samples:
+        ErrorHandler.log(f"{len(feedback)} new feedback reviews (min {min_samples}) : baseline {base_model_id} is up to date")
+        return ""
+
+    # fixed feature space : the vectorizer is stateless
+    features = pipe.steps[0][1].transform(feedback["text"])
+    labels = feedback["label"].to_numpy(dtype=np.int64)
+    clf = pipe.steps[-1][1]
+    for _ in range(epochs):
+        order = np.random.permutation(len(labels))
+        clf.partial_fit(features[order], labels[order], classes=CLASSES)
+    ErrorHandler.log(f"Updated baseline {base_model_id} with {len(feedback)} feedback reviews ({epochs} epoch(s))")
+
+    # the offset travels with the model : the next update starts where this one stopped
+    pipe.feedback_offset = new_offset
+    pipe.base_model_id = base_model_id
+    path = FileManager.publish_baseline(pipe, model_id)
+    ErrorHandler.log("Published : " + path)
+    return model_id
+
+
+def main():
+    cfg_online = FileManager.load_config()["baseline"]["online"]
+    ap = argparse.ArgumentParser("Update the online baseline with the labeled feedback logged since its last update, and publish it as a new baseline")
+    ap.add_argument("--base_model_id",  type=str,   default="",                             help="Id of the baseline to update (default: latest baseline).")
+    ap.add_argument("--epochs",         type=int,   default=cfg_online["feedback_epochs"],  help="Passes of partial_fit over the new feedback.")
+    ap.add_argument("--min_samples",    type=int,   default=cfg_online["min_samples"],      help="Min number of new feedback reviews required to publish a new version.")
+    ap.add_argument("--model_id",       type=str,   default=str(int(datetime.now().timestamp() * 1e6)), help="Unique identifier for the published model (default: current timestamp).")
+    args = ap.parse_args()
+
+    update_baseline(model_id=args.model_id, base_model_id=args.base_model_id, epochs=args.epochs, min_samples=args.min_samples)
+
+
+if __name__ == "__main__":
+    main()
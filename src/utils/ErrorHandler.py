@@ -1,46 +1,231 @@
 import os
+import sys
+import atexit
+import time
+import queue
+import random
+import threading
 from pathlib import Path
-from datetime import datetime
-from tkinter import E
+from contextvars import ContextVar
 from loguru import logger
 
 # -- internal
 from src.utils.enums import EErrorLevel
 
 
+class BoundedQueueSink:
+    """
+    Loguru sink that hands formatted messages to a bounded queue consumed by a background thread.
+    The caller never waits on disk / terminal I/O : when the queue is full, the message is dropped
+    and counted instead of blocking the hot path.
+    """
+
+    def __init__(self, path: str = None, stream = None, maxsize: int = 10000, rotation_bytes: int = 1_000_000):
+        self.path           = path
+        self.stream         = stream
+        self.rotation_bytes = rotation_bytes
+        self.dropped        = 0
+        self._queue         = queue.Queue(maxsize=maxsize)
+        self._file          = None
+        self._thread        = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __call__(self, message):
+        try:
+            self._queue.put_nowait(str(message))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            message = self._queue.get()
+            if message is None:
+                break
+            try:
+                self._write(message)
+            except Exception:
+                # logging must never take down the process
+                pass
+        if self._file is not None:
+            self._file.close()
+
+    def _write(self, message: str):
+        if self.stream is not None:
+            self.stream.write(message)
+            # only flush once the burst has been consumed
+            if self._queue.empty():
+                self.stream.flush()
+            return
+
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(message)
+        if self._queue.empty():
+            self._file.flush()
+
+        # simple size based rotation (same behavior as loguru's rotation="1 MB")
+        if self.rotation_bytes and self._file.tell() > self.rotation_bytes:
+            self._file.close()
+            os.replace(self.path, f"{self.path}.{int(time.time() * 1e6)}")
+            self._file = None
+
+    def stop(self):
+        """Flush pending messages and stop the background thread"""
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+
 class ErrorHandler:
-    _initialized:    bool        = False
-    
+    _initialized:   bool        = False
+    _configured:    bool        = False
+    # -- settings
+    _json:          bool        = False
+    _queue_size:    int         = 10000
+    _sample_rate:   float       = 1.0
+    # -- registered sinks (key -> (loguru handler id, sink))
+    _sinks:         dict        = {}
+    _lock:          threading.Lock = threading.Lock()
+    # -- per-request correlation id
+    _request_id:    ContextVar  = ContextVar("request_id", default="-")
+
+    TEXT_FORMAT:    str         = "{time:YYYY-MM-DD HH:mm:ss.SSS} | {level: <8} | {extra[request_id]} | {message}\n{exception}"
+
+    @staticmethod
+    def configure(json_logs: bool = False, queue_size: int = 10000, sample_rate: float = 1.0):
+        """
+        Setup the logging mode. Must be called before 'init' to be taken into account by the file sinks.
+
+        Args:
+            json_logs   (bool)  : write one JSON object per line (structured logs) instead of plain text
+            queue_size  (int)   : max number of pending messages per sink (messages are dropped when full)
+            sample_rate (float) : default proportion [0, 1] of sampled events that are kept (see 'sample')
+        """
+        with ErrorHandler._lock:
+            ErrorHandler._json          = json_logs
+            ErrorHandler._queue_size    = queue_size
+            ErrorHandler._sample_rate   = sample_rate
+
+            # inject the correlation id in every record
+            logger.configure(patcher=ErrorHandler._patch_record)
+
+            # replace loguru's default (synchronous) console sink by a queued one
+            if not ErrorHandler._configured:
+                try:
+                    logger.remove(0)
+                except ValueError:
+                    pass
+                atexit.register(ErrorHandler.shutdown)
+            ErrorHandler._add_sink("console", lambda: BoundedQueueSink(stream=sys.stderr, maxsize=queue_size))
+            ErrorHandler._configured = True
+
+    @staticmethod
+    def is_configured() -> bool:
+        return ErrorHandler._configured
+
     @staticmethod
     def init(model_id: str):
-        dirpath = os.path.join("reports", "errorlogs");
-        p = Path(dirpath)
-        p.mkdir(parents=True, exist_ok=True)
-        logger.add(os.path.join(dirpath,  f"errorlogs_{model_id}.log"), rotation="1 MB", encoding="utf-8", enqueue=True)
+        """
+        Register the log file of the provided model id. Calling it several times with the
+        same id is a no-op (sinks are only registered once per process).
+        """
+        if not ErrorHandler._configured:
+            ErrorHandler.configure(ErrorHandler._json, ErrorHandler._queue_size, ErrorHandler._sample_rate)
+
+        dirpath = os.path.join("reports", "errorlogs")
+        Path(dirpath).mkdir(parents=True, exist_ok=True)
+        extension = "jsonl" if ErrorHandler._json else "log"
+        path = os.path.join(dirpath, f"errorlogs_{model_id}.{extension}")
+
+        with ErrorHandler._lock:
+            ErrorHandler._add_sink(path, lambda: BoundedQueueSink(path=path, maxsize=ErrorHandler._queue_size))
         ErrorHandler._initialized = True
 
     @staticmethod
-    def log(message: str, level: EErrorLevel = EErrorLevel.NONE, exception: Exception = None):
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    def _add_sink(key: str, create_sink):
+        """Register a sink if not already registered (replace it if the logging mode changed)"""
+        if key in ErrorHandler._sinks:
+            handler_id, old_sink, serialize = ErrorHandler._sinks[key]
+            if serialize == ErrorHandler._json:
+                return
+            logger.remove(handler_id)
+            old_sink.stop()
 
+        sink = create_sink()
+        handler_id = logger.add(sink, format=ErrorHandler.TEXT_FORMAT, serialize=ErrorHandler._json, colorize=False)
+        ErrorHandler._sinks[key] = (handler_id, sink, ErrorHandler._json)
+
+    @staticmethod
+    def shutdown():
+        """Flush every queued message (called at exit)"""
+        with ErrorHandler._lock:
+            for handler_id, sink, _ in ErrorHandler._sinks.values():
+                logger.remove(handler_id)
+                sink.stop()
+            ErrorHandler._sinks = {}
+
+    @staticmethod
+    def _patch_record(record):
+        record["extra"].setdefault("request_id", ErrorHandler._request_id.get())
+
+    @staticmethod
+    def dropped_count() -> int:
+        """Number of messages dropped because a sink queue was full"""
+        return sum(sink.dropped for _, sink, _ in ErrorHandler._sinks.values())
+
+    # ===============================================================================================
+    # CORRELATION IDS
+    @staticmethod
+    def set_request_id(request_id: str):
+        """Attach a correlation id to every log emitted in the current context. Returns a token for 'reset_request_id'"""
+        return ErrorHandler._request_id.set(request_id)
+
+    @staticmethod
+    def reset_request_id(token):
+        ErrorHandler._request_id.reset(token)
+
+    @staticmethod
+    def get_request_id() -> str:
+        return ErrorHandler._request_id.get()
+
+    # ===============================================================================================
+    # LOGGING
+    @staticmethod
+    def log(message: str, level: EErrorLevel = EErrorLevel.NONE, exception: Exception = None, **fields):
         if level == EErrorLevel.NONE:
-            logger.info(f"[{timestamp}] {message}")
+            logger.bind(**fields).info(message)
         elif level == EErrorLevel.WARNING:
-            logger.warning(f"[{timestamp}] {message}")
+            logger.bind(**fields).warning(message)
         elif level == EErrorLevel.ERROR:
-            logger.error(f"[{timestamp}] {message} {exception or ''}")
+            logger.bind(**fields).error(f"{message} {exception or ''}")
         elif level == EErrorLevel.FATAL:
-            logger.critical(f"[{timestamp}] {message} {exception or ''}")
+            logger.bind(**fields).critical(f"{message} {exception or ''}")
             raise SystemExit(1)
 
+    @staticmethod
+    def sample(message: str, sample_rate: float = None, **fields):
+        """
+        Log a high-volume event (one per request, one per batch, ...) only for a random
+        proportion of the calls. The sample rate is attached to the record so that counts can be re-scaled.
+
+        Args:
+            message     (str)   : message to log
+            sample_rate (float) : proportion of events kept (default : configured sample rate)
+            **fields            : extra structured fields attached to the record
+        """
+        if sample_rate is None:
+            sample_rate = ErrorHandler._sample_rate
+        if sample_rate < 1.0 and random.random() >= sample_rate:
+            return
+        logger.bind(sample_rate=sample_rate, **fields).info(message)
+
     @staticmethod
     def warning(message: str, exception: Exception = None):
         return ErrorHandler.log(message, EErrorLevel.WARNING, exception)
-    
+
     @staticmethod
     def error(message: str, exception: Exception = None):
         return ErrorHandler.log(message, EErrorLevel.ERROR, exception)
-    
+
     @staticmethod
     def fatal(message: str, exception: Exception = None):
-        return ErrorHandler.log(message, EErrorLevel.FATAL, exception)
\ No newline at end of file
+        return ErrorHandler.log(message, EErrorLevel.FATAL, exception)
@@ -1,5 +1,6 @@
 import os
 import json
+import shutil
 import yaml
 from pathlib import Path
 from typing import Union
@@ -10,18 +11,40 @@ import torch
 # -- internal
 from src.utils.ErrorHandler import ErrorHandler
 from src.utils.enums import EModelType
+from src.models.student import StudentClassifier
+from src.models.early_exit import EarlyExitHeads
+from src.models.mmap_weights import load_sequence_classifier_mmap
 
 
 class FileManager:
     # -- reports
     REPORTS_DIR:                str = "reports"
     LIME_HTML_FILE:             str = "lime_explanation.html"
+    EXPLAIN_FIDELITY_FILE:      str = "explain_fidelity.json"
     ATTENTION_HTML_FILE:        str = "attention.html"
+    ATTENTION_DIR:              str = "attention"
+    ATTENTION_SCORES_FILE:      str = "attention_scores.npz"
+    MAX_LENGTH_PROFILE_FILE:    str = "max_length_profile.json"
+    METRICS_FILE:               str = "metrics.json"
+    COMPILED_BENCHMARK_FILE:    str = "compiled_benchmark.json"
     # -- results
     RESULTS_DIR:                str = "results"
+    PREDICTIONS_DIR:            str = "predictions"
     # -- artifacts 
     ARTIFACTS_DIR:              str = "artifacts"
     TRAINING_OUTPUT_DIR:        str = "training_output"
+    STUDENT_WEIGHTS_FILE:       str = "student.pt"
+    STUDENT_CONFIG_FILE:        str = "student_config.json"
+    EARLY_EXIT_HEADS_FILE:      str = "early_exit_heads.pt"
+    EARLY_EXIT_CONFIG_FILE:     str = "early_exit_config.json"
+    METADATA_FILE:              str = "metadata.json"
+    EMBEDDINGS_DIR:             str = "embeddings"
+    DEDUP_DIR:                  str = "dedup"
+    FEEDBACK_DIR:               str = "feedback"
+    FEEDBACK_FILE:              str = "feedback.jsonl"
+    # -- scoring worker
+    SPOOL_DIR:                  str = "spool"
+    JOBS_DB_FILE:               str = "jobs.sqlite"
     # -- configs
     CONFIGS_DIR :               str = "configs"
     # -- default values
@@ -202,16 +225,89 @@ class FileManager:
         elif model_type == EModelType.LORA:
             model, _ = FileManager.load_lora(model_id)
             return model
+        elif model_type == EModelType.STUDENT:
+            model, _ = FileManager.load_student(model_id)
+            return model
         else:
             ErrorHandler.fatal("Unhandled case : " + model_type)
       
     @staticmethod
-    def load_lora(model_id: str, allow_gpu: bool = True):
+    def load_tokenizer(model_type: EModelType, model_id: str, model_path: str = ""):
         """
-        Load a lora model from its id (+ the tokenizer) already setup from configs
+        Load the tokenizer of a model. Its 'model_max_length' is set to the inference max length stored in the
+        model metadata, so that every 'tokenizer(..., truncation=True)' call applies it.
         
         Args:
+            model_type (EModelType) : type of model (lora, student, ...)
             model_id (str)          : special unique identifier for the model.
+            model_path (str)        : path of the model (default: found from type and id)
+
+        Returns:
+            tokenizer
+        """
+        if not model_path:
+            model_path = FileManager.get_model_path(model_type=model_type, model_id=model_id, must_exist=True);
+        tokenizer = AutoTokenizer.from_pretrained(model_path)
+        
+        max_length = FileManager.get_inference_max_length(model_type, model_id)
+        if max_length:
+            tokenizer.model_max_length = max_length
+        return tokenizer
+
+    @staticmethod
+    def read_model_metadata(model_type: EModelType, model_id: str) -> dict:
+        """
+        Read the metadata of a model artifact (training / inference settings)
+        
+        Returns:
+            dict : metadata (empty if the model has none)
+        """
+        path = os.path.join(FileManager.get_model_path(model_type=model_type, model_id=model_id, must_exist=True), FileManager.METADATA_FILE)
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    @staticmethod
+    def update_model_metadata(model_type: EModelType, model_id: str, **values):
+        """
+        Add / update values in the metadata of a model artifact
+        
+        Args:
+            model_type (EModelType) : type of model (lora, student, ...)
+            model_id (str)          : special unique identifier for the model.
+            **values                : values to store
+        """
+        metadata = FileManager.read_model_metadata(model_type, model_id)
+        metadata.update(values)
+        path = os.path.join(FileManager.get_model_path(model_type=model_type, model_id=model_id, must_exist=True), FileManager.METADATA_FILE)
+        FileManager.write_json(path, metadata)
+
+    @staticmethod
+    def get_inference_max_length(model_type: EModelType, model_id: str):
+        """
+        Max number of tokens used at inference : tuned length ('profile_max_length') if any, otherwise the training 
+        length. Older artifacts without metadata use the configured training length ('<model_type>.max_length').
+        """
+        metadata = FileManager.read_model_metadata(model_type, model_id)
+        max_length = metadata.get("inference_max_length") or metadata.get("max_length")
+        if not max_length:
+            max_length = FileManager.load_config().get(model_type.value, {}).get("max_length")
+            ErrorHandler.log(f"No max length in the metadata of {model_type.value} model {model_id} : configured length used ({max_length})")
+        return max_length
+
+    @staticmethod
+    def load_lora(model_id: str, allow_gpu: bool = True, attn_implementation: str = None, mmap_weights: bool = False):
+        """
+        Load a lora model from its id (+ the tokenizer) already setup from configs
+        
+        Args:
+            model_id (str)              : special unique identifier for the model.
+            allow_gpu (bool)            : use the GPU if available
+            attn_implementation (str)   : attention implementation ("eager", "sdpa", ... default: transformers' choice)
+            mmap_weights (bool)         : (CPU only) build the model over the copy-on-write memory-mapped 'model.safetensors'
+                                          instead of copying the weights : near instantaneous load, physical pages
+                                          shared by every process using the same model
 
         Returns:
             model loaded and ready to be used
@@ -220,17 +316,111 @@ class FileManager:
          # get path to the model (fatal error if not existing)
         model_path = FileManager.get_model_path(model_type=EModelType.LORA, model_id=model_id, must_exist=True);
         
-        # load tokenizer and model from the config files
-        tokenizer = AutoTokenizer.from_pretrained(model_path)
-        model = AutoModelForSequenceClassification.from_pretrained(model_path)
+        # load tokenizer (truncating at the inference length of the model) and model from the config files
+        tokenizer = FileManager.load_tokenizer(EModelType.LORA, model_id, model_path)
+        kwargs = {"attn_implementation": attn_implementation} if attn_implementation else {}
+        device = torch.device("cuda" if allow_gpu and torch.cuda.is_available() else "cpu")
+
+        # mapped weights (the model stays on CPU)
+        if mmap_weights and device.type == "cpu":
+            model = load_sequence_classifier_mmap(model_path, **kwargs)
+            if model is not None:
+                return model, tokenizer
+            ErrorHandler.warning(f"Unable to memory-map the weights of model {model_id} : loading a private copy")
+
+        model = AutoModelForSequenceClassification.from_pretrained(model_path, **kwargs)
         
         # setup model to GPU if possible
-        device = torch.device("cuda" if allow_gpu and torch.cuda.is_available() else "cpu")
         model = model.to(device)    # use gpu (if possible) to run the predictions
         model.eval()                # put model in eval mode (small speed boost)
         
         return model, tokenizer
 
+    @staticmethod
+    def load_early_exit(model_id: str, allow_gpu: bool = True):
+        """
+        Load a lora model with its early exit heads (+ the tokenizer)
+        
+        Args:
+            model_id (str)          : special unique identifier for the model.
+
+        Returns:
+            model loaded and ready to be used (eager attention, required to run the layers one by one)
+            tokenizer
+            EarlyExitHeads
+        """
+        model, tokenizer = FileManager.load_lora(model_id, allow_gpu=allow_gpu, attn_implementation="eager")
+        
+        model_path = FileManager.get_model_path(model_type=EModelType.LORA, model_id=model_id, must_exist=True);
+        heads_path = os.path.join(model_path, FileManager.EARLY_EXIT_HEADS_FILE)
+        if not os.path.exists(heads_path):
+            ErrorHandler.fatal(f"No early exit heads found for model id {model_id} (run 'train_early_exit' first)")
+        with open(os.path.join(model_path, FileManager.EARLY_EXIT_CONFIG_FILE), "r", encoding="utf-8") as f:
+            config = json.load(f)
+        heads = EarlyExitHeads(**config)
+        heads.load_state_dict(torch.load(heads_path, map_location="cpu"))
+        heads = heads.to(next(model.parameters()).device)
+        heads.eval()
+        
+        return model, tokenizer, heads
+
+    @staticmethod
+    def save_early_exit_heads(heads: EarlyExitHeads, model_id: str):
+        """
+        Save the early exit heads next to the lora model they were trained on
+        
+        Args:
+            heads (EarlyExitHeads)  : trained heads
+            model_id (str)          : special unique identifier for the model.
+        """
+        model_path = FileManager.get_model_path(model_type=EModelType.LORA, model_id=model_id, must_exist=True);
+        torch.save(heads.state_dict(), os.path.join(model_path, FileManager.EARLY_EXIT_HEADS_FILE))
+        FileManager.write_json(os.path.join(model_path, FileManager.EARLY_EXIT_CONFIG_FILE), heads.config)
+
+    @staticmethod
+    def load_student(model_id: str, allow_gpu: bool = True):
+        """
+        Load a distilled student model from its id (+ the tokenizer of its teacher)
+        
+        Args:
+            model_id (str)          : special unique identifier for the model.
+
+        Returns:
+            model loaded and ready to be used
+            tokenizer
+        """
+        # get path to the model (fatal error if not existing)
+        model_path = FileManager.get_model_path(model_type=EModelType.STUDENT, model_id=model_id, must_exist=True);
+        
+        # load tokenizer, architecture and weights
+        tokenizer = FileManager.load_tokenizer(EModelType.STUDENT, model_id, model_path)
+        with open(os.path.join(model_path, FileManager.STUDENT_CONFIG_FILE), "r", encoding="utf-8") as f:
+            config = json.load(f)
+        model = StudentClassifier(**config)
+        model.load_state_dict(torch.load(os.path.join(model_path, FileManager.STUDENT_WEIGHTS_FILE), map_location="cpu"))
+        
+        # setup model to GPU if possible
+        device = torch.device("cuda" if allow_gpu and torch.cuda.is_available() else "cpu")
+        model = model.to(device)
+        model.eval()
+        
+        return model, tokenizer
+
+    @staticmethod
+    def save_student(model: StudentClassifier, tokenizer, model_path: str):
+        """
+        Save a distilled student model (weights + architecture config) and its tokenizer
+        
+        Args:
+            model (StudentClassifier)   : trained student
+            tokenizer                   : tokenizer used by the student (the teacher's one)
+            model_path (str)            : directory of the artifact
+        """
+        FileManager.ensure_dir(model_path)
+        torch.save(model.state_dict(), os.path.join(model_path, FileManager.STUDENT_WEIGHTS_FILE))
+        FileManager.write_json(os.path.join(model_path, FileManager.STUDENT_CONFIG_FILE), model.config)
+        tokenizer.save_pretrained(model_path)
+
     @staticmethod
     def get_models_save_dirpath(model_type: EModelType):
         """ 
@@ -244,6 +434,78 @@ class FileManager:
         """
         return os.path.join(FileManager.get_root(), FileManager.ARTIFACTS_DIR, str(model_type.value))
         
+    @staticmethod
+    def get_dedup_index_path(name: str):
+        """ 
+        Get path to a persisted near-duplicate (MinHash / LSH) signature index
+        
+        Args:
+            name (str) : name of the index (ex: "imdb")
+
+        Returns:
+            str: path to the index file (artifacts/dedup/<name>.npz)
+        """
+        dirpath = os.path.join(FileManager.get_root(), FileManager.ARTIFACTS_DIR, FileManager.DEDUP_DIR)
+        FileManager.ensure_dir(dirpath)
+        return os.path.join(dirpath, f"{name}.npz")
+
+    @staticmethod
+    def get_embedding_index_dir(model_id: str, name: str, must_exist: bool = False):
+        """ 
+        Get path to the directory of a similarity index built with the embeddings of a lora model
+        
+        Args:
+            model_id (str)      : id of the lora model computing the embeddings
+            name (str)          : name of the index (ex: "imdb")
+            must_exist (bool)   : throw an error if the index is not found
+
+        Returns:
+            str: path to the directory (artifacts/lora/model_<id>/embeddings/<name>)
+        """
+        model_path = FileManager.get_model_path(EModelType.LORA, model_id=model_id, must_exist=True)
+        path = os.path.join(model_path, FileManager.EMBEDDINGS_DIR, name)
+        if must_exist and not os.path.exists(path):
+            ErrorHandler.fatal(f"No similarity index '{name}' for model id {model_id} (run 'build_index' first)")
+        FileManager.ensure_dir(path)
+        return path
+
+    @staticmethod
+    def get_feedback_file():
+        """ 
+        Get path to the append-only log of labeled feedback (artifacts/feedback/feedback.jsonl)
+        """
+        dirpath = os.path.join(FileManager.get_root(), FileManager.ARTIFACTS_DIR, FileManager.FEEDBACK_DIR)
+        FileManager.ensure_dir(dirpath)
+        return os.path.join(dirpath, FileManager.FEEDBACK_FILE)
+
+    @staticmethod
+    def get_spool_dir(name: str = ""):
+        """ 
+        Get path to the spool directory of the scoring worker, or one of its sub-directories (spool/<name>)
+        """
+        dirpath = os.path.join(FileManager.get_root(), FileManager.SPOOL_DIR, name)
+        FileManager.ensure_dir(dirpath)
+        return dirpath
+
+    @staticmethod
+    def publish_baseline(model, model_id: str = ""):
+        """ 
+        Save a baseline model atomically : written to a temporary file then renamed, so that readers (the API
+        looking for the latest baseline) never see a partially written artifact
+        
+        Args:
+            model               : scikit-learn pipeline
+            model_id (str)      : special unique identifier for the model.
+
+        Returns:
+            str: path to the published model
+        """
+        path = FileManager.get_model_path(EModelType.BASELINE, model_id=model_id)
+        tmp_path = os.path.join(os.path.dirname(path), f".tmp_{os.path.basename(path)}")
+        joblib.dump(model, tmp_path)
+        os.replace(tmp_path, path)
+        return path
+
     @staticmethod
     def get_training_output_dirpath(model_type: EModelType, model_name: str = "", model_id: str = ""):
         """ 
@@ -257,10 +519,53 @@ class FileManager:
         Returns:
             str: path to the created directory
         """
-        path = os.path.join(FileManager.get_models_save_dirpath(model_type), FileManager.TRAINING_OUTPUT_DIR, f"{model_name}_{FileManager.get_model_id()}")
+        if model_id == "":
+            model_id = FileManager.get_model_id()
+        path = os.path.join(FileManager.get_models_save_dirpath(model_type), FileManager.TRAINING_OUTPUT_DIR, f"{model_name}_{model_id}")
         FileManager.ensure_dir(path)
         return path;
 
+    @staticmethod
+    def get_last_checkpoint(model_type: EModelType, model_name: str = "", model_id: str = ""):
+        """ 
+        Find the most recent training checkpoint ("checkpoint-<step>" directory) of a specific model
+        
+        Args:
+            model_type (EModelType) : type of model (lora, baseline, ...)
+            model_name (str)        : special name for the model (act like an extra identifier)
+            model_id (str)          : special unique identifier for the model.
+
+        Returns:
+            str: path to the checkpoint directory, or "" if none exists
+        """
+        dirpath = FileManager.get_training_output_dirpath(model_type, model_name=model_name, model_id=model_id)
+        checkpoints = [p for p in Path(dirpath).glob("checkpoint-*") if p.is_dir() and p.name.split("-")[-1].isdigit()]
+        if not checkpoints:
+            return ""
+        return str(max(checkpoints, key=lambda p: int(p.name.split("-")[-1])))
+
+    @staticmethod
+    def prune_training_outputs(model_type: EModelType, keep: int, model_id: str = ""):
+        """ 
+        Delete the training outputs (checkpoints, logs) of the oldest runs, only the 'keep' most recent are kept.
+        
+        Args:
+            model_type (EModelType) : type of model (lora, baseline, ...)
+            keep (int)              : number of runs to keep (the run 'model_id' is always kept)
+            model_id (str)          : id of the current run (default: model id of the context)
+        """
+        if model_id == "":
+            model_id = FileManager.get_model_id()
+        dirpath = Path(FileManager.get_models_save_dirpath(model_type), FileManager.TRAINING_OUTPUT_DIR)
+        if not dirpath.exists():
+            return
+        
+        runs = [p for p in dirpath.iterdir() if p.is_dir() and not p.name.endswith(f"_{model_id}")]
+        runs.sort(key=lambda p: p.stat().st_mtime, reverse=True)
+        for run in runs[max(keep - 1, 0):]:
+            ErrorHandler.log(f"Deleting old training outputs : {run}")
+            shutil.rmtree(run, ignore_errors=True)
+
     @staticmethod
     def get_model_path(model_type: EModelType, model_name: str = "", model_id: str = "", must_exist: bool = False):
         """
@@ -286,7 +591,7 @@ class FileManager:
         FileManager.ensure_dir(dirpath)
         if model_type == EModelType.BASELINE:
             path = os.path.join(dirpath, f"{model_name}_{model_id}.joblib");  
-        elif model_type == EModelType.LORA:
+        elif model_type in (EModelType.LORA, EModelType.STUDENT):
             path = os.path.join(dirpath, f"{model_name}_{model_id}")
             if not must_exist:
                 FileManager.ensure_dir(path)
@@ -317,7 +622,7 @@ class FileManager:
         dirpath = FileManager.get_models_save_dirpath(model_type);
         if model_type == EModelType.BASELINE:
             path = os.path.join(dirpath, f"{model_name}_{model_id}.joblib");  
-        elif model_type == EModelType.LORA:
+        elif model_type in (EModelType.LORA, EModelType.STUDENT):
             path = os.path.join(dirpath, f"{model_name}_{model_id}")
         else:
             ErrorHandler.error("Unhandled case : " + model_type)
@@ -325,6 +630,24 @@ class FileManager:
         
         return os.path.exists(path)
 
+    @staticmethod
+    def get_weights_mtime(path: Union[str, Path]) -> float:
+        """
+        Modification time of the weights of a saved model : the file itself (baseline) or the weight files of a
+        model directory (lora, student), the directory mtime if it holds none
+
+        Args:
+            path (str | Path) : path to the saved model (file or directory)
+
+        Returns:
+            float: modification time of the weights
+        """
+        path = Path(path)
+        if not path.is_dir():
+            return path.stat().st_mtime
+        weights = [p for p in path.iterdir() if p.is_file() and (p.suffix in (".safetensors", ".bin") or p.name == FileManager.STUDENT_WEIGHTS_FILE)]
+        return max((p.stat().st_mtime for p in weights), default=path.stat().st_mtime)
+
     @staticmethod
     def get_last_model_id(model_type: EModelType, model_name: str = "") -> str:
         """
@@ -349,8 +672,9 @@ class FileManager:
         if not items:
             return ""
 
-        # sort by modification time, descending
-        items.sort(key=lambda f: f.stat().st_mtime, reverse=True)
+        # sort by modification time of the weights, descending (the directory mtime changes whenever metadata,
+        # early exit heads or embedding indexes are added to an existing model)
+        items.sort(key=FileManager.get_weights_mtime, reverse=True)
         last_item = items[0]
 
         # extract the model_id from filename (after last "_")
@@ -383,6 +707,28 @@ class FileManager:
         FileManager.ensure_file(path)
         return path;
 
+    @staticmethod
+    def get_predictions_file(model_type: EModelType, dataset_hash: str, model_id: str = "", variant: str = ""):
+        """
+        Get path to the persisted per-item probabilities of a model on a dataset
+
+        Args:
+            model_type (EModelType) : type of model (lora, baseline, ...)
+            dataset_hash (str)      : hash of the evaluated data (see src.prediction.metrics.dataset_hash)
+            model_id (str)          : special unique identifier for the model.
+            variant (str)           : inference settings changing the probabilities (see src.prediction.metrics.inference_variant)
+
+        Returns:
+            str: path to the file (results/predictions/predictions_<type>_<id>_<hash>[_<variant>].npz)
+        """
+        if model_id == "":
+            model_id = FileManager.get_model_id()
+        
+        dirpath = os.path.join(FileManager.get_root(), FileManager.RESULTS_DIR, FileManager.PREDICTIONS_DIR)
+        FileManager.ensure_dir(dirpath)
+        suffix = f"_{variant}" if variant else ""
+        return os.path.join(dirpath, f"predictions_{model_type.value}_{model_id}_{dataset_hash}{suffix}.npz")
+
     # ===============================================================================================
     # REPORTS
     @staticmethod
@@ -8,4 +8,5 @@ class EErrorLevel(Enum):
 
 class EModelType(Enum):
     BASELINE    = "baseline"
-    LORA        = "lora"
\ No newline at end of file
+    LORA        = "lora"
+    STUDENT     = "student"
\ No newline at end of file
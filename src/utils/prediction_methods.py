@@ -1,38 +1,89 @@
-﻿from sklearn.feature_extraction.text import TfidfVectorizer
+﻿from sklearn.feature_extraction.text import TfidfVectorizer, HashingVectorizer
 import torch
 import numpy as np
 # -- internal
 from src.utils.FileManager import FileManager
 from src.utils.ErrorHandler import ErrorHandler
 from src.utils.enums import EModelType
+from src.models.early_exit import forward_early_exit, forward_all_exits
+from src.models.compiled import CompiledClassifier
+
+
+def compile_lora(model, tokenizer, batch_size: int=32):
+    """
+    Wrap a lora model for static-shape compiled inference (buckets and backend from configs 'compiled') and warm up
+    every bucket. Length buckets stop at the inference max length of the tokenizer.
+
+    Returns:
+        CompiledClassifier
+    """
+    cfg_compiled = FileManager.load_config()["compiled"]
+    length_buckets = [l for l in cfg_compiled["length_buckets"] if l < tokenizer.model_max_length] + [tokenizer.model_max_length]
+    batch_buckets = sorted({b for b in cfg_compiled["batch_buckets"] if b < batch_size} | {batch_size})
+    
+    compiled = CompiledClassifier(model, length_buckets=length_buckets, batch_buckets=batch_buckets,
+                                  pad_token_id=tokenizer.pad_token_id or 0, backend=cfg_compiled["backend"])
+    elapsed = compiled.warmup()
+    ErrorHandler.log(f"Compiled inference ({cfg_compiled['backend']}) : length buckets {length_buckets}, batch buckets {batch_buckets}, warm-up {elapsed:.1f}s")
+    return compiled
+
+
+def load_compiled_lora(model_id: str, batch_size: int=32, allow_gpu: bool=True):
+    """
+    Load a lora model wrapped for static-shape compiled inference (see 'compile_lora')
+
+    Returns:
+        CompiledClassifier
+        tokenizer
+    """
+    model, tokenizer = FileManager.load_lora(model_id, allow_gpu=allow_gpu)
+    return compile_lora(model, tokenizer, batch_size=batch_size), tokenizer
 
 
 def build_vectorizer(max_features=20000, ngram_range=(1,2)):
     return TfidfVectorizer(max_features=max_features, ngram_range=ngram_range, lowercase=True, strip_accents='unicode')
 
 
-def delegate_predict_fn(model_type: EModelType, model_id: str, batch_size: int=32):
+def build_hashing_vectorizer(n_features=2**20, ngram_range=(1,2)):
+    """Stateless vectorizer (fixed feature space, nothing to refit) used by the incrementally updated baseline"""
+    return HashingVectorizer(n_features=n_features, ngram_range=ngram_range, lowercase=True, strip_accents='unicode', alternate_sign=False)
+
+
+def delegate_predict_fn(model_type: EModelType, model_id: str, batch_size: int=32, early_exit_threshold: float=None, compiled: bool=False):
     """
     Create a delegated batch prediction method that can be provided to itterate predictions on a list of data
     The delegate methods expects args :
         texts (list[str] | pd.Series):      Input texts
         
     Args:
-        model_type  (EModelType)    : type of the model used for the prediction
-        model_id    (str)           : id of the model used for the prediction
-        batch_size  (int)           : size of prediction batch
+        model_type  (EModelType)        : type of the model used for the prediction
+        model_id    (str)               : id of the model used for the prediction
+        batch_size  (int)               : size of prediction batch
+        early_exit_threshold (float)    : (lora only) use the early exit heads with this confidence threshold
+        compiled (bool)                 : (lora only) static-shape compiled inference (see 'load_compiled_lora')
         
     Returns:
         function(str|List[str])
     """
-    model = FileManager.load_model(model_type, model_id=model_id);
-    
     if model_type == EModelType.BASELINE:
+        model = FileManager.load_model(model_type, model_id=model_id);
         return lambda _text: predict_proba_baseline(model, _text, batch_size=batch_size)
     
+    elif model_type == EModelType.LORA and early_exit_threshold is not None:
+        model, tokenizer, heads = FileManager.load_early_exit(model_id)
+        return lambda _text: predict_proba_lora_early_exit(model, heads, tokenizer, _text, batch_size=batch_size, threshold=early_exit_threshold)
+    
+    elif model_type == EModelType.LORA and compiled:
+        compiled_model, tokenizer = load_compiled_lora(model_id, batch_size=batch_size)
+        return lambda _text: compiled_model.predict_proba(tokenizer, _text)
+    
     elif model_type == EModelType.LORA:
-        _, tokenizer = FileManager.load_lora(model_id)
+        model, tokenizer = FileManager.load_lora(model_id)
         return lambda _text: predict_proba_lora(model, tokenizer, _text, batch_size=batch_size)
+    
+    elif model_type == EModelType.STUDENT:
+        model, tokenizer = FileManager.load_student(model_id)
+        return lambda _text: predict_proba_student(model, tokenizer, _text, batch_size=batch_size)
 
     ErrorHandler.error("Unhandled case : " + model_type)
 
@@ -80,9 +131,8 @@ def predict_proba_lora(model, tokenizer, texts, batch_size: int=32):
     if isinstance(texts, str):
         texts = [texts]
 
-    # check the device used (cuda if possible otherwise cpu)
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model = model.to(device)
+    # device of the model (placed once, at loading)
+    device = next(model.parameters()).device
 
     # batch prediction
     probs = []
@@ -93,4 +143,282 @@ def predict_proba_lora(model, tokenizer, texts, batch_size: int=32):
             logits = model(**inputs).logits
             batch_probs = torch.softmax(logits, dim=-1).cpu().numpy() 
             probs.extend(batch_probs)
-    return np.array(probs)  # shape (n_samples, n_classes)
\ No newline at end of file
+    return np.array(probs)  # shape (n_samples, n_classes)
+
+def embed_lora(model, tokenizer, texts, batch_size: int=32, normalize: bool=True):
+    """
+    Compute the pooled representation of texts with a Hugging Face DistilBERT classifier : the pre-classifier
+    vector (ReLU(pre_classifier([CLS]))) that the classification head uses.
+
+    Args:
+        model:                      A Hugging Face DistilBERT `AutoModelForSequenceClassification`.
+        tokenizer:                  A Hugging Face tokenizer compatible with the model.
+        texts (str | list[str]):    Input texts
+        batch_size  (int) :         size of prediction batch
+        normalize (bool) :          L2 normalize the vectors (dot product = cosine similarity)
+
+    Returns:
+        np.ndarray: Array of shape (n_samples, dim) float32 embeddings.
+    """
+    if isinstance(texts, str):
+        texts = [texts]
+
+    device = next(model.parameters()).device
+    embeddings = []
+    for i in range(0, len(texts), batch_size):
+        batch_texts = texts[i:i+batch_size]
+        inputs = tokenizer(batch_texts, padding=True, truncation=True, return_tensors="pt").to(device)
+        with torch.no_grad():
+            hidden = model.distilbert(input_ids=inputs["input_ids"], attention_mask=inputs["attention_mask"])[0]
+            pooled = torch.relu(model.pre_classifier(hidden[:, 0]))
+            if normalize:
+                pooled = torch.nn.functional.normalize(pooled, dim=-1)
+            embeddings.append(pooled.float().cpu().numpy())
+    return np.concatenate(embeddings) if embeddings else np.empty((0, model.config.dim), dtype=np.float32)
+
+
+def occlusion_probs(model, input_ids, attention_mask, hidden_positions: list, batch_size: int=64):
+    """
+    Probabilities of a sequence with groups of tokens hidden from the attention, one row per group.
+    Every row shares the same token ids and only the attention mask changes.
+    """
+    masks = attention_mask.repeat(len(hidden_positions), 1)
+    for i, positions in enumerate(hidden_positions):
+        masks[i, positions] = 0
+    probs = []
+    with torch.no_grad():
+        for i in range(0, len(masks), batch_size):
+            batch_masks = masks[i:i+batch_size]
+            logits = model(input_ids=input_ids.expand(len(batch_masks), -1), attention_mask=batch_masks).logits
+            probs.append(torch.softmax(logits.float(), dim=-1).cpu().numpy())
+    return np.concatenate(probs)
+
+
+def explain_lora_occlusion(model, tokenizer, text: str, max_variants: int=32, batch_size: int=64, target: int=1):
+    """
+    Word importances of a Hugging Face classifier prediction by occlusion. Each word is hidden from the model by
+    masking its tokens out of the attention, and all occurrences of a word are hidden together, like LIME.
+    A word's importance is the drop of the probability of 'target' when it is hidden.
+    
+    The cost is one full-length sequence per occluded variant, and the number of variants is capped :
+        - reviews with at most 'max_variants' distinct words : one variant per word, one pass
+        - longer reviews : the words are coalesced into 'max_variants / 2' spans of consecutive distinct words
+          (first pass), then the most important spans are refined word by word within the remaining budget
+          (second pass). The words of the other spans share the importance of their span.
+
+    Args:
+        model:                      A Hugging Face `AutoModelForSequenceClassification`.
+        tokenizer:                  A Hugging Face fast tokenizer compatible with the model.
+        text (str):                 Input text
+        max_variants (int) :        max number of occluded variants per pass
+        batch_size  (int) :         max number of variants per forward pass
+        target (int) :              class explained
+
+    Returns:
+        np.ndarray: probabilities of the full text, shape (n_classes,)
+        list[tuple[str, float]]: (word, importance) sorted by decreasing absolute importance
+    """
+    device = next(model.parameters()).device
+    encoded = tokenizer(text, truncation=True, return_offsets_mapping=True, return_tensors="pt")
+    offsets = encoded["offset_mapping"][0].tolist()
+
+    # token positions of each (lowercased) word, punctuation ignored
+    positions = {}
+    for pos, word_id in enumerate(encoded.word_ids(0)):
+        if word_id is not None:
+            positions.setdefault(word_id, []).append(pos)
+    groups = {}
+    for word_positions in positions.values():
+        word = text[offsets[word_positions[0]][0]:offsets[word_positions[-1]][1]].lower()
+        if any(c.isalnum() for c in word):
+            groups.setdefault(word, []).extend(word_positions)
+    words = list(groups)
+
+    input_ids = encoded["input_ids"].to(device)
+    attention_mask = encoded["attention_mask"].to(device)
+
+    # short review : every word occluded in a single pass (row 0 : full text)
+    if len(words) <= max_variants:
+        probs = occlusion_probs(model, input_ids, attention_mask, [[]] + [groups[w] for w in words], batch_size)
+        importances = probs[0, target] - probs[1:, target]
+    else:
+        # first pass : spans of consecutive distinct words
+        spans = np.array_split(np.arange(len(words)), max(1, max_variants // 2))
+        probs = occlusion_probs(model, input_ids, attention_mask, [[]] + [[p for i in span for p in groups[words[i]]] for span in spans], batch_size)
+        span_importances = probs[0, target] - probs[1:, target]
+        importances = np.empty(len(words))
+        for span, weight in zip(spans, span_importances):
+            importances[span] = weight / len(span)
+
+        # second pass : the most important spans, word by word
+        refined, budget = [], max_variants - len(spans)
+        for j in np.argsort(-np.abs(span_importances), kind="stable"):
+            if len(spans[j]) > budget:
+                break
+            refined.extend(spans[j].tolist())
+            budget -= len(spans[j])
+        if refined:
+            refined_probs = occlusion_probs(model, input_ids, attention_mask, [groups[words[i]] for i in refined], batch_size)
+            importances[refined] = probs[0, target] - refined_probs[:, target]
+
+    order = np.argsort(-np.abs(importances), kind="stable")
+    return probs[0], [(words[i], float(importances[i])) for i in order]
+
+
+def predict_proba_student(model, tokenizer, texts, batch_size: int=32):
+    """
+    Compute prediction probabilities using a distilled student model.
+
+    Args:
+        model:                      A `StudentClassifier`
+        tokenizer:                  The tokenizer of the student (the one of its teacher)
+        texts (str | list[str]):    Input texts
+        batch_size  (int) :         size of prediction batch
+
+    Returns:
+        np.ndarray: Array of shape (n_samples, n_classes) with predicted probabilities.
+    """
+    # simple string -> convert into list of strings
+    if isinstance(texts, str):
+        texts = [texts]
+
+    device = next(model.parameters()).device
+
+    # batch prediction
+    probs = []
+    for i in range(0, len(texts), batch_size):
+        batch_texts = texts[i:i+batch_size]
+        inputs = tokenizer(batch_texts, padding=True, truncation=True, return_tensors="pt").to(device)
+        with torch.no_grad():
+            logits = model(input_ids=inputs["input_ids"], attention_mask=inputs["attention_mask"])
+            batch_probs = torch.softmax(logits, dim=-1).cpu().numpy()
+            probs.extend(batch_probs)
+    return np.array(probs)  # shape (n_samples, n_classes)
+
+
+def truncate_input_ids(ids: torch.Tensor, max_length: int):
+    """Truncate token ids at the inference max length of the model, keeping the last ([SEP]) token like the tokenizer does"""
+    if ids.numel() <= max_length:
+        return ids
+    return torch.cat((ids[:max_length - 1], ids[-1:]))
+
+
+def predict_proba_lora_ids(model, input_ids, batch_size: int=32, pad_token_id: int=0):
+    """
+    Compute prediction probabilities using a Hugging Face LoRA fine-tuned model on already tokenized inputs.
+    Sequences are used as provided (no re-tokenization) : a single sequence is fed as is, batches are 
+    padded with 'pad_token_id' and masked.
+
+    Args:
+        model:                              A Hugging Face `AutoModelForSequenceClassification` with LoRA weights
+                                            (or a `StudentClassifier`, which shares its tokenizer).
+        input_ids (list[torch.Tensor]):     1D integer tensors of token ids (one per text)
+        batch_size  (int) :                 size of prediction batch
+        pad_token_id (int):                 id used to pad the sequences of a batch
+
+    Returns:
+        np.ndarray: Array of shape (n_samples, n_classes) with predicted probabilities.
+    """
+    device = next(model.parameters()).device
+    
+    probs = []
+    for i in range(0, len(input_ids), batch_size):
+        batch_ids = input_ids[i:i+batch_size]
+        lengths = torch.tensor([len(ids) for ids in batch_ids])
+        
+        # single sequence : no padding required, use the tensor directly
+        if len(batch_ids) == 1:
+            ids = batch_ids[0].unsqueeze(0)
+        else:
+            ids = torch.full((len(batch_ids), int(lengths.max())), pad_token_id, dtype=batch_ids[0].dtype)
+            for j, seq in enumerate(batch_ids):
+                ids[j, :len(seq)] = seq
+        mask = (torch.arange(ids.size(1)).unsqueeze(0) < lengths.unsqueeze(1)).long()
+        
+        with torch.no_grad():
+            out = model(input_ids=ids.to(device), attention_mask=mask.to(device))
+            logits = out.logits if hasattr(out, "logits") else out
+            batch_probs = torch.softmax(logits, dim=-1).cpu().numpy()
+            probs.extend(batch_probs)
+    return np.array(probs)  # shape (n_samples, n_classes)
+
+
+def predict_proba_lora_early_exit(model, heads, tokenizer, texts, batch_size: int=32, threshold: float=0.95, return_layers: bool=False):
+    """
+    Compute prediction probabilities using a LoRA model with early exit heads : each text stops at the first
+    intermediate layer whose prediction confidence reaches 'threshold'.
+
+    Args:
+        model:                      A Hugging Face DistilBERT `AutoModelForSequenceClassification` (eager attention).
+        heads:                      `EarlyExitHeads` trained on this model.
+        tokenizer:                  A Hugging Face tokenizer compatible with the model.
+        texts (str | list[str]):    Input texts
+        batch_size  (int) :         size of prediction batch
+        threshold (float) :         min confidence (max probability) required to exit
+        return_layers (bool):       also return the number of layers used by each text
+
+    Returns:
+        np.ndarray: Array of shape (n_samples, n_classes) with predicted probabilities.
+        np.ndarray: (if return_layers) Array of shape (n_samples,) with the number of layers used.
+    """
+    # simple string -> convert into list of strings
+    if isinstance(texts, str):
+        texts = [texts]
+
+    device = next(model.parameters()).device
+
+    # batch prediction
+    probs, layers = [], []
+    for i in range(0, len(texts), batch_size):
+        batch_texts = texts[i:i+batch_size]
+        inputs = tokenizer(batch_texts, padding=True, truncation=True, return_tensors="pt").to(device)
+        with torch.no_grad():
+            batch_probs, batch_layers = forward_early_exit(model, heads, inputs["input_ids"], inputs["attention_mask"], threshold)
+            probs.extend(batch_probs.cpu().numpy())
+            layers.extend(batch_layers.cpu().numpy())
+    if return_layers:
+        return np.array(probs), np.array(layers)
+    return np.array(probs)  # shape (n_samples, n_classes)
+
+
+def predict_proba_all_exits(model, heads, tokenizer, texts, batch_size: int=32):
+    """
+    Compute the prediction probabilities of every exit (intermediate heads + final classifier) in a single pass,
+    so that any exit threshold can be simulated without re-running the model.
+
+    Returns:
+        list[int]:  layer of each exit
+        np.ndarray: Array of shape (n_exits, n_samples, n_classes) with predicted probabilities.
+    """
+    if isinstance(texts, str):
+        texts = [texts]
+
+    device = next(model.parameters()).device
+    exit_layers, probs = None, []
+    for i in range(0, len(texts), batch_size):
+        batch_texts = texts[i:i+batch_size]
+        inputs = tokenizer(batch_texts, padding=True, truncation=True, return_tensors="pt").to(device)
+        with torch.no_grad():
+            exit_layers, batch_probs = forward_all_exits(model, heads, inputs["input_ids"], inputs["attention_mask"])
+            probs.append(batch_probs.cpu().numpy())
+    return exit_layers, np.concatenate(probs, axis=1)
+
+
+def simulate_early_exit(exit_layers, exit_probs, threshold: float):
+    """
+    Compute the predictions an early exit inference would make from the probabilities of every exit.
+
+    Args:
+        exit_layers (list[int]):    layer of each exit (the last one is always taken)
+        exit_probs (np.ndarray):    probabilities of shape (n_exits, n_samples, n_classes)
+        threshold (float):          min confidence required to exit
+
+    Returns:
+        np.ndarray: Array of shape (n_samples, n_classes) with predicted probabilities.
+        np.ndarray: Array of shape (n_samples,) with the number of layers used.
+    """
+    confident = exit_probs.max(axis=-1) >= threshold        # (n_exits, n_samples)
+    confident[-1] = True                                    # final classifier always answers
+    first_exit = confident.argmax(axis=0)                   # index of the first confident exit
+    probs = exit_probs[first_exit, np.arange(exit_probs.shape[1])]
+    return probs, np.asarray(exit_layers)[first_exit]
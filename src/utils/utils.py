@@ -23,6 +23,20 @@ def set_seed(seed):
     if torch.cuda.is_available():
         torch.cuda.manual_seed_all(seed)
 
+def init_logging():
+    """
+    Setup the logging mode (plain text / json, queue size, sampling) from the config file.
+    Only the first call has an effect.
+    """
+    if ErrorHandler.is_configured():
+        return
+    cfg_logging = FileManager.load_config().get("logging", {})
+    ErrorHandler.configure(
+        json_logs   = cfg_logging.get("json", False),
+        queue_size  = cfg_logging.get("queue_size", 10000),
+        sample_rate = cfg_logging.get("sample_rate", 1.0),
+    )
+
 def init_model_id_context(model_type: EModelType, model_id: str, use_last_model_id: bool = False):
     """
     Initialize the context for the model id - if no model_id provided, use the 
@@ -35,5 +49,6 @@ def init_model_id_context(model_type: EModelType, model_id: str, use_last_model_
     if use_last_model_id and not model_id:
         model_id = FileManager.get_last_model_id(model_type)
     
+    init_logging()
     ErrorHandler.init(model_id)
     FileManager.init(model_id)
\ No newline at end of file